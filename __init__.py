@@ -1,5 +1,12 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial, wraps
+from os.path import join
 
+from ovos_bus_client.message import Message, dig_for_message
+from ovos_bus_client.session import SessionManager
+from ovos_config.locations import get_xdg_cache_save_path
 from ovos_utils import classproperty
 from ovos_utils.log import LOG
 from ovos_workshop.intents import IntentBuilder
@@ -8,13 +15,95 @@ from ovos_workshop.decorators import intent_handler
 from ovos_workshop.skills import OVOSSkill
 
 from lingua_franca.format import pronounce_number, nice_date, nice_number
-from lingua_franca.util import fuzzy_match
 
-from tmdbv3api import TMDb, Movie, Person
+from tmdbv3api import TMDb, Movie
+from tmdbv3api.exceptions import TMDbException
+
+from .breaker import TMDbUnavailable
+from .bundle import ResourceBundle
+from .cache import TTLCache
+from .catalog import MovieCatalog
+from .hub import HubClient, HubServer
+from .images import BACKDROP_SIZES, POSTER_SIZES, ImageCache, image_url
+from .lookups import (LookupCancelled, LookupTracker, current_token,
+                      running)
+from .profiling import Profiler
+from .tracing import Tracer, activate, current_span, span
+
+# Seconds between writes of the warm start cache snapshot
+SNAPSHOT_INTERVAL = 15 * 60
+# Seconds between checks if TMDb is back while the circuit breaker is open
+TMDB_PROBE_INTERVAL = 30
+# Threads for background work: lookups of satellites and cache maintenance
+WORKERS = 4
+# Seconds a check if a GUI is connected is trusted, it is a bus round trip
+GUI_CHECK_INTERVAL = 60
+# Threads answering intents, at most this many lookups run at once
+HANDLER_WORKERS = 4
+# Pixels wide a poster or backdrop is shown on a GUI card
+POSTER_WIDTH = 300
+BACKDROP_WIDTH = 720
+MB = 1024 * 1024
+# Seconds "it" in a follow up question still means the last movie asked about
+RECENT_MOVIE_TTL = 10 * 60
+# Watch providers are looked up here when the language names no country
+DEFAULT_PROVIDER_REGION = "US"
+
+
+def lookup_handler(handler):
+    """ Run an intent handler as a lookup on the handler worker pool.
+
+    The bus thread is free again right away and handlers run concurrently,
+    so they must keep what they look up in local variables.
+
+    The lookup belongs to the session it was asked in.  Saying stop, or
+    anything else, in that session cancels it: it stops waiting for TMDb
+    and whatever it would still say is dropped.
+    """
+    def run(self, message, token):
+        with self.lookups.lookup(token.session_id, token), \
+                self.tracer.trace(handler.__name__,
+                                  session=token.session_id,
+                                  utterance=message.data.get("utterance")) \
+                as trace:
+            try:
+                token.check()
+                with self.profiler.profile(handler.__name__):
+                    handler(self, message)
+            except LookupCancelled:
+                LOG.debug(f"{handler.__name__} cancelled")
+                trace.set(error="LookupCancelled")
+            except TMDbUnavailable:
+                trace.set(error="TMDbUnavailable")
+                self.speak_dialog("tmdb.unavailable", {})
+            except Exception as e:
+                # off the bus thread, so the skill's own error path does
+                # not see it: answer and report it the same way
+                LOG.exception(f"{handler.__name__} failed")
+                trace.set(error=type(e).__name__)
+                self.speak_dialog("lookup.error", {})
+                message.context["skill_id"] = self.skill_id
+                self.bus.emit(message.forward(
+                    "mycroft.skill.handler.error",
+                    {"name": f"{self.name}.{handler.__name__}",
+                     "exception": repr(e)}))
+
+    @wraps(handler)
+    def wrapper(self, message):
+        # registered before it is queued, so it is cancelled while it waits
+        token = self.lookups.start(SessionManager.get(message).session_id)
+        try:
+            return self._handler_executor.submit(run, self, message, token)
+        except RuntimeError:
+            # shutting down
+            self.lookups.finish(token)
+    return wrapper
 
 
 class MovieMaster(OVOSSkill):
     def __init__(self, *args, **kwargs):
+        # lang -> precompiled ResourceBundle, needed while intents register
+        self._bundles = {}
         super().__init__(*args, **kwargs)
 
     @classproperty
@@ -35,20 +124,135 @@ class MovieMaster(OVOSSkill):
         DEFAULT_SETTINGS = {
             "apiv3": self.settings.get("apiv3", "8a2e8882b465b1cf7cce9ff6b35bdd7e"),
             "search_depth": self.settings.get("search_depth", 5),
-            "match_confidence": self.settings.get("match_confidence", 0.8)
+            "match_confidence": self.settings.get("match_confidence", 0.8),
+            "prefetch_budget": self.settings.get("prefetch_budget", 60),
+            "shared_cache": self.settings.get(
+                "shared_cache",
+                join(get_xdg_cache_save_path("moviemaster"), "tmdb.sqlite")),
+            "mode": self.settings.get("mode", "standalone"),
+            "hub_timeout": self.settings.get("hub_timeout", 3),
+            "gui_cards": self.settings.get("gui_cards", True),
+            "image_cache_mb": self.settings.get("image_cache_mb", 50),
+            "region": self.settings.get("region", ""),
+            "trace_sample_rate": self.settings.get("trace_sample_rate", 0.1),
+            "trace_slow_seconds": self.settings.get("trace_slow_seconds", 2),
+            "profile_sample_rate": self.settings.get("profile_sample_rate", 0)
         }
         self.settings.merge(DEFAULT_SETTINGS, new_only=False)
 
+        self.catalog = MovieCatalog(on_breaker_change=self._on_tmdb_state)
+        self.lookups = LookupTracker()
+        self.tracer = Tracer(
+            join(self.file_system.path, "traces.jsonl"),
+            float(self.settings.get("trace_sample_rate")),
+            float(self.settings.get("trace_slow_seconds")))
+        self.profiler = Profiler(
+            join(self.file_system.path, "profiles"),
+            float(self.settings.get("profile_sample_rate", 0)))
+        # session id -> MovieRecord last asked about in it
+        self._recent_movies = TTLCache(maxsize=64, ttl=RECENT_MOVIE_TTL)
         self._api_key = self.verify_api(self.settings.get("apiv3"))
         self._search_depth = self.settings.get("search_depth")
         self._match_confidence = self.settings.get("match_confidence")
 
-        self._active_movie = None
-        self._active_person = None
+        self.prefetch_budget = self.settings.get("prefetch_budget")
+        self._snapshot_path = join(self.file_system.path, "cache.snapshot")
+        self.catalog.load_snapshot(self._snapshot_path)
+        self._shared_cache = self.settings.get("shared_cache")
+        if self._shared_cache:
+            self.catalog.open_shared_cache(self._shared_cache)
+        self.schedule_repeating_event(self._save_snapshot, None,
+                                      SNAPSHOT_INTERVAL, name="cache.snapshot")
+        self.schedule_repeating_event(self._probe_tmdb, None,
+                                      TMDB_PROBE_INTERVAL, name="tmdb.probe")
+        self.add_event("ovos.moviemaster.tmdb.state.get",
+                       self.handle_tmdb_state)
+        self.add_event("ovos.moviemaster.profiling.get",
+                       self.handle_profiling)
+        self.add_event("ovos.moviemaster.profiling.set",
+                       self.handle_profiling)
+        self.add_event("ovos.moviemaster.cache.stats",
+                       self.handle_cache_stats)
+        self.add_event("ovos.moviemaster.cache.invalidate",
+                       self.handle_cache_invalidate)
+        self.add_event("ovos.moviemaster.cache.warm",
+                       self.handle_cache_warm)
+        self.add_event("ovos.moviemaster.cache.compact",
+                       self.handle_cache_compact)
+        self.add_event("recognizer_loop:utterance", self.handle_utterance)
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=WORKERS, thread_name_prefix="moviemaster-worker")
+        self._handler_executor = ThreadPoolExecutor(
+            max_workers=HANDLER_WORKERS,
+            thread_name_prefix="moviemaster-handler")
+        # the other half of lookups done in parallel, one thread per handler
+        # thread so a lookup never waits for a free one
+        self._parallel_executor = ThreadPoolExecutor(
+            max_workers=HANDLER_WORKERS,
+            thread_name_prefix="moviemaster-parallel")
+        # GUI cards wait for the GUI and for downloads, on their own thread
+        # so they never hold up a lookup
+        self._gui_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="moviemaster-gui")
+        self._gui_checked = None
+        self._gui_is_connected = False
+        self._mode = None
+        self._hub_server = None
+        self.mode = self.settings.get("mode")
+        self.images = ImageCache(
+            join(self.file_system.path, "images"),
+            int(self.settings.get("image_cache_mb")) * MB)
 
         self.settings_change_callback = self.on_settings_changed
         TMDb().api_key = self.api_key
 
+    def _resource_bundle(self, lang):
+        lang = lang.lower()
+        if lang not in self._bundles:
+            self._bundles[lang] = ResourceBundle.load(
+                join(self.res_dir, "locale", lang))
+        return self._bundles[lang]
+
+    def register_intent_file(self, intent_file, handler, voc_blacklist=None):
+        """ Register an intent with the samples precompiled in the locale
+        bundles, without reading and expanding the .intent files.
+
+        Falls back to the .intent files if a language has no bundle.
+        """
+        bundles = {lang: self._resource_bundle(lang)
+                   for lang in self.native_langs}
+        # blacklists need string_blacklist, only newer ovos_workshop has it
+        if voc_blacklist or not all(b and b.intent(intent_file)
+                                    for b in bundles.values()):
+            return super().register_intent_file(intent_file, handler,
+                                                voc_blacklist)
+        name = f"{self.skill_id}:{intent_file}"
+        for lang, bundle in bundles.items():
+            path = bundle.intent_file(
+                intent_file, join(self.file_system.path, "intents", lang))
+            self.intent_service.register_padatious_intent(name, path, lang)
+        if handler:
+            self.add_event(name, handler, "mycroft.skill.handler",
+                           activation=True, is_intent=True)
+
+    def load_dialog_files(self, root_directory=None):
+        root_directory = root_directory or self.res_dir
+        if root_directory == self.res_dir:
+            for lang in self.native_langs:
+                bundle = self._resource_bundle(lang)
+                if bundle:
+                    self.load_lang(root_directory, lang).dialog_renderer = \
+                        bundle.dialog_renderer()
+        super().load_dialog_files(root_directory)
+
+    def voc_list(self, voc_filename, lang=None):
+        bundle = self._resource_bundle(lang or self.lang)
+        vocab = bundle.vocab(voc_filename) if bundle else None
+        if vocab is None:
+            return super().voc_list(voc_filename, lang)
+        return vocab
+
     @property
     def api_key(self):
         return self._api_key
@@ -74,36 +278,151 @@ class MovieMaster(OVOSSkill):
         if value <= 1.0:
             self._match_confidence = float(value)
 
-    # active_movie and active_person will help with conversational dialog I hope.
     @property
-    def active_movie(self):
-        return self._active_movie
+    def region(self):
+        """ Country the theater listings are for, the region setting or
+        else the country of the skill language."""
+        region = self.settings.get("region") or self.lang.partition("-")[2]
+        return region.upper() or None
+
+    @property
+    def mode(self):
+        return self._mode
 
-    @active_movie.setter
-    def active_movie(self, movie_id):
-        self._active_movie = movie_id
+    @mode.setter
+    def mode(self, value):
+        """ standalone asks TMDb itself, a hub also answers the lookups of
+        satellites, a satellite asks the hub before TMDb."""
+        if value not in ("standalone", "hub", "satellite"):
+            LOG.error(f"Unknown mode {value!r}, using standalone")
+            value = "standalone"
+        if self._hub_server is not None:
+            self._hub_server.shutdown()
+            self._hub_server = None
+        self.catalog.hub = None
+        if value == "hub":
+            self._hub_server = HubServer(self.bus, self.catalog,
+                                         self._executor)
+        elif value == "satellite":
+            self.catalog.hub = HubClient(
+                self.bus, float(self.settings.get("hub_timeout", 3)))
+        self._mode = value
 
     @property
-    def active_person(self):
-        return self._active_person
+    def prefetch_budget(self):
+        return self.catalog.prefetch_budget
 
-    @active_person.setter
-    def active_person(self, person_id):
-        self._active_person = person_id
+    @prefetch_budget.setter
+    def prefetch_budget(self, value):
+        self.catalog.prefetch_budget = max(int(value), 0)
 
     def _search_for_movie(self, movie):
-        for m in Movie().search(movie):
-            if fuzzy_match(m.title, movie) >= self.settings.get("match_confidence"):
-                self.active_movie = m
-                LOG.debug(f"Chosen movie: {self.active_movie.title}")
-                break
+        """ MovieRecord of the requested movie, or None.
+
+        Records are immutable, so concurrent handlers can each hold their
+        own without stepping on each other.
+        """
+        record = self._resolve_movie(movie)
+        if record:
+            token = current_token()
+            if token is not None:
+                self._recent_movies.put(token.session_id, record)
+            # the next question is likely about the same movie
+            self.lookups.track(self.catalog.prefetch(record.id))
+            self._show_movie_card(record)
+        return record
+
+    def _resolve_movie(self, movie):
+        return self.catalog.resolve(movie, self.match_confidence,
+                                    self.voc_list("year.prefix"),
+                                    self.voc_list("year.suffix"))
+
+    def _movie_details(self, movie):
+        """ MovieRecord with the details of the requested movie, or None."""
+        record = self._resolve_movie(movie)
+        return record and self.catalog.movie(record.id)
+
+    def _in_parallel(self, *calls):
+        """ Results of calls made at the same time, as part of the current
+        lookup.
+
+        The first call runs on this thread, the others on a pool of their
+        own, so answering takes about as long as the slowest of them.
+        """
+        token = current_token()
+        parent = current_span()
+
+        def run(call):
+            with running(token), activate(parent):
+                return call()
+
+        futures = [self._parallel_executor.submit(run, call)
+                   for call in calls[1:]]
+        first = calls[0]()
+        return [first] + [future.result() for future in futures]
+
+    def _show_movie_card(self, record):
+        """ Show the poster of a movie on a connected GUI.
+
+        Everything happens in the background, the spoken answer does not
+        wait for the GUI or the image download.
+        """
+        if not self.settings.get("gui_cards") or \
+                not (record.poster_path or record.backdrop_path):
+            return
+        if self._gui_checked is not None and not self._gui_is_connected \
+                and time.monotonic() < self._gui_checked + GUI_CHECK_INTERVAL:
+            return
+        try:
+            self._gui_executor.submit(self._render_movie_card, record)
+        except RuntimeError:
+            # shutting down
+            pass
+
+    def _gui_connected(self):
+        """ True if a GUI is connected, asked over the bus at most once per
+        GUI_CHECK_INTERVAL."""
+        now = time.monotonic()
+        if self._gui_checked is None or \
+                now >= self._gui_checked + GUI_CHECK_INTERVAL:
+            self._gui_is_connected = self.gui.connected
+            self._gui_checked = now
+        return self._gui_is_connected
+
+    def _render_movie_card(self, record):
+        if not self._gui_connected():
+            return
+        if record.poster_path:
+            url = image_url(record.poster_path, POSTER_SIZES, POSTER_WIDTH)
+        else:
+            url = image_url(record.backdrop_path, BACKDROP_SIZES,
+                            BACKDROP_WIDTH)
+        caption = f"{record.title} ({record.year})" if record.year \
+            else record.title
+
+        def show(path):
+            self.gui.show_image(path, caption=caption,
+                                fill="PreserveAspectFit")
+
+        path = self.images.fetch(url, callback=show)
+        if path is not None:
+            show(path)
 
     def _search_for_person(self, person):
-        for p in Person().search(person):
-            if fuzzy_match(p.name, person) >= self.settings.get("match_confidence"):
-                self.active_person = p
-                LOG.debug(f"active person: {self.active_person}")
-                break
+        """ EntityRecord of the requested person, or None."""
+        entity = self.catalog.resolve_entity(person, self.match_confidence)
+        if entity and entity.kind == "person":
+            LOG.debug(f"found person: {entity}")
+            return entity
+
+    def _person_filmography(self, person):
+        """ (EntityRecord, Filmography) of the requested person, or None."""
+        entity = self._search_for_person(person)
+        return entity and (entity, self.catalog.filmography(entity.id))
+
+    def _speak_overview(self, overview):
+        for sentence in overview.split(". "):
+            self.speak(sentence)
 
     def _create_dialog_list(self, dialog_list):
         # create a list
@@ -125,30 +444,209 @@ class MovieMaster(OVOSSkill):
             "search_depth", self.search_depth)
         self.match_confidence = self.settings.get(
             "match_confidence", self.match_confidence)
+        self.prefetch_budget = self.settings.get(
+            "prefetch_budget", self.prefetch_budget)
+        if self.settings.get("mode", self.mode) != self.mode:
+            self.mode = self.settings.get("mode")
+        elif self.catalog.hub is not None:
+            self.catalog.hub.timeout = float(
+                self.settings.get("hub_timeout", self.catalog.hub.timeout))
+        self.tracer.sample_rate = float(self.settings.get(
+            "trace_sample_rate", self.tracer.sample_rate))
+        self.tracer.slow = float(self.settings.get(
+            "trace_slow_seconds", self.tracer.slow))
+        self.profiler.sample_rate = float(self.settings.get(
+            "profile_sample_rate", self.profiler.sample_rate))
+        self.images.budget = int(self.settings.get(
+            "image_cache_mb", self.images.budget // MB)) * MB
+        shared_cache = self.settings.get("shared_cache")
+        if shared_cache != self._shared_cache:
+            self._shared_cache = shared_cache
+            if shared_cache:
+                self.catalog.open_shared_cache(shared_cache)
+            else:
+                self.catalog.close_shared_cache()
         LOG.debug(f"settings changed to {self.settings}")
 
+    def _save_snapshot(self, message=None):
+        try:
+            self.catalog.save_snapshot(self._snapshot_path)
+        except OSError as e:
+            LOG.error(f"Could not save the cache snapshot: {e}")
+        shared = self.catalog.shared
+        if shared is not None:
+            shared.purge()
+
+    def speak_dialog(self, key, *args, **kwargs):
+        with span("dialog", key=key):
+            super().speak_dialog(key, *args, **kwargs)
+
+    def speak(self, utterance, *args, **kwargs):
+        token = current_token()
+        if token is not None and token.cancelled:
+            LOG.debug(f"Not speaking the answer of a cancelled lookup: "
+                      f"{utterance}")
+            return
+        with span("speak", characters=len(utterance)):
+            super().speak(utterance, *args, **kwargs)
+
+    def handle_utterance(self, message):
+        """ A new utterance makes the answers still being looked up for
+        its session stale."""
+        self.lookups.cancel(SessionManager.get(message).session_id)
+
+    @property
+    def stop_is_implemented(self):
+        # only ask to handle stop while there is something to stop
+        message = dig_for_message()
+        return self.lookups.busy(
+            SessionManager.get(message).session_id if message else None)
+
+    def stop_session(self, session):
+        return self.lookups.cancel(session.session_id, queued=True) > 0
+
+    def stop(self):
+        # stop_session() found nothing to stop, keep other sessions going
+        message = dig_for_message()
+        session_id = SessionManager.get(message).session_id \
+            if message else None
+        return self.lookups.cancel(session_id, queued=True) > 0
+
+    def _probe_tmdb(self, message=None):
+        self.catalog.probe()
+
+    def _on_tmdb_state(self, state, previous):
+        self.bus.emit(Message("ovos.moviemaster.tmdb.state",
+                              {"state": state, "previous": previous,
+                               "failures": self.catalog.breaker.failures}))
+
+    def handle_tmdb_state(self, message):
+        """ Answer ovos.moviemaster.tmdb.state.get with the breaker state."""
+        self.bus.emit(message.response(
+            {"state": self.catalog.breaker.state,
+             "failures": self.catalog.breaker.failures}))
+
+    def handle_profiling(self, message):
+        """ Answer ovos.moviemaster.profiling.get, and .set with a new
+        sample_rate, with the profiling state."""
+        if message.msg_type.endswith(".set"):
+            try:
+                sample_rate = float(message.data.get("sample_rate"))
+            except (TypeError, ValueError):
+                self.bus.emit(message.response(
+                    {"error": "sample_rate must be a number from 0 to 1"}))
+                return
+            self.profiler.sample_rate = min(max(sample_rate, 0.0), 1.0)
+            LOG.info(f"Profiling {self.profiler.sample_rate:.0%} of the "
+                     f"intents")
+        self.bus.emit(message.response(
+            {"sample_rate": self.profiler.sample_rate,
+             "directory": self.profiler.directory,
+             "samples": self.profiler.samples()}))
+
+    def handle_cache_stats(self, message):
+        """ Answer ovos.moviemaster.cache.stats with the catalog stats."""
+        self.bus.emit(message.response(self.catalog.stats()))
+
+    def handle_cache_invalidate(self, message):
+        """ Drop the cache entries of a movie_id, title or endpoint, and
+        answer with how many were dropped."""
+        data = message.data
+        movie_id, title, endpoint = (data.get("movie_id"), data.get("title"),
+                                     data.get("endpoint"))
+        if movie_id is None and not title and not endpoint:
+            self.bus.emit(message.response(
+                {"error": "one of movie_id, title or endpoint is needed"}))
+            return
+        try:
+            movie_id = None if movie_id is None else int(movie_id)
+        except (TypeError, ValueError):
+            self.bus.emit(message.response(
+                {"error": "movie_id must be a TMDb movie id"}))
+            return
+        dropped = self.catalog.invalidate(movie_id, title, endpoint)
+        LOG.info(f"Dropped {dropped} cache entries of movie_id={movie_id} "
+                 f"title={title!r} endpoint={endpoint!r}")
+        self.bus.emit(message.response({"dropped": dropped}))
+
+    def handle_cache_warm(self, message):
+        """ Look up the movies of a list of titles on a worker, and answer
+        with the ones found, not found and failed."""
+        titles = message.data.get("titles")
+        if not isinstance(titles, list):
+            self.bus.emit(message.response(
+                {"error": "titles must be a list of movie titles"}))
+            return
+        self._executor.submit(self._warm_cache, message, titles)
+
+    def _warm_cache(self, message, titles):
+        warmed, not_found, failed = [], [], []
+        for title in titles:
+            try:
+                record = self._movie_details(str(title))
+            except (TMDbUnavailable, TMDbException, OSError) as e:
+                LOG.warning(f"Could not warm the cache with {title!r}: {e}")
+                failed.append(title)
+                continue
+            if record is None:
+                not_found.append(title)
+            else:
+                warmed.append({"title": title, "id": record.id,
+                               "movie": record.title})
+        self.bus.emit(message.response(
+            {"warmed": warmed, "not_found": not_found, "failed": failed}))
+
+    def handle_cache_compact(self, message):
+        """ Drop the expired cache entries and rewrite the snapshot on a
+        worker, and answer with how many entries were dropped."""
+        self._executor.submit(self._compact_cache, message)
+
+    def _compact_cache(self, message):
+        try:
+            result = self.catalog.compact(self._snapshot_path)
+        except OSError as e:
+            LOG.error(f"Could not compact the caches: {e}")
+            result = {"error": str(e)}
+        self.bus.emit(message.response(result))
+
+    def shutdown(self):
+        if self._hub_server is not None:
+            self._hub_server.shutdown()
+        self.lookups.cancel(queued=True)
+        self._handler_executor.shutdown(wait=False, cancel_futures=True)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._parallel_executor.shutdown(wait=False, cancel_futures=True)
+        self._gui_executor.shutdown(wait=False, cancel_futures=True)
+        self.images.shutdown()
+        self._save_snapshot()
+        self.catalog.shutdown()
+
     def verify_api(self, api_key):
         # Do a quick search to verify the api_key
         try:
             TMDb().api_key = api_key
-            p = Movie().popular()
-            return api_key
-        except Exception:
+            self.catalog.breaker.call(Movie().popular)
+        except TMDbException:
             self.speak_dialog("no.valid.api", {})
             # self.speak_dialog("fallback.api", {})
+            return None
+        except TMDbUnavailable as e:
+            # an outage says nothing about the key
+            LOG.warning(f"Could not verify the TMDb api key: {e}")
+        return api_key
 
     @intent_handler("movie.description.intent")
+    @lookup_handler
     def handle_movie_description_intent(self, message):
         """ Gets the long version of the requested movie."""
         movie = message.data.get("movie")
         LOG.debug(f"requested description for movie {movie}")
-        self._search_for_movie(movie)
         try:
-            if self.active_movie:
-                if self.active_movie.overview is not "":
+            record = self._search_for_movie(movie)
+            if record:
+                if record.overview:
                     self.speak_dialog("movie.description", {"movie": movie})
-                    for sentence in self.active_movie.overview.split(". "):
-                        self.speak(sentence)
+                    self._speak_overview(record.overview)
                 else:
                     self.speak_dialog(
                         "movie.description.error", {"movie": movie})
@@ -159,46 +657,89 @@ class MovieMaster(OVOSSkill):
         except IndexError:
             self.speak_dialog("no.info", {"movie": movie})
 
+    @intent_handler("movie.information.intent")
+    @lookup_handler
+    def handle_movie_information(self, message):
+        """ Tells about a movie, TV show or person, whichever the name is.
+
+        A single multi search finds out which one was meant.
+        """
+        name = message.data.get("movie")
+        LOG.debug(f"requested information about {name}")
+        entity = self.catalog.resolve_entity(name, self.match_confidence)
+        if not entity:
+            self.speak_dialog("no.info", {"movie": name})
+        elif entity.kind == "movie":
+            # the multi search left the movie in the cache
+            record = self._search_for_movie(name)
+            if record and record.overview:
+                self.speak_dialog("movie.description", {"movie": name})
+                self._speak_overview(record.overview)
+            else:
+                self.speak_dialog("movie.description.error", {"movie": name})
+        elif entity.kind == "tv":
+            if entity.year:
+                self.speak_dialog("movie.info.tv", {
+                    "show": entity.name, "year": entity.year})
+            else:
+                self.speak_dialog("movie.info.tv.new", {"show": entity.name})
+            if entity.overview:
+                self._speak_overview(entity.overview)
+        else:
+            known_for = [{"title": t} for t in
+                         entity.known_for[:self.search_depth] if t]
+            if len(known_for) > 1:
+                movie_list, last_movie = self._create_dialog_list(known_for)
+                self.speak_dialog("movie.info.person.multiple", {
+                    "person": entity.name, "movielist": movie_list,
+                    "lastmovie": last_movie})
+            elif known_for:
+                self.speak_dialog("movie.info.person.single", {
+                    "person": entity.name, "movie": known_for[0]["title"]})
+            else:
+                self.speak_dialog("movie.info.person", {
+                    "person": entity.name})
+
     @intent_handler("movie.year.intent")
+    @lookup_handler
     def handle_movie_year(self, message):
         """ Gets the year the movie was released."""
         movie = message.data.get("movie")
         LOG.debug(f"requested year made for movie {movie}")
-        self._search_for_movie(movie)
         try:
-            if self.active_movie:
-                if self.active_movie.release_date:
-                    self.speak_dialog("movie.year", {"movie": self.active_movie.title, "year": nice_date(
-                        datetime.strptime(self.active_movie.release_date.replace("-", " "), "%Y %m %d"))})
+            record = self._search_for_movie(movie)
+            if record:
+                if record.release_date:
+                    self.speak_dialog("movie.year", {"movie": record.title, "year": nice_date(
+                        datetime.strptime(record.release_date.replace("-", " "), "%Y %m %d"))})
                 else:
                     self.speak_dialog("movie.year.error", {
-                                      "movie": self.active_movie.title})
+                                      "movie": record.title})
+            else:
+                self.speak_dialog("no.info", {"movie": movie})
 
         # If the title can not be found, it creates an IndexError
         except IndexError:
             self.speak_dialog("no.info", {"movie": movie})
 
     @intent_handler("movie.cast.intent")
+    @lookup_handler
     def handle_movie_cast(self, message):
         """ Gets the cast of the requested movie."""
         movie = message.data.get("movie")
         LOG.debug(f"requested cast for movie {movie}")
-        self._search_for_movie(movie)
         try:
-            if self.active_movie and self.active_movie.id:
-                LOG.debug(f"active_movie {self.active_movie}")
-                cast = []
-                credits = Movie().credits(self.active_movie.id)
-                LOG.debug(f"credits {credits}")
-                for c in Movie().credits(self.active_movie.id)["cast"]:
-                    cast.append(c)
-                    if len(cast) >= self.search_depth:
-                        break
-                LOG.debug(f"{self.active_movie} cast: {cast}")
-            # Create a list to store the cast to be included in the dialog
-            actor_list, last_actor = self._create_dialog_list(cast)
-            self.speak_dialog("movie.cast", {
-                              "movie": movie, "actorlist": actor_list, "lastactor": last_actor})
+            record = self._search_for_movie(movie)
+            if record:
+                record = self.catalog.movie(record.id)
+                cast = [{"name": c} for c in record.cast[:self.search_depth]]
+                LOG.debug(f"{record} cast: {cast}")
+                # Create a list to store the cast to be included in the dialog
+                actor_list, last_actor = self._create_dialog_list(cast)
+                self.speak_dialog("movie.cast", {
+                                  "movie": movie, "actorlist": actor_list, "lastactor": last_actor})
+            else:
+                self.speak_dialog("no.info", {"movie": movie})
 
         # If the title can not be found, it creates an IndexError
         except IndexError:
@@ -213,9 +754,9 @@ class MovieMaster(OVOSSkill):
     #     """
     #     movie = message.data.get("movie")
     #     LOG.debug(f"requested production for movie {movie}")
-    #     self._search_for_movie(movie)
     #     try:
-    #         if self.active_movie and self.active_movie.id:
+    #         record = self._search_for_movie(movie)
+    #         if record:
     #
     #         movie_details = Movie().details(Movie().search(movie)[:1][0].id)
     #         companyList = movie_details.production_companies[:self.searchDepth]
@@ -236,106 +777,274 @@ class MovieMaster(OVOSSkill):
     #         self.speak_dialog("no.info", {"movie": movie})
 
     @intent_handler("movie.genres.intent")
+    @lookup_handler
     def handle_movie_genre(self, message):
         """ Gets the genres the movie belongs to."""
         movie = message.data.get("movie")
         LOG.debug(f"requested cast for movie {movie}")
-        self._search_for_movie(movie)
         try:
-            if self.active_movie and self.active_movie.id:
-                genres = []
-                for g in Movie().details(self.active_movie.id).genres:
-                    genres.append(g)
-                    if len(genres) >= self.search_depth:
-                        break
+            record = self._search_for_movie(movie)
+            if record:
+                record = self.catalog.movie(record.id)
+                genres = [{"name": g}
+                          for g in record.genres[:self.search_depth]]
                 if len(genres) > 1:
                     genre_list, last_genre = self._create_dialog_list(genres)
                     self.speak_dialog("movie.genre.multiple", {
                                       "genrelist": genre_list, "genrelistlast": last_genre})
                 else:
                     self.speak_dialog("movie.genre.single", {
-                                      "movie": movie, "genre": genres[0].name})
+                                      "movie": movie, "genre": genres[0]["name"]})
+            else:
+                self.speak_dialog("no.info", {"movie": movie})
         # If the title can not be found, it creates an IndexError
         except IndexError:
             self.speak_dialog("no.info", {"movie": movie})
 
     @intent_handler("movie.runtime.intent")
+    @lookup_handler
     def handle_movie_length(self, message):
         """ Gets the runtime of the searched movie."""
         movie = message.data.get("movie")
         LOG.debug(f"requested runtime for movie {movie}")
-        self._search_for_movie(movie)
         try:
-            if self.active_movie:
-                movie_runtime = Movie().details(self.active_movie.id).runtime
+            record = self._search_for_movie(movie)
+            if record:
+                record = self.catalog.movie(record.id)
                 self.speak_dialog("movie.runtime", {
-                                  "movie": movie, "runtime": movie_details.runtime})
+                                  "movie": movie, "runtime": record.runtime})
+            else:
+                self.speak_dialog("no.info", {"movie": movie})
 
         # If the title can not be found, it creates an IndexError
         except IndexError:
             self.speak_dialog("no.info", {"movie": movie})
 
     @intent_handler("movie.recommendations.intent")
+    @lookup_handler
     def handle_movie_recommendations(self, message):
         """ Gets the top movies that are similar to the suggested movie."""
         movie = message.data.get("movie")
         LOG.debug(f"requested recommendations like the movie {movie}")
-        self._search_for_movie(movie)
         try:
-            if self.active_movie:
-                recommendation_list = []
-                for r in Movie().recommendations(self.active_movie.id):
-                    recommendation_list.append(r)
-                    if len(recommendation_list) >= self.search_depth:
-                        break
+            record = self._search_for_movie(movie)
+            if record:
+                recommendation_list = self.catalog.recommend(
+                    record.id, self.search_depth)
                 movie_list, last_movie = self._create_dialog_list(
                     recommendation_list)
-
-            self.speak_dialog("movie.recommendations", {
-                              "movielist": movie_list, "lastmovie": last_movie, "movie": movie})
+                self.speak_dialog("movie.recommendations", {
+                                  "movielist": movie_list, "lastmovie": last_movie, "movie": movie})
+            else:
+                self.speak_dialog("no.info", {"movie": movie})
 
         # If the title can not be found, it creates an IndexError
         except IndexError:
             self.speak_dialog("no.info", {"movie": movie})
 
     @intent_handler("movie.popular.intent")
+    @lookup_handler
     def handle_popular_movies(self, message):
         """ Gets the daily popular movies.
 
         The list changes daily, and are not just recent movies.
         """
         try:
-            movies = []
-            for movie in Movie().popular():
-                movies.append(movie)
-                if len(movies) >= self.search_depth:
-                    break
+            movies = self.catalog.popular().take(self.search_depth)
             # Lets see...I think we will set up the dialog again.
             popular_movies, last_movie = self._create_dialog_list(movies)
             self.speak_dialog("movie.popular", {
                               "popularlist": popular_movies, "lastmovie": last_movie})
 
-        # If the title can not be found, it creates an IndexError
+        # If the list is empty, it creates an IndexError
         except IndexError:
-            self.speak_dialog("no.info", {"movie": movie})
+            self.speak_dialog("no.info.general", {})
 
     @intent_handler("movie.top.intent")
+    @lookup_handler
     def handle_top_movies(self, message):
         """ Gets the top rated movies of the day.
         The list changes daily, and are not just recent movies.
         """
         LOG.debug("requested the top movies playing")
         try:
-            movies = Movie().top_rated()
-            top_movies = []
-            for m in movies:
-                top_movies.append(m)
-                if len(top_movies) >= self.search_depth:
-                    break
+            top_movies = self.catalog.top_rated().take(self.search_depth)
             movie_list, last_movie = self._create_dialog_list(top_movies)
             self.speak_dialog(
                 "movie.top", {"toplist": movie_list, "lastmovie": last_movie})
 
-        # If the title can not be found, it creates an IndexError
+        # If the list is empty, it creates an IndexError
         except IndexError:
+            self.speak_dialog("no.info.general", {})
+
+    @intent_handler("movie.trending.intent")
+    @lookup_handler
+    def handle_trending_movies(self, message):
+        """ Gets the movies trending today, or this week if asked for."""
+        utterance = message.data.get("utterance", "")
+        window = "week" if self.voc_match(utterance, "week") else "day"
+        LOG.debug(f"requested the movies trending this {window}")
+        try:
+            movies = self.catalog.trending(window).take(self.search_depth)
+            movie_list, last_movie = self._create_dialog_list(movies)
+            dialog = "movie.trending.week" if window == "week" \
+                else "movie.trending"
+            self.speak_dialog(
+                dialog, {"movielist": movie_list, "lastmovie": last_movie})
+
+        # If the list is empty, it creates an IndexError
+        except IndexError:
+            self.speak_dialog("no.info.general", {})
+
+    @intent_handler("movie.now.playing.intent")
+    @lookup_handler
+    def handle_now_playing_movies(self, message):
+        """ Gets the movies in theaters of the region right now."""
+        LOG.debug(f"requested the movies playing in {self.region}")
+        try:
+            movies = self.catalog.now_playing(self.region).take(
+                self.search_depth)
+            movie_list, last_movie = self._create_dialog_list(movies)
+            self.speak_dialog("movie.now.playing", {
+                "movielist": movie_list, "lastmovie": last_movie})
+
+        # If the list is empty, it creates an IndexError
+        except IndexError:
+            self.speak_dialog("no.info.general", {})
+
+    @intent_handler("movie.upcoming.intent")
+    @lookup_handler
+    def handle_upcoming_movies(self, message):
+        """ Gets the movies coming to theaters of the region soon."""
+        LOG.debug(f"requested the movies coming out in {self.region}")
+        try:
+            movies = self.catalog.upcoming(self.region).take(
+                self.search_depth)
+            movie_list, last_movie = self._create_dialog_list(movies)
+            self.speak_dialog("movie.upcoming", {
+                "movielist": movie_list, "lastmovie": last_movie})
+
+        # If the list is empty, it creates an IndexError
+        except IndexError:
+            self.speak_dialog("no.info.general", {})
+
+    @intent_handler("movie.providers.intent")
+    @lookup_handler
+    def handle_movie_providers(self, message):
+        """ Gets where the movie can be streamed, or else rented or bought.
+
+        Without a title, or with "it" or "that movie" in its place, it is
+        about the last movie asked for in the session.
+        """
+        movie = message.data.get("movie")
+        LOG.debug(f"requested watch providers for movie {movie}")
+        if movie and not self.voc_match(movie, "pronoun", exact=True):
+            record = self._search_for_movie(movie)
+        else:
+            record = self._recent_movies.get(
+                SessionManager.get(message).session_id)
+            if not record:
+                self.speak_dialog("no.info.general", {})
+                return
+            movie = record.title
+        if not record:
             self.speak_dialog("no.info", {"movie": movie})
+            return
+        offers = self.catalog.watch_providers(
+            record.id, self.region or DEFAULT_PROVIDER_REGION)
+        stream = offers.get("flatrate", ()) + offers.get("free", ()) + \
+            offers.get("ads", ())
+        if stream:
+            dialog, providers = "movie.providers.stream", stream
+        else:
+            providers = offers.get("rent", ()) + offers.get("buy", ())
+            dialog = "movie.providers.rent"
+        # the same service often both rents and sells
+        providers = list(dict.fromkeys(providers))[:self.search_depth]
+        if not providers:
+            self.speak_dialog("movie.providers.none", {"movie": movie})
+        elif len(providers) > 1:
+            provider_list, last_provider = self._create_dialog_list(
+                [{"name": p} for p in providers])
+            self.speak_dialog(f"{dialog}.multiple", {
+                "movie": movie, "providerlist": provider_list,
+                "lastprovider": last_provider})
+        else:
+            self.speak_dialog(f"{dialog}.single",
+                              {"movie": movie, "provider": providers[0]})
+
+    @intent_handler("movie.compare.length.intent")
+    @lookup_handler
+    def handle_compare_length(self, message):
+        """ Tells which of two movies is longer."""
+        first = message.data.get("first")
+        second = message.data.get("second")
+        LOG.debug(f"requested which is longer, {first} or {second}")
+        records = self._in_parallel(partial(self._movie_details, first),
+                                    partial(self._movie_details, second))
+        for movie, record in zip((first, second), records):
+            if not record or not record.runtime:
+                self.speak_dialog("no.info", {"movie": movie})
+                return
+        longer, shorter = sorted(records, key=lambda r: r.runtime,
+                                 reverse=True)
+        if longer.runtime == shorter.runtime:
+            self.speak_dialog("movie.compare.length.same", {
+                "first": records[0].title, "second": records[1].title,
+                "runtime": longer.runtime})
+        else:
+            self.speak_dialog("movie.compare.length", {
+                "longer": longer.title, "longruntime": longer.runtime,
+                "shorter": shorter.title, "shortruntime": shorter.runtime})
+
+    @intent_handler("movie.compare.release.intent")
+    @lookup_handler
+    def handle_compare_release(self, message):
+        """ Tells which of two movies came out first."""
+        first = message.data.get("first")
+        second = message.data.get("second")
+        LOG.debug(f"requested which came out first, {first} or {second}")
+        records = self._in_parallel(partial(self._resolve_movie, first),
+                                    partial(self._resolve_movie, second))
+        for movie, record in zip((first, second), records):
+            if not record or not record.year:
+                self.speak_dialog("no.info", {"movie": movie})
+                return
+        # release dates are ISO dates, they sort as strings
+        earlier, later = sorted(records, key=lambda r: r.release_date)
+        if earlier.release_date == later.release_date:
+            self.speak_dialog("movie.compare.release.same", {
+                "first": records[0].title, "second": records[1].title,
+                "year": earlier.year})
+        else:
+            self.speak_dialog("movie.compare.release", {
+                "earlier": earlier.title, "earlieryear": earlier.year,
+                "later": later.title, "lateryear": later.year})
+
+    @intent_handler("movie.costars.intent")
+    @lookup_handler
+    def handle_costars(self, message):
+        """ Gets the movies two people played in together, most popular
+        first."""
+        first = message.data.get("first")
+        second = message.data.get("second")
+        LOG.debug(f"requested movies with both {first} and {second}")
+        found = self._in_parallel(partial(self._person_filmography, first),
+                                  partial(self._person_filmography, second))
+        for person, person_found in zip((first, second), found):
+            if not person_found:
+                self.speak_dialog("person.not.found", {"person": person})
+                return
+        (first_person, first_movies), (second_person, second_movies) = found
+        movies = [{"title": t} for t in
+                  first_movies.together(second_movies)[:self.search_depth]]
+        names = {"first": first_person.name, "second": second_person.name}
+        if len(movies) > 1:
+            movie_list, last_movie = self._create_dialog_list(movies)
+            self.speak_dialog("movie.costars.multiple", dict(
+                names, movielist=movie_list, lastmovie=last_movie))
+        elif movies:
+            self.speak_dialog("movie.costars.single",
+                              dict(names, movie=movies[0]["title"]))
+        else:
+            self.speak_dialog("movie.costars.none", names)
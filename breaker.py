@@ -0,0 +1,129 @@
+import time
+from threading import Lock
+
+from ovos_utils.log import LOG
+from requests.exceptions import RequestException
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Errors that mean TMDb could not be reached or answered garbage, like a
+# gateway error page instead of json.  A TMDbException is a real answer.
+TRANSIENT_ERRORS = (RequestException, ValueError)
+
+
+class TMDbUnavailable(Exception):
+    """ TMDb could not be reached, the request did not get an answer."""
+
+
+class CircuitOpenError(TMDbUnavailable):
+    """ Not even tried, TMDb failed too often lately."""
+
+
+class CircuitBreaker:
+    """ Stop calling a service that keeps failing.
+
+    After failure_threshold transient errors in a row the circuit opens and
+    calls fail right away with CircuitOpenError.  Once reset_timeout seconds
+    passed the circuit is half open and lets a single call through as a
+    probe, closing again if it works and opening for another reset_timeout
+    if it does not.
+
+    on_change(state, previous) is called on every state change.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=30, on_change=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_change = on_change
+        self.failures = 0
+        self._state = CLOSED
+        self._opened_at = 0
+        self._probing = False
+        self._lock = Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and self._retry_due():
+                return HALF_OPEN
+            return self._state
+
+    def _retry_due(self):
+        return time.monotonic() - self._opened_at >= self.reset_timeout
+
+    def _set_state(self, state):
+        """ Change state, returns the previous state if it changed.
+
+        Must be called with the lock held.
+        """
+        previous = self._state
+        if previous == state:
+            return None
+        self._state = state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        return previous
+
+    def _notify(self, state, previous):
+        if previous is None:
+            return
+        LOG.info(f"TMDb circuit breaker {previous} -> {state}")
+        if self.on_change is not None:
+            try:
+                self.on_change(state, previous)
+            except Exception as e:
+                LOG.error(f"Circuit breaker callback failed: {e}")
+
+    def _before_call(self):
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            if self._state == OPEN and not self._retry_due():
+                raise CircuitOpenError("TMDb is unavailable")
+            if self._probing:
+                # somebody else is already finding out
+                raise CircuitOpenError("TMDb is unavailable")
+            self._probing = True
+            previous = self._set_state(HALF_OPEN)
+        self._notify(HALF_OPEN, previous)
+
+    def _succeeded(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            previous = self._set_state(CLOSED)
+        self._notify(CLOSED, previous)
+
+    def _failed(self):
+        with self._lock:
+            self.failures += 1
+            previous = None
+            if self._state == HALF_OPEN or \
+                    self.failures >= self.failure_threshold:
+                previous = self._set_state(OPEN)
+                # a failed probe waits another reset_timeout
+                self._opened_at = time.monotonic()
+            self._probing = False
+            state = self._state
+        self._notify(state, previous)
+
+    def call(self, func, *args, **kwargs):
+        """ func(*args, **kwargs) if the circuit allows it.
+
+        Raises CircuitOpenError without calling func while open, and
+        TMDbUnavailable if func fails with a transient error.
+        """
+        self._before_call()
+        try:
+            result = func(*args, **kwargs)
+        except TRANSIENT_ERRORS as e:
+            self._failed()
+            raise TMDbUnavailable(str(e)) from e
+        except Exception:
+            # TMDb answered, if only with an error
+            self._succeeded()
+            raise
+        self._succeeded()
+        return result
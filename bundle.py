@@ -0,0 +1,190 @@
+import hashlib
+import json
+import re
+from os import makedirs, replace, walk
+from os.path import isfile, join, relpath
+
+from ovos_utils.log import LOG
+
+BUNDLE_FILE = "bundle.json"
+BUNDLE_VERSION = 1
+
+# resource file extension -> bundle section
+SECTIONS = {".intent": "intents", ".dialog": "dialogs", ".voc": "vocabs"}
+
+_PLACEHOLDER = re.compile(r"\{+\s*(.*?)\s*\}+")
+
+
+def read_lines(path):
+    """ Lines of a resource file without comments and blank lines."""
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f
+                if line.strip() and not line.strip().startswith("#")]
+
+
+def source_files(lang_dir):
+    """ Sorted (section, resource name, relative path) of a locale folder."""
+    sources = []
+    for directory, _, files in walk(lang_dir):
+        for file in files:
+            for ext, section in SECTIONS.items():
+                if file.endswith(ext):
+                    path = relpath(join(directory, file), lang_dir)
+                    sources.append((section, file, path))
+    return sorted(sources, key=lambda s: s[2])
+
+
+def source_hash(lang_dir):
+    """ Hash over the names and contents of the resource files."""
+    digest = hashlib.sha256()
+    for _, _, path in source_files(lang_dir):
+        digest.update(path.encode("utf-8") + b"\0")
+        with open(join(lang_dir, path), "rb") as f:
+            digest.update(f.read() + b"\0")
+    return digest.hexdigest()
+
+
+def placeholders(lines):
+    return sorted({p for line in lines for p in _PLACEHOLDER.findall(line)})
+
+
+def _check_brackets(line):
+    depth = {"(": 0, "{": 0, "[": 0}
+    closing = {")": "(", "}": "{", "]": "["}
+    for char in line:
+        if char in depth:
+            depth[char] += 1
+        elif char in closing:
+            depth[closing[char]] -= 1
+            if depth[closing[char]] < 0:
+                return False
+    return not any(depth.values())
+
+
+def build_bundle(lang_dir, lang):
+    """ Expand, dedupe and validate the resources of one locale.
+
+    Returns the bundle dict and a list of problems found.  The expansion
+    helpers are only needed here, at build time.
+    """
+    from ovos_utils.bracket_expansion import expand_template
+    from padacioso.bracket_expansion import expand_parentheses
+
+    bundle = {"version": BUNDLE_VERSION, "lang": lang,
+              "hash": source_hash(lang_dir), "sources": {},
+              "intents": {}, "dialogs": {}, "vocabs": {}}
+    problems = []
+    for section, name, path in source_files(lang_dir):
+        lines = read_lines(join(lang_dir, path))
+        for line in lines:
+            if not _check_brackets(line):
+                problems.append(f"{lang}/{path}: unbalanced brackets "
+                                f"in {line!r}")
+        if section == "intents":
+            samples = [" ".join(s.split()) for line in lines
+                       for s in expand_parentheses(line)]
+        elif section == "vocabs":
+            samples = [" ".join(s.split()) for line in lines
+                       for s in expand_template(line.lower())]
+        else:
+            # same normalisation MustacheDialogRenderer does when loading
+            samples = [_PLACEHOLDER.sub(r"{\1}", line) for line in lines]
+        samples = list(dict.fromkeys(s for s in samples if s))
+        if not samples:
+            problems.append(f"{lang}/{path}: no usable lines")
+            continue
+        key = name if section == "intents" else name.rsplit(".", 1)[0]
+        bundle[section][key] = samples
+        bundle["sources"][name] = path
+    return bundle, problems
+
+
+def compare_placeholders(bundle, reference):
+    """ Entities and dialog fields a translation disagrees on."""
+    problems = []
+    for section in ("intents", "dialogs"):
+        for key, lines in bundle[section].items():
+            expected = reference[section].get(key)
+            if expected is not None and \
+                    placeholders(lines) != placeholders(expected):
+                problems.append(
+                    f"{bundle['lang']}/{key}: uses {placeholders(lines)}, "
+                    f"{reference['lang']} uses {placeholders(expected)}")
+    return problems
+
+
+def write_bundle(lang_dir, bundle):
+    with open(join(lang_dir, BUNDLE_FILE), "w", encoding="utf-8") as f:
+        json.dump(bundle, f, ensure_ascii=False, sort_keys=True,
+                  separators=(",", ":"))
+        f.write("\n")
+
+
+class ResourceBundle:
+    """ Precompiled intents, dialogs and vocab of one locale.
+
+    Built by scripts/build_resource_bundles.py so the skill does not have
+    to find, parse and expand every resource file on each load.
+    """
+
+    def __init__(self, lang_dir, data):
+        self.lang_dir = lang_dir
+        self.hash = data["hash"]
+        self._data = data
+
+    @classmethod
+    def load(cls, lang_dir):
+        """ The bundle of a locale folder, or None if there is none."""
+        path = join(lang_dir, BUNDLE_FILE)
+        if not isfile(path):
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            LOG.warning(f"Ignoring broken resource bundle {path}: {e}")
+            return None
+        if data.get("version") != BUNDLE_VERSION:
+            LOG.warning(f"Ignoring resource bundle {path}: "
+                        f"version {data.get('version')}")
+            return None
+        return cls(lang_dir, data)
+
+    def source_path(self, name):
+        path = self._data["sources"].get(name)
+        return join(self.lang_dir, path) if path else None
+
+    def intent(self, name):
+        """ Expanded samples of an .intent file, or None."""
+        return self._data["intents"].get(name)
+
+    def intent_file(self, name, directory):
+        """ Path of a file with the expanded samples of an .intent file,
+        written to directory once per bundle hash, or None.
+
+        The intent service registers intents from files, this hands it the
+        precompiled samples instead of the templates.
+        """
+        samples = self.intent(name)
+        if samples is None:
+            return None
+        path = join(directory, self.hash, name)
+        if not isfile(path):
+            makedirs(join(directory, self.hash), exist_ok=True)
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write("\n".join(samples) + "\n")
+            replace(tmp, path)
+        return path
+
+    def vocab(self, name):
+        """ Expanded options of a .voc file, or None."""
+        return self._data["vocabs"].get(name)
+
+    def dialog_renderer(self):
+        from ovos_utils.dialog import MustacheDialogRenderer
+
+        renderer = MustacheDialogRenderer()
+        renderer.templates = {k: list(v)
+                              for k, v in self._data["dialogs"].items()}
+        return renderer
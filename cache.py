@@ -0,0 +1,94 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+_MISSING = object()
+
+
+class TTLCache:
+    """ Small thread safe LRU cache whose entries expire after ttl seconds.
+
+    Expiry uses wall clock time so entries keep their meaning when they are
+    written to disk and read back later.
+
+    With a soft_ttl, entries older than soft_ttl are still handed out by
+    get_stale() until ttl, flagged as stale, so callers can answer right
+    away and refresh them in the background.
+    """
+
+    def __init__(self, maxsize=256, ttl=3600, soft_ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.soft_ttl = soft_ttl
+        self.hits = 0
+        self.misses = 0
+        # bumped on every write, tells if the cache is worth saving again
+        self.changes = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        return self.get_stale(key, default)[0]
+
+    def get_stale(self, key, default=None):
+        """ (value, fresh) for key, fresh is False once soft_ttl passed."""
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires, value = entry
+                if expires > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    fresh = self.soft_ttl is None or \
+                        expires - self.ttl + self.soft_ttl > now
+                    return value, fresh
+                del self._data[key]
+            self.misses += 1
+            return default, False
+
+    def put(self, key, value, ttl=None, expires=None):
+        if expires is None:
+            expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            self.changes += 1
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+            self.changes += 1
+        return default if entry is _MISSING else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.changes += 1
+
+    def purge(self):
+        """ Drop the expired entries, returns how many there were."""
+        now = time.time()
+        with self._lock:
+            expired = [k for k, (e, _) in self._data.items() if e <= now]
+            for key in expired:
+                del self._data[key]
+            if expired:
+                self.changes += 1
+        return len(expired)
+
+    def items(self):
+        """ List of (key, value, expires) for the entries still valid."""
+        now = time.time()
+        with self._lock:
+            return [(k, v, e) for k, (e, v) in self._data.items() if e > now]
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[0] > time.time()
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,1079 @@
+import json
+import os
+import time
+from collections import Counter, deque
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from itertools import islice, zip_longest
+from threading import Event, Lock, get_native_id
+
+import requests
+from ovos_utils.log import LOG
+from tmdbv3api import (TMDb, Configuration, Movie, Person, Provider,
+                       Search, Trending)
+
+from .breaker import CLOSED, CircuitBreaker, TMDbUnavailable
+from .cache import TTLCache
+from .hub import HubUnavailable
+from .lookups import LookupCancelled, current_token, running
+from .profiling import is_profiled
+from .records import EntityRecord, Filmography, MovieRecord
+from .resolver import extract_year, rank_candidates
+from .shared_cache import SharedCache
+from .similar import SimilarityIndex
+from .snapshot import Snapshot, write_snapshot
+from .tracing import activate, current_span, span, traced
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+# Distinct titles kept in the unresolved title metrics
+MAX_UNRESOLVED_TITLES = 200
+
+# TMDb lists come in pages of 20, and at most 500 of them
+PAGE_SIZE = 20
+MAX_PAGES = 500
+# Start fetching the next page when a reader gets this close to the end
+NEXT_PAGE_MARGIN = 5
+
+# Niceness of the prefetch worker thread, it only ever does speculative work
+PREFETCH_NICENESS = 10
+
+# Seconds to wait for TMDb to connect and to answer
+REQUEST_TIMEOUT = (3.05, 10)
+# Failed requests in a row that open the circuit breaker, and seconds until
+# a request is tried again
+BREAKER_FAILURES = 3
+BREAKER_RESET = 30
+# Threads making the requests of cancellable lookups
+REQUEST_WORKERS = 8
+
+# Kinds of watch provider offers, best first
+PROVIDER_KINDS = ("flatrate", "free", "ads", "rent", "buy")
+
+# How each cache section is turned into json for a snapshot and back
+_ENCODERS = {
+    "titles": lambda movie_id: movie_id,
+    "movies": lambda record: record.to_tuple(),
+    "lists": lambda movies: [m.to_tuple() for m in movies],
+    "providers": lambda offers: offers,
+    "provider_names": lambda names: sorted(names.items()),
+    "entities": lambda entity: entity.to_tuple(),
+    "filmographies": lambda filmography: filmography.to_tuple(),
+}
+_DECODERS = {
+    "titles": lambda movie_id: movie_id,
+    "movies": MovieRecord.from_tuple,
+    "lists": lambda movies: tuple(MovieRecord.from_tuple(m) for m in movies),
+    "providers": lambda offers: {kind: tuple(ids)
+                                 for kind, ids in offers.items()},
+    "provider_names": lambda names: dict(names),
+    "entities": EntityRecord.from_tuple,
+    "filmographies": Filmography.from_tuple,
+}
+
+# List endpoint -> request for one page of it, called with the arguments
+# of the list key, (endpoint, *args, page)
+LISTS = {
+    "recommendations": lambda movie_id, page:
+        Movie().recommendations(movie_id, page=page),
+    "popular": lambda page: Movie().popular(page=page),
+    "top_rated": lambda page: Movie().top_rated(page=page),
+    # window is "day" or "week"
+    "trending": lambda window, page:
+        getattr(Trending(), f"movie_{window}")(page=page).results,
+    # region is an ISO 3166-1 country code, None for all of them
+    "now_playing": lambda region, page:
+        Movie().now_playing(region=region, page=page),
+    "upcoming": lambda region, page:
+        Movie().upcoming(region=region, page=page),
+}
+
+
+class MovieCatalog:
+    """ Cached access to TMDb movie data.
+
+    Everything handed out is a compact MovieRecord, or a tuple of them for
+    list style endpoints, never the raw tmdbv3api objects.
+    """
+
+    def __init__(self, on_breaker_change=None):
+        # TMDb is asked through the breaker so an outage fails fast instead
+        # of every request waiting for its timeout
+        self.breaker = CircuitBreaker(BREAKER_FAILURES, BREAKER_RESET,
+                                      on_change=on_breaker_change)
+        _use_request_timeout()
+        # (spoken title, match_confidence) -> movie id
+        self.titles = TTLCache(maxsize=512, ttl=DAY)
+        # movie id -> MovieRecord
+        self.movies = TTLCache(maxsize=256, ttl=DAY)
+        # (endpoint, *args, page) -> tuple of MovieRecord, served stale
+        # while a newer page is fetched in the background
+        self.lists = TTLCache(maxsize=64, ttl=3 * DAY, soft_ttl=6 * HOUR)
+        # (spoken name, match_confidence) -> EntityRecord of a multi search
+        self.entities = TTLCache(maxsize=256, ttl=DAY)
+        # person id -> Filmography
+        self.filmographies = TTLCache(maxsize=64, ttl=7 * DAY)
+        # (spoken title, match_confidence) that found nothing, kept briefly
+        # so the same misheard title is not searched again and again
+        self.unresolved = TTLCache(maxsize=256, ttl=10 * MINUTE)
+        # (region, movie id) -> {offer kind: provider ids}
+        self.providers = TTLCache(maxsize=256, ttl=DAY)
+        # region -> {provider id: name}, shared by all the movies
+        self.provider_names = TTLCache(maxsize=8, ttl=7 * DAY)
+        # spoken title -> times it could not be resolved
+        self.unresolved_titles = Counter()
+        # (endpoint, "hits" or "misses") -> cache lookups
+        self.endpoint_stats = Counter()
+        self._metrics_lock = Lock()
+        # content similarity of the movies cache, rebuilt when it changed
+        self._similar = SimilarityIndex()
+        self._similar_changes = None
+        # ids of the movies in the index
+        self._similar_ids = frozenset()
+        self._similar_lock = Lock()
+        self._sections = {"titles": self.titles, "movies": self.movies,
+                          "lists": self.lists, "providers": self.providers,
+                          "provider_names": self.provider_names,
+                          "entities": self.entities,
+                          "filmographies": self.filmographies}
+        # cache shared with the other MovieMaster processes on this host
+        self.shared = None
+        # HubClient of a satellite, misses are asked from the hub first
+        self.hub = None
+        self._snapshot = None
+        self._saved_changes = None
+        # serializes swapping the snapshot and the shared cache, readers
+        # take a reference and never lock
+        self._swap_lock = Lock()
+        self._save_lock = Lock()
+        # (section, key) invalidated since the snapshot was written
+        self._dropped = set()
+        # list key -> Future of its background fetch
+        self._refreshing = {}
+        # movie id -> Future of the details request on its way, so a
+        # handler and a prefetch of the same movie share one request
+        self._fetching = {}
+        self._refresh_lock = Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="moviemaster-refresh")
+        # requests of cancellable lookups run here, the lookup only waits
+        self._request_executor = ThreadPoolExecutor(
+            max_workers=REQUEST_WORKERS,
+            thread_name_prefix="moviemaster-request")
+
+        # prefetch requests allowed per hour, 0 turns prefetching off
+        self.prefetch_budget = 0
+        self.prefetch_stats = Counter()
+        # ("movie" or "lists", key) warmed by a prefetch and not used yet
+        self._prefetched = set()
+        self._prefetch_times = deque()
+        self._prefetch_lock = Lock()
+        self._prefetch_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="moviemaster-prefetch",
+            initializer=_lower_thread_priority)
+
+    def probe(self):
+        """ Try TMDb again once the breaker waited long enough.
+
+        Returns True if the breaker is closed afterwards.
+        """
+        if self.breaker.state == CLOSED:
+            return True
+        try:
+            self.breaker.call(Configuration().api_configuration)
+        except TMDbUnavailable:
+            return False
+        except Exception as e:
+            LOG.debug(f"TMDb probe answered with an error: {e}")
+        return self.breaker.state == CLOSED
+
+    def shutdown(self):
+        self._prefetch_executor.shutdown(wait=False, cancel_futures=True)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._request_executor.shutdown(wait=False, cancel_futures=True)
+        self.close_snapshot()
+        self.close_shared_cache()
+
+    def open_shared_cache(self, path):
+        """ Share cached TMDb data with other processes through the
+        database at path."""
+        self._swap_shared(SharedCache.open(path))
+
+    def close_shared_cache(self):
+        self._swap_shared(None)
+
+    def _swap_shared(self, shared):
+        with self._swap_lock:
+            old, self.shared = self.shared, shared
+        if old is not None:
+            old.close()
+
+    def load_snapshot(self, path):
+        """ Warm the caches from a snapshot file written by save_snapshot.
+
+        Only the file is mapped here, entries are decoded the first time a
+        lookup misses the in memory cache.
+        """
+        self._swap_snapshot(Snapshot.open(path))
+
+    def close_snapshot(self):
+        self._swap_snapshot(None)
+
+    def _swap_snapshot(self, snapshot):
+        """ Use snapshot from now on.  The old one is closed once the
+        lookups still reading it are done."""
+        with self._swap_lock:
+            old, self._snapshot = self._snapshot, snapshot
+        if old is not None:
+            old.close()
+
+    def save_snapshot(self, path, force=False):
+        """ Write the hot caches to path, if anything changed since the
+        last save.
+
+        Entries that are still only in the loaded snapshot are carried over
+        so a short session does not throw away the rest of the warm data.
+        With force the file is written even if nothing changed, which also
+        leaves out the entries that expired since.
+        """
+        with self._save_lock:
+            changes = sum(c.changes for c in self._sections.values())
+            if changes == self._saved_changes and not force:
+                return False
+            snapshot = self._snapshot
+            dropped = set(self._dropped)
+            sections = {}
+            for name, cache in self._sections.items():
+                encode = _ENCODERS[name]
+                entries = {k: (encode(v), e) for k, v, e in cache.items()}
+                if snapshot is not None:
+                    for key in snapshot.keys(name):
+                        if key not in entries and (name, key) not in dropped:
+                            found = snapshot.get(name, key)
+                            if found is not None:
+                                entries[key] = found
+                sections[name] = [(k, v, e) for k, (v, e) in entries.items()]
+            # the old file stays mapped until it is swapped out
+            count = write_snapshot(path, sections)
+            self._swap_snapshot(Snapshot.open(path))
+            self._saved_changes = changes
+            self._dropped -= dropped
+        LOG.debug(f"Saved {count} cache entries to {path}")
+        return True
+
+    def _request(self, func, *args, **kwargs):
+        """ func(*args, **kwargs) through the circuit breaker.
+
+        Inside a cancellable lookup the request runs on another thread and
+        the lookup stops waiting for it as soon as it is cancelled.  A
+        request already sent can not be taken back, its answer still ends
+        up in the caches when it arrives.
+        """
+        with span("tmdb", request=getattr(func, "__qualname__", str(func)),
+                  args=list(args), **kwargs):
+            return self._send(func, *args, **kwargs)
+
+    def _send(self, func, *args, **kwargs):
+        token = current_token()
+        if token is None:
+            return self.breaker.call(func, *args, **kwargs)
+        token.check()
+        if is_profiled():
+            # parsing and wrapping the answer belongs in the profile, at
+            # the price of not being able to stop waiting for it
+            return self.breaker.call(func, *args, **kwargs)
+        future = self._request_executor.submit(self.breaker.call, func,
+                                               *args, **kwargs)
+        return _wait(future)
+
+    def _cached(self, section, key):
+        """ Cached value from memory, falling back to the snapshot."""
+        return self._cached_stale(section, key)[0]
+
+    def _cached_stale(self, section, key):
+        """ (value, fresh) from memory, falling back to the shared cache
+        and the snapshot."""
+        with span("cache", section=section, key=str(key)) as lookup:
+            cache = self._sections[section]
+            value, fresh = cache.get_stale(key)
+            found = None
+            if value is None:
+                found = self._stored(section, key)
+                if found is not None:
+                    data, expires = found
+                    cache.put(key, _DECODERS[section](data), expires=expires)
+                    value, fresh = cache.get_stale(key)
+            if lookup is not None:
+                lookup.set(result="miss" if value is None else
+                           "stored" if found is not None else "memory",
+                           fresh=fresh)
+            with self._metrics_lock:
+                self.endpoint_stats[_endpoint(section, key),
+                                    "misses" if value is None
+                                    else "hits"] += 1
+            return value, fresh
+
+    def _stored(self, section, key):
+        """ (json value, expires) outside of this process, or None."""
+        found = None
+        shared, snapshot = self.shared, self._snapshot
+        if shared is not None:
+            found = shared.get(section, key)
+        if found is None and snapshot is not None and \
+                (section, key) not in self._dropped:
+            found = snapshot.get(section, key)
+        return found
+
+    def _store(self, section, key, value):
+        """ Cache a value in memory and in the shared cache."""
+        cache = self._sections[section]
+        expires = time.time() + cache.ttl
+        cache.put(key, value, expires=expires)
+        shared = self.shared
+        if shared is not None:
+            shared.put(section, key, _ENCODERS[section](value), expires)
+
+    def _remember(self, record):
+        """ Cache a record unless a more complete one is already known."""
+        cached = self._cached("movies", record.id)
+        if cached is not None and cached.has_details and \
+                not record.has_details:
+            return cached
+        self._store("movies", record.id, record)
+        return record
+
+    @traced("resolve")
+    def resolve(self, phrase, min_confidence, prefixes=None, suffixes=None):
+        """ Find the movie a spoken title refers to.
+
+        Returns a MovieRecord, or None if nothing matches well enough.
+        """
+        key = (phrase.lower(), min_confidence)
+        movie_id = self._cached("titles", key)
+        if movie_id is not None:
+            record = self._cached("movies", movie_id)
+            if record is not None:
+                return record
+        if key in self.unresolved:
+            self._count_unresolved(key[0])
+            return None
+
+        if self._use_hub():
+            try:
+                record = self.hub.resolve(phrase, min_confidence,
+                                          prefixes, suffixes)
+            except HubUnavailable:
+                pass
+            else:
+                return self._resolved(key, record and self._remember(record))
+
+        # "the 1976 version of king kong" narrows the search down to 1976
+        title, year = extract_year(phrase, prefixes, suffixes)
+        ranked = []
+        if year:
+            ranked = _rank(self.search(title, year), title, min_confidence)
+        # Titles like "2001 a space odyssey" are not a year qualifier
+        if not ranked:
+            ranked = _rank(self.search(phrase), phrase, min_confidence)
+        if not ranked:
+            return self._resolved(key, None)
+        record = ranked[0][0]
+        LOG.debug(f"Chosen movie: {record.title} ({record.release_date}) "
+                  f"out of {len(ranked)} candidates")
+        return self._resolved(key, record)
+
+    @traced("resolve_entity")
+    def resolve_entity(self, phrase, min_confidence):
+        """ Find the movie, TV show or person a spoken name refers to.
+
+        A single multi search tells them apart, instead of one search per
+        kind.  A movie found this way is cached like one found by resolve().
+
+        Returns an EntityRecord, or None if nothing matches well enough.
+        """
+        key = (phrase.lower(), min_confidence)
+        entity = self._cached("entities", key)
+        if entity is not None:
+            return entity
+        missed = ("entities",) + key
+        if missed in self.unresolved:
+            self._count_unresolved(key[0])
+            return None
+
+        if self._use_hub():
+            try:
+                entity, record = self.hub.resolve_entity(phrase,
+                                                         min_confidence)
+            except HubUnavailable:
+                pass
+            else:
+                if record is not None:
+                    self._remember(record)
+                return self._resolved_entity(key, entity)
+
+        candidates = []
+        for result in self._request(Search().multi, phrase):
+            if result.get("media_type") not in ("movie", "tv", "person"):
+                continue
+            if result.get("media_type") == "movie":
+                self._remember(MovieRecord.from_tmdb(result))
+            candidates.append(EntityRecord.from_tmdb(result))
+        ranked = _rank(candidates, phrase, min_confidence)
+        if not ranked:
+            return self._resolved_entity(key, None)
+        entity = ranked[0][0]
+        LOG.debug(f"Chosen {entity.kind}: {entity.name} out of "
+                  f"{len(ranked)} candidates")
+        return self._resolved_entity(key, entity)
+
+    def _resolved_entity(self, key, entity):
+        if entity is None:
+            self.unresolved.put(("entities",) + key, True)
+            self._count_unresolved(key[0])
+            return None
+        self._store("entities", key, entity)
+        if entity.kind == "movie":
+            self._store("titles", key, entity.id)
+        return entity
+
+    def _resolved(self, key, record):
+        if record is None:
+            self.unresolved.put(key, True)
+            self._count_unresolved(key[0])
+        else:
+            self._store("titles", key, record.id)
+        return record
+
+    def _use_hub(self):
+        return self.hub is not None and self.hub.available
+
+    def _count_unresolved(self, phrase):
+        with self._metrics_lock:
+            if phrase not in self.unresolved_titles and \
+                    len(self.unresolved_titles) >= MAX_UNRESOLVED_TITLES:
+                # make room by forgetting the rarest title
+                rarest, _ = self.unresolved_titles.most_common()[-1]
+                del self.unresolved_titles[rarest]
+            self.unresolved_titles[phrase] += 1
+        LOG.debug(f"Could not resolve {phrase!r}, "
+                  f"{self.unresolved_titles[phrase]} times so far")
+
+    def stats(self):
+        """ Entries, serialized bytes, hit and miss counts per cache, hit
+        and miss counts per endpoint, prefetch usage and the most asked for
+        titles that could not be found."""
+        caches = dict(self._sections, unresolved=self.unresolved)
+        shared, snapshot = self.shared, self._snapshot
+        if shared is not None:
+            caches["shared"] = shared
+        with self._prefetch_lock:
+            prefetch = dict(self.prefetch_stats)
+        with self._metrics_lock:
+            unresolved = self.unresolved_titles.most_common(20)
+            lookups = dict(self.endpoint_stats)
+        endpoints = {}
+        for (endpoint, outcome), count in lookups.items():
+            endpoints.setdefault(endpoint, {"hits": 0, "misses": 0})
+            endpoints[endpoint][outcome] = count
+        for counts in endpoints.values():
+            counts["hit_ratio"] = _ratio(counts["hits"], counts["misses"])
+        stats = {
+            "caches": {name: {"entries": len(cache), "hits": cache.hits,
+                              "misses": cache.misses,
+                              "hit_ratio": _ratio(cache.hits, cache.misses)}
+                       for name, cache in caches.items()},
+            "endpoints": endpoints,
+            "prefetch": prefetch,
+            "unresolved_titles": unresolved,
+        }
+        for name, cache in self._sections.items():
+            stats["caches"][name]["bytes"] = sum(
+                len(json.dumps(_ENCODERS[name](v), separators=(",", ":")))
+                for _, v, _ in cache.items())
+        if shared is not None:
+            stats["caches"]["shared"]["bytes"] = shared.size()
+        if snapshot is not None:
+            stats["snapshot"] = {"path": snapshot.path,
+                                 "bytes": os.path.getsize(snapshot.path)}
+        return stats
+
+    def invalidate(self, movie_id=None, title=None, endpoint=None):
+        """ Forget cached entries, so they are fetched from TMDb again.
+
+        movie_id drops everything about a movie: its details, the titles
+        and names resolved to it, its recommendations and watch providers.
+        title drops what a spoken title resolved to, endpoint a whole cache
+        section or list endpoint, like "movies" or "popular".  Entries are
+        dropped from memory, the shared cache and the snapshot.
+
+        Returns how many entries were dropped.
+        """
+        title = title.lower() if title else None
+        shared = self.shared
+        dropped = 0
+        for section, cache in self._sections.items():
+            values = {k: v for k, v, _ in cache.items()}
+            for key in self._keys(section):
+                if not _matches(section, key, values.get(key), self._peek,
+                                movie_id, title, endpoint):
+                    continue
+                cache.pop(key)
+                if shared is not None:
+                    shared.delete(section, key)
+                self._dropped.add((section, key))
+                dropped += 1
+        for key, _, _ in self.unresolved.items():
+            phrase = key[1] if key[0] == "entities" else key[0]
+            if endpoint == "unresolved" or phrase == title:
+                self.unresolved.pop(key)
+                dropped += 1
+        if shared is not None:
+            shared.flush()
+        return dropped
+
+    def _keys(self, section):
+        """ Keys of a section in memory, the shared cache and the snapshot.
+        """
+        keys = {k for k, _, _ in self._sections[section].items()}
+        shared, snapshot = self.shared, self._snapshot
+        if shared is not None:
+            keys.update(shared.keys(section))
+        if snapshot is not None:
+            keys.update(k for k in snapshot.keys(section)
+                        if (section, k) not in self._dropped)
+        return keys
+
+    def _peek(self, section, key):
+        """ Value of an entry outside of memory, without caching it."""
+        found = self._stored(section, key)
+        return None if found is None else _DECODERS[section](found[0])
+
+    def compact(self, snapshot_path=None):
+        """ Drop the expired entries of every cache and give the space they
+        took back, rewriting the snapshot at snapshot_path.
+
+        Returns {"memory": entries dropped, "shared": entries dropped,
+        "snapshot": entries written or None}.
+        """
+        caches = dict(self._sections, unresolved=self.unresolved)
+        result = {"memory": sum(c.purge() for c in caches.values()),
+                  "shared": 0, "snapshot": None}
+        shared = self.shared
+        if shared is not None:
+            result["shared"] = shared.compact()
+        if snapshot_path is not None:
+            self.save_snapshot(snapshot_path, force=True)
+            snapshot = self._snapshot
+            if snapshot is not None:
+                result["snapshot"] = sum(len(snapshot.keys(name))
+                                         for name in self._sections)
+        return result
+
+    def prefetch(self, movie_id):
+        """ Warm what a follow up question about a movie is likely to need.
+
+        Details with the cast and the recommendations are fetched on a low
+        priority worker, within prefetch_budget requests per hour.  Nothing
+        is prefetched while TMDb is unavailable.
+
+        Returns the futures of the queued prefetches.
+        """
+        if self.breaker.state != CLOSED:
+            return []
+        tasks = []
+        record = self._cached("movies", movie_id)
+        if record is None or not record.has_details:
+            tasks.append((("movie", movie_id),
+                          lambda: self.movie(movie_id, prefetch=True)))
+        first_page = ("recommendations", movie_id, 1)
+        if self._cached("lists", first_page) is None:
+            tasks.append((("lists", first_page),
+                          lambda: self.list_page(first_page,
+                                                 prefetch=True)))
+        futures = []
+        for key, task in tasks:
+            if not self._take_prefetch_budget():
+                with self._prefetch_lock:
+                    self.prefetch_stats["skipped"] += 1
+                continue
+            try:
+                futures.append(self._prefetch_executor.submit(
+                    self._run_prefetch, key, task))
+            except RuntimeError:
+                # shutting down
+                break
+        return futures
+
+    def _take_prefetch_budget(self):
+        now = time.monotonic()
+        with self._prefetch_lock:
+            while self._prefetch_times and \
+                    self._prefetch_times[0] < now - HOUR:
+                self._prefetch_times.popleft()
+            if len(self._prefetch_times) >= self.prefetch_budget:
+                return False
+            self._prefetch_times.append(now)
+            return True
+
+    def _run_prefetch(self, key, task):
+        try:
+            task()
+        except Exception as e:
+            LOG.debug(f"Prefetch of {key} failed: {e}")
+            with self._prefetch_lock:
+                self.prefetch_stats["failed"] += 1
+            return
+        with self._prefetch_lock:
+            self._prefetched.add(key)
+            self.prefetch_stats["fetched"] += 1
+
+    def _used(self, key):
+        """ Count a prefetched entry the first time a handler needs it."""
+        with self._prefetch_lock:
+            if key in self._prefetched:
+                self._prefetched.discard(key)
+                self.prefetch_stats["used"] += 1
+
+    @traced("search")
+    def search(self, title, year=None):
+        """ Search results for a title as a list of records."""
+        return [self._remember(MovieRecord.from_tmdb(m))
+                for m in self._request(Search().movies, title, year=year)]
+
+    @traced("movie")
+    def movie(self, movie_id, prefetch=False):
+        """ Full record of a movie, details, top cast and keywords in one
+        request."""
+        record = self._cached("movies", movie_id)
+        if record is not None and record.has_details:
+            if not prefetch:
+                self._used(("movie", movie_id))
+            return record
+        with self._refresh_lock:
+            pending = self._fetching.get(movie_id)
+            if pending is None:
+                pending = self._fetching[movie_id] = Future()
+                fetching = True
+            else:
+                fetching = False
+        if not fetching:
+            # already on its way, None if that request failed
+            record = _wait(pending)
+            if record is not None:
+                return record
+            return self._fetch_movie(movie_id)
+        try:
+            record = self._fetch_movie(movie_id)
+        except BaseException:
+            pending.set_result(None)
+            raise
+        finally:
+            with self._refresh_lock:
+                self._fetching.pop(movie_id, None)
+        pending.set_result(record)
+        return record
+
+    def _fetch_movie(self, movie_id):
+        if self._use_hub():
+            try:
+                return self._remember(self.hub.movie(movie_id))
+            except HubUnavailable:
+                pass
+        details = self._request(Movie().details, movie_id,
+                                append_to_response="credits,keywords")
+        return self._remember(MovieRecord.from_tmdb(details))
+
+    @traced("list")
+    def list_page(self, key, prefetch=False):
+        """ A page of a movie list, key is (endpoint, *args, page), stale
+        while revalidate.
+
+        Only an empty cache makes the caller wait for TMDb. A list past its
+        soft TTL is returned as is and refreshed in the background.
+        """
+        movies, fresh = self._cached_stale("lists", key)
+        if movies is None:
+            with self._refresh_lock:
+                pending = self._refreshing.get(key)
+            if pending is not None:
+                # already on its way, no need to ask twice
+                try:
+                    movies = pending.result()
+                except CancelledError:
+                    pass
+            if movies is None:
+                movies = self._fetch_list(key)
+            return movies
+        if not prefetch:
+            self._used(("lists", key))
+        if not fresh:
+            self._fetch_list_in_background(key)
+        return movies
+
+    def _fetch_list(self, key):
+        shared = self.shared
+        if shared is not None:
+            # another process may have refreshed it already
+            found = shared.get("lists", key)
+            if found is not None and self._is_fresh_list(found[1]):
+                data, expires = found
+                movies = _DECODERS["lists"](data)
+                self.lists.put(key, movies, expires=expires)
+                return movies
+        movies = None
+        if self._use_hub():
+            try:
+                movies = tuple(self._remember(m)
+                               for m in self.hub.list_page(key))
+            except HubUnavailable:
+                pass
+        if movies is None:
+            movies = tuple(
+                self._remember(MovieRecord.from_tmdb(m))
+                for m in self._request(LISTS[key[0]], *key[1:]))
+        self._store("lists", key, movies)
+        return movies
+
+    @staticmethod
+    def is_list_key(key):
+        """ True if key is (endpoint, *args, page) of a known list."""
+        return len(key) >= 2 and key[0] in LISTS and \
+            isinstance(key[-1], int)
+
+    def _is_fresh_list(self, expires):
+        return expires - self.lists.ttl + self.lists.soft_ttl > time.time()
+
+    def _fetch_list_in_background(self, key):
+        def refresh():
+            try:
+                movies = self._fetch_list(key)
+                LOG.debug(f"Fetched list {key} in the background")
+                return movies
+            except TMDbUnavailable as e:
+                LOG.debug(f"Could not fetch list {key}: {e}")
+            except Exception as e:
+                # a stale list stays in use until the hard TTL
+                LOG.warning(f"Could not fetch list {key}: {e}")
+            finally:
+                with self._refresh_lock:
+                    self._refreshing.pop(key, None)
+
+        with self._refresh_lock:
+            if key in self._refreshing:
+                return
+            try:
+                self._refreshing[key] = self._executor.submit(refresh)
+            except RuntimeError:
+                # shutting down
+                pass
+
+    @traced("watch_providers")
+    def watch_providers(self, movie_id, region):
+        """ Services offering a movie in a region.
+
+        Returns {offer kind: provider names} for the PROVIDER_KINDS that
+        have any, best offers first.  Offers are cached per region for a
+        day as provider ids, the names come from the provider list of the
+        region, cached on its own.
+        """
+        offers = self.watch_provider_offers(movie_id, region)
+        names = self.watch_provider_names(region)
+        return {kind: tuple(names[i] for i in ids if i in names)
+                for kind, ids in offers.items()}
+
+    def watch_provider_offers(self, movie_id, region):
+        """ {offer kind: provider ids} of a movie in a region.
+
+        Providers missing from the cached provider list of the region are
+        added to it.
+        """
+        key = (region, movie_id)
+        offers = self._cached("providers", key)
+        if offers is not None:
+            return offers
+        found = None
+        if self._use_hub():
+            try:
+                found = self.hub.watch_provider_offers(movie_id, region)
+            except HubUnavailable:
+                pass
+        if found is None:
+            response = _json(self._request(Movie().watch_providers,
+                                           movie_id))
+            regional = (response.get("results") or {}).get(region) or {}
+            offers, named = {}, {}
+            for kind in PROVIDER_KINDS:
+                providers = sorted(regional.get(kind) or (),
+                                   key=lambda p: p.get("display_priority", 0))
+                if providers:
+                    offers[kind] = tuple(p["provider_id"] for p in providers)
+                    named.update((p["provider_id"], p["provider_name"])
+                                 for p in providers)
+            found = offers, named
+        offers, named = found
+        self._store("providers", key, offers)
+        names = self.watch_provider_names(region)
+        # providers newer than the cached list
+        missing = {i: name for i, name in named.items() if i not in names}
+        if missing:
+            self._store("provider_names", region, {**names, **missing})
+        return offers
+
+    def watch_provider_names(self, region):
+        """ {provider id: name} of the watch providers in a region."""
+        names = self._cached("provider_names", region)
+        if names is not None:
+            return names
+        if self._use_hub():
+            try:
+                names = self.hub.watch_provider_names(region)
+            except HubUnavailable:
+                pass
+        if names is None:
+            names = {p["provider_id"]: p["provider_name"]
+                     for p in self._request(Provider().movie_providers,
+                                            region)}
+        self._store("provider_names", region, names)
+        return names
+
+    @traced("filmography")
+    def filmography(self, person_id):
+        """ Filmography of the movies a person played in."""
+        filmography = self._cached("filmographies", person_id)
+        if filmography is not None:
+            return filmography
+        if self._use_hub():
+            try:
+                filmography = self.hub.filmography(person_id)
+            except HubUnavailable:
+                pass
+        if filmography is None:
+            filmography = Filmography.from_tmdb(
+                self._request(Person().movie_credits, person_id))
+        self._store("filmographies", person_id, filmography)
+        return filmography
+
+    def similarity_index(self):
+        """ SimilarityIndex of the cached movies.
+
+        It is only rebuilt when movies with features came or went, most
+        writes to the cache are search and list results without any.
+        """
+        with self._similar_lock:
+            if self._similar_changes != self.movies.changes:
+                self._similar_changes = self.movies.changes
+                records = [record for _, record, _ in self.movies.items()
+                           if record.genres or record.keyword_ids]
+                ids = frozenset(record.id for record in records)
+                if ids != self._similar_ids:
+                    self._similar_ids = ids
+                    self._similar = SimilarityIndex(records)
+            return self._similar
+
+    @traced("recommend")
+    def recommend(self, movie_id, count):
+        """ Up to count movies like movie_id, best first.
+
+        TMDb's recommendations take turns with the cached movies most
+        similar in genres and keywords.  Without TMDb the cached movies
+        answer alone, so a movie with cached details gets recommendations
+        offline too.
+
+        A cached recommendations list answers right away with whatever
+        record of the movie is cached, missing details are left to the
+        prefetch.  Otherwise the details are asked for alongside the list.
+        """
+        unavailable = None
+        record = self._cached("movies", movie_id)
+        details = None
+        if record is None or not record.has_details:
+            if self._cached("lists", ("recommendations", movie_id, 1)) \
+                    is None:
+                details = self._movie_in_background(movie_id)
+            else:
+                self.prefetch(movie_id)
+        try:
+            # a cached page is served while TMDb is down as well
+            remote = self.recommendations(movie_id).take(count)
+        except TMDbUnavailable as e:
+            remote, unavailable = [], e
+        if details is not None:
+            try:
+                record = _wait(details)
+            except TMDbUnavailable as e:
+                unavailable = e
+        local = []
+        if record is not None:
+            local = [r for r, _ in
+                     self.similarity_index().top_k([record], count)[0]]
+        movies = {}
+        for pair in zip_longest(remote, local):
+            for movie in pair:
+                if movie is not None and movie.id != movie_id:
+                    movies.setdefault(movie.id, movie)
+        if not movies and unavailable is not None:
+            raise unavailable
+        return list(movies.values())[:count]
+
+    def _movie_in_background(self, movie_id):
+        """ Future of the details of a movie, fetched as part of the
+        current lookup."""
+        token = current_token()
+        parent = current_span()
+
+        def fetch():
+            with running(token), activate(parent):
+                return self.movie(movie_id)
+
+        return self._executor.submit(fetch)
+
+    def recommendations(self, movie_id):
+        return MoviePages(self, ("recommendations", movie_id))
+
+    def popular(self):
+        return MoviePages(self, ("popular",))
+
+    def top_rated(self):
+        return MoviePages(self, ("top_rated",))
+
+    def trending(self, window="day"):
+        return MoviePages(self, ("trending", window))
+
+    def now_playing(self, region=None):
+        return MoviePages(self, ("now_playing", region))
+
+    def upcoming(self, region=None):
+        return MoviePages(self, ("upcoming", region))
+
+
+class MoviePages:
+    """ Lazy iterator over the movies of a paged TMDb list.
+
+    Pages are only requested once the reader runs past the previous one,
+    and each page is cached on its own.  Getting close to the end of a page
+    starts fetching the next one in the background.
+    """
+
+    def __init__(self, catalog, key):
+        self._catalog = catalog
+        self._key = key
+
+    def _page(self, page):
+        return self._catalog.list_page(self._key + (page,))
+
+    def _prefetch_page(self, page):
+        key = self._key + (page,)
+        if self._catalog._cached("lists", key) is None:
+            self._catalog._fetch_list_in_background(key)
+
+    def __iter__(self):
+        for page in range(1, MAX_PAGES + 1):
+            movies = self._page(page)
+            if not movies:
+                return
+            last_page = len(movies) < PAGE_SIZE or page == MAX_PAGES
+            for i, movie in enumerate(movies):
+                if not last_page and i == len(movies) - NEXT_PAGE_MARGIN:
+                    self._prefetch_page(page + 1)
+                yield movie
+            if last_page:
+                return
+
+    def take(self, count):
+        """ The first count movies, fetching only the pages needed."""
+        return list(islice(self, count))
+
+
+def _rank(candidates, query, min_confidence):
+    with span("fuzzy_match", query=query,
+              candidates=len(candidates)) as match:
+        ranked = rank_candidates(candidates, query, min_confidence)
+        if match is not None:
+            match.set(matches=len(ranked))
+        return ranked
+
+
+def _endpoint(section, key):
+    """ What a cache lookup is counted under, the endpoint of a list."""
+    return key[0] if section == "lists" else section
+
+
+def _ratio(hits, misses):
+    return round(hits / (hits + misses), 3) if hits + misses else None
+
+
+def _matches(section, key, value, peek, movie_id, title, endpoint):
+    """ True if a cache entry is one invalidate() was asked to drop.
+
+    value is the cached value if it is in memory, else peek(section, key)
+    reads it from the shared cache or the snapshot.
+    """
+    if endpoint is not None and endpoint == _endpoint(section, key):
+        return True
+    if title is not None and section in ("titles", "entities") and \
+            key[0] == title:
+        return True
+    if movie_id is None:
+        return False
+    if section == "movies":
+        return key == movie_id
+    if section == "lists":
+        return key[0] == "recommendations" and key[1] == movie_id
+    if section == "providers":
+        return key[1] == movie_id
+    if section not in ("titles", "entities"):
+        return False
+    if value is None:
+        value = peek(section, key)
+    if section == "titles":
+        return value == movie_id
+    return value is not None and value.kind == "movie" and \
+        value.id == movie_id
+
+
+def _wait(future):
+    """ Result of future, a cancelled lookup stops waiting for it."""
+    token = current_token()
+    if token is not None:
+        done = Event()
+        future.add_done_callback(lambda _: done.set())
+        token.on_cancel(done.set)
+        done.wait()
+        if not future.done():
+            future.cancel()
+            raise LookupCancelled(token.session_id)
+    return future.result()
+
+
+def _json(result):
+    """ Plain json of a tmdbv3api result, for the responses its wrappers
+    mangle, like objects keyed by country code."""
+    return getattr(result, "_json", result)
+
+
+class _TimeoutSession(requests.Session):
+    """ Session that gives up on requests after REQUEST_TIMEOUT."""
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+        return super().request(*args, **kwargs)
+
+
+def _use_request_timeout():
+    """ Make tmdbv3api requests time out.
+
+    Its own response cache calls requests without a session, and so without
+    a timeout, and is not needed on top of the catalog caches.
+    """
+    if not isinstance(TMDb._session, _TimeoutSession):
+        TMDb(session=_TimeoutSession())
+    TMDb().cache = False
+
+
+def _lower_thread_priority():
+    """ Renice the calling thread, Linux applies niceness per thread."""
+    try:
+        os.setpriority(os.PRIO_PROCESS, get_native_id(), PREFETCH_NICENESS)
+    except (AttributeError, OSError):
+        pass
@@ -0,0 +1,172 @@
+import time
+from uuid import uuid4
+
+from ovos_bus_client.message import Message
+from ovos_utils.log import LOG
+
+from .breaker import TMDbUnavailable
+from .records import EntityRecord, Filmography, MovieRecord
+
+# Satellites ask the hub with this message, the hub replies to the message
+# type named in "reply_to"
+HUB_LOOKUP = "ovos.moviemaster.hub.lookup"
+
+# Seconds a satellite stops asking a hub that did not answer in time
+HUB_RETRY = 60
+
+
+class HubUnavailable(Exception):
+    """ The hub did not answer in time."""
+
+
+def _encode(record):
+    return record.to_tuple() if record is not None else None
+
+
+def _decode(data):
+    return MovieRecord.from_tuple(data) if data is not None else None
+
+
+class HubClient:
+    """ Catalog lookups forwarded to a hub over the messagebus.
+
+    Used by a satellite instead of asking TMDb itself.  After the hub missed
+    a reply the satellite goes to TMDb directly for HUB_RETRY seconds.
+    """
+
+    def __init__(self, bus, timeout=3.0):
+        self.bus = bus
+        self.timeout = timeout
+        self._down_until = 0
+
+    @property
+    def available(self):
+        return time.monotonic() >= self._down_until
+
+    def _ask(self, op, **data):
+        reply_to = f"{HUB_LOOKUP}.{uuid4().hex}"
+        reply = self.bus.wait_for_response(
+            Message(HUB_LOOKUP, dict(data, op=op, reply_to=reply_to)),
+            reply_type=reply_to, timeout=self.timeout)
+        if reply is None:
+            self._down_until = time.monotonic() + HUB_RETRY
+            LOG.warning(f"MovieMaster hub did not answer within "
+                        f"{self.timeout}s, asking TMDb directly")
+            raise HubUnavailable(op)
+        error = reply.data.get("error")
+        if error == "unavailable":
+            raise TMDbUnavailable("the hub can not reach TMDb")
+        if error:
+            raise HubUnavailable(error)
+        return reply.data
+
+    def resolve(self, phrase, min_confidence, prefixes=None, suffixes=None):
+        return _decode(self._ask("resolve", phrase=phrase,
+                                 min_confidence=min_confidence,
+                                 prefixes=prefixes, suffixes=suffixes
+                                 )["record"])
+
+    def resolve_entity(self, phrase, min_confidence):
+        """ (EntityRecord or None, MovieRecord of a movie or None)"""
+        reply = self._ask("entity", phrase=phrase,
+                          min_confidence=min_confidence)
+        entity = reply["entity"]
+        return (EntityRecord.from_tuple(entity) if entity is not None
+                else None, _decode(reply["record"]))
+
+    def movie(self, movie_id):
+        return _decode(self._ask("movie", movie_id=movie_id)["record"])
+
+    def list_page(self, key):
+        return tuple(_decode(m)
+                     for m in self._ask("list", key=list(key))["movies"])
+
+    def watch_provider_offers(self, movie_id, region):
+        """ ({offer kind: provider ids}, {provider id: name} of those)"""
+        reply = self._ask("providers", movie_id=movie_id, region=region)
+        # json has no int keys, names come as (id, name) pairs
+        return ({kind: tuple(ids) for kind, ids in reply["offers"].items()},
+                dict(reply["names"]))
+
+    def watch_provider_names(self, region):
+        return dict(self._ask("provider_names", region=region)["names"])
+
+    def filmography(self, person_id):
+        return Filmography.from_tuple(
+            self._ask("filmography", person_id=person_id)["filmography"])
+
+
+class HubServer:
+    """ Answers the lookups of satellites from the catalog of the hub.
+
+    Lookups may have to wait for TMDb, so they are answered on executor
+    instead of the messagebus thread.
+    """
+
+    def __init__(self, bus, catalog, executor):
+        self.bus = bus
+        self.catalog = catalog
+        self.executor = executor
+        self.bus.on(HUB_LOOKUP, self.handle_lookup)
+
+    def shutdown(self):
+        self.bus.remove(HUB_LOOKUP, self.handle_lookup)
+
+    def handle_lookup(self, message):
+        if not message.data.get("reply_to"):
+            return
+        try:
+            self.executor.submit(self._answer, message)
+        except RuntimeError:
+            # shutting down, the satellite falls back on its own
+            pass
+
+    def _lookup(self, data):
+        op = data.get("op")
+        if op == "resolve":
+            record = self.catalog.resolve(data["phrase"],
+                                          data["min_confidence"],
+                                          data.get("prefixes"),
+                                          data.get("suffixes"))
+            return {"record": _encode(record)}
+        if op == "entity":
+            entity = self.catalog.resolve_entity(data["phrase"],
+                                                 data["min_confidence"])
+            record = None
+            if entity is not None and entity.kind == "movie":
+                # the satellite caches the movie like the hub did
+                record = self.catalog.movies.get(entity.id)
+            return {"entity": _encode(entity), "record": _encode(record)}
+        if op == "movie":
+            return {"record": _encode(self.catalog.movie(data["movie_id"]))}
+        if op == "list":
+            key = tuple(data["key"])
+            if not self.catalog.is_list_key(key):
+                return {"error": f"unknown list {key}"}
+            return {"movies": [_encode(m)
+                               for m in self.catalog.list_page(key)]}
+        if op == "providers":
+            offers = self.catalog.watch_provider_offers(data["movie_id"],
+                                                        data["region"])
+            names = self.catalog.watch_provider_names(data["region"])
+            return {"offers": {kind: list(ids)
+                               for kind, ids in offers.items()},
+                    "names": [(i, names[i]) for ids in offers.values()
+                              for i in ids if i in names]}
+        if op == "provider_names":
+            names = self.catalog.watch_provider_names(data["region"])
+            return {"names": sorted(names.items())}
+        if op == "filmography":
+            filmography = self.catalog.filmography(data["person_id"])
+            return {"filmography": filmography.to_tuple()}
+        return {"error": f"unknown lookup {op}"}
+
+    def _answer(self, message):
+        try:
+            reply = self._lookup(message.data)
+        except TMDbUnavailable:
+            reply = {"error": "unavailable"}
+        except Exception as e:
+            LOG.exception(f"Hub lookup {message.data} failed")
+            reply = {"error": str(e) or type(e).__name__}
+        self.bus.emit(message.reply(message.data["reply_to"], reply))
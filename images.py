@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from os.path import isfile, join
+from threading import Lock
+
+import requests
+from ovos_utils.log import LOG
+
+IMAGE_BASE = "https://image.tmdb.org/t/p/"
+# Widths TMDb renders posters and backdrops in, besides "original"
+POSTER_SIZES = (92, 154, 185, 342, 500, 780)
+BACKDROP_SIZES = (300, 780, 1280)
+
+# Seconds to wait for the image server to connect and to answer
+DOWNLOAD_TIMEOUT = (3.05, 10)
+
+INDEX_FILE = "index.json"
+
+
+def image_url(path, sizes, width):
+    """ URL of a TMDb image in the smallest size at least width wide."""
+    size = next((s for s in sizes if s >= width), sizes[-1])
+    return f"{IMAGE_BASE}w{size}{path}"
+
+
+class ImageCache:
+    """ Poster and backdrop files on disk, within a byte budget.
+
+    Files are named after the sha256 of their content so an image reachable
+    under several URLs is stored once; index.json maps URLs to files.  The
+    modification time of a file is bumped on every read, and the least
+    recently used files are removed once the budget is exceeded.
+
+    Downloads run on a background thread, callers get a local path right
+    away or a callback once the file is there.
+    """
+
+    def __init__(self, directory, budget):
+        self.directory = directory
+        self.budget = budget
+        os.makedirs(directory, exist_ok=True)
+        self._lock = Lock()
+        self._pending = {}
+        self._index = self._load_index()
+        self._session = requests.Session()
+        self._executor = ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="moviemaster-images")
+
+    def _load_index(self):
+        try:
+            with open(join(self.directory, INDEX_FILE)) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return {url: name for url, name in index.items()
+                if isfile(join(self.directory, name))}
+
+    def _save_index(self):
+        """ Must be called with the lock held."""
+        path = join(self.directory, INDEX_FILE)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(self._index, f)
+        os.replace(f"{path}.tmp", path)
+
+    def get(self, url):
+        """ Local path of a cached image, or None."""
+        with self._lock:
+            name = self._index.get(url)
+        if name is None:
+            return None
+        path = join(self.directory, name)
+        try:
+            os.utime(path)
+        except OSError:
+            # evicted meanwhile
+            return None
+        return path
+
+    def fetch(self, url, callback=None):
+        """ Local path of an image, downloading it in the background if
+        needed.
+
+        Returns the path if the image is cached, else None, and calls
+        callback(path) once the download finished.
+        """
+        path = self.get(url)
+        if path is not None:
+            return path
+        with self._lock:
+            if url in self._pending:
+                if callback is not None:
+                    self._pending[url].append(callback)
+                return None
+            self._pending[url] = [callback] if callback is not None else []
+        try:
+            self._executor.submit(self._download, url)
+        except RuntimeError:
+            # shutting down
+            with self._lock:
+                self._pending.pop(url, None)
+        return None
+
+    def _download(self, url):
+        path = None
+        try:
+            response = self._session.get(url, timeout=DOWNLOAD_TIMEOUT)
+            response.raise_for_status()
+            path = self._store(url, response.content)
+        except (requests.RequestException, OSError) as e:
+            LOG.warning(f"Could not download {url}: {e}")
+        with self._lock:
+            callbacks = self._pending.pop(url, [])
+        if path is not None:
+            for callback in callbacks:
+                try:
+                    callback(path)
+                except Exception as e:
+                    LOG.error(f"Image callback failed: {e}")
+
+    def _store(self, url, content):
+        name = hashlib.sha256(content).hexdigest() + \
+            os.path.splitext(url)[1].lower()
+        path = join(self.directory, name)
+        if not isfile(path):
+            with open(f"{path}.tmp", "wb") as f:
+                f.write(content)
+            os.replace(f"{path}.tmp", path)
+        else:
+            os.utime(path)
+        with self._lock:
+            self._index[url] = name
+            self._evict(keep=name)
+            self._save_index()
+        return path
+
+    def _evict(self, keep=None):
+        """ Remove the least recently used files over the budget.
+
+        Must be called with the lock held.
+        """
+        files = []
+        for name in set(self._index.values()):
+            try:
+                stat = os.stat(join(self.directory, name))
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in files)
+        removed = set()
+        for _, size, name in sorted(files):
+            if total <= self.budget:
+                break
+            if name == keep:
+                continue
+            try:
+                os.remove(join(self.directory, name))
+            except OSError:
+                continue
+            removed.add(name)
+            total -= size
+        if removed:
+            self._index = {url: name for url, name in self._index.items()
+                           if name not in removed}
+
+    def size(self):
+        """ Bytes used by the cached images."""
+        with self._lock:
+            names = set(self._index.values())
+        return sum(os.path.getsize(join(self.directory, n))
+                   for n in names if isfile(join(self.directory, n)))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
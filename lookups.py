@@ -0,0 +1,147 @@
+from contextlib import contextmanager
+from threading import Event, Lock, local
+
+_current = local()
+
+
+class LookupCancelled(Exception):
+    """ The lookup was abandoned, its answer is not wanted anymore."""
+
+
+class CancelToken:
+    """ Tells a running lookup it has been abandoned.
+
+    Whatever waits on behalf of the lookup registers a callback with
+    on_cancel(), so cancelling wakes it up right away.
+    """
+
+    def __init__(self, session_id=None):
+        self.session_id = session_id
+        self._event = Event()
+        self._callbacks = []
+        self._lock = Lock()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def check(self):
+        if self.cancelled:
+            raise LookupCancelled(self.session_id)
+
+    def on_cancel(self, callback):
+        """ Call callback() on cancel, or right away if already cancelled."""
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+def current_token():
+    """ CancelToken of the lookup running on this thread, or None."""
+    return getattr(_current, "token", None)
+
+
+@contextmanager
+def running(token):
+    """ Run the body as part of the lookup of token, on any thread."""
+    previous = current_token()
+    _current.token = token
+    try:
+        yield token
+    finally:
+        _current.token = previous
+
+
+class LookupTracker:
+    """ The lookups running for each session, so they can be cancelled.
+
+    Background work a lookup queued, like prefetches, is tracked per session
+    too, it is dropped when the session is stopped.
+    """
+
+    def __init__(self):
+        self._lookups = {}
+        self._queued = {}
+        self._lock = Lock()
+
+    def start(self, session_id):
+        """ CancelToken of a new lookup of session_id."""
+        token = CancelToken(session_id)
+        with self._lock:
+            self._lookups.setdefault(session_id, set()).add(token)
+        return token
+
+    def finish(self, token):
+        with self._lock:
+            tokens = self._lookups.get(token.session_id, set())
+            tokens.discard(token)
+            if not tokens:
+                self._lookups.pop(token.session_id, None)
+
+    @contextmanager
+    def lookup(self, session_id, token=None):
+        """ Run the body as a lookup of session_id, yields its CancelToken.
+
+        token is one from start(), by default a new lookup is started.  It
+        is the current_token() of the thread until the body ends.
+        """
+        if token is None:
+            token = self.start(session_id)
+        try:
+            with running(token):
+                yield token
+        finally:
+            self.finish(token)
+
+    def track(self, futures):
+        """ Remember futures queued by the current lookup, they are
+        cancelled with it and when its session is stopped."""
+        token = current_token()
+        if token is None:
+            return
+        for future in futures:
+            token.on_cancel(future.cancel)
+        with self._lock:
+            queued = [f for f in self._queued.get(token.session_id, [])
+                      if not f.done()]
+            self._queued[token.session_id] = queued + list(futures)
+
+    def busy(self, session_id=None):
+        """ True if a session, or any session, has something to cancel."""
+        with self._lock:
+            sessions = list(self._lookups) + list(self._queued) \
+                if session_id is None else [session_id]
+            return any(self._lookups.get(s) for s in sessions) or \
+                any(not f.done() for s in sessions
+                    for f in self._queued.get(s, ()))
+
+    def cancel(self, session_id=None, queued=False):
+        """ Cancel the lookups of a session, or of all sessions.
+
+        With queued the background work they left behind is cancelled too.
+        Returns how many lookups and queued tasks were cancelled.
+        """
+        with self._lock:
+            sessions = list(self._lookups) if session_id is None \
+                else [session_id]
+            tokens = [t for s in sessions for t in self._lookups.pop(s, ())]
+            futures = []
+            if queued:
+                sessions = list(self._queued) if session_id is None \
+                    else [session_id]
+                futures = [f for s in sessions
+                           for f in self._queued.pop(s, ())]
+        for token in tokens:
+            token.cancel()
+        return len(tokens) + sum(future.cancel() for future in futures)
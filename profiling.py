@@ -0,0 +1,92 @@
+import cProfile
+import os
+import pstats
+import random
+from collections import Counter
+from contextlib import contextmanager
+from os.path import join
+from threading import Lock, local
+
+from ovos_utils.log import LOG
+
+_current = local()
+
+
+def is_profiled():
+    """ True while this thread runs a sampled profile.  Work it would hand
+    to another thread should run inline instead, cProfile only sees the
+    thread that enabled it."""
+    return getattr(_current, "profiled", False)
+
+
+class Profiler:
+    """ Sampled cProfile runs of intent handlers, aggregated per intent.
+
+    A sample_rate share of the runs is profiled, 0 turns profiling off.
+    The profiles of an intent are added up and written to
+    <directory>/<intent>.pstats after every sample, ready for pstats or
+    snakeviz.
+
+    Only the thread running the handler is profiled, and only one handler
+    at a time; a run that would overlap with a profiled one is skipped.
+    While it is profiled the catalog sends its TMDb requests from that
+    thread, see is_profiled().
+    """
+
+    def __init__(self, directory, sample_rate=0.0):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        # intent -> pstats.Stats of all its samples
+        self._stats = {}
+        self._samples = Counter()
+        self._running = Lock()
+        self._lock = Lock()
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0
+
+    @contextmanager
+    def profile(self, intent):
+        """ Profile the body as a run of intent, if it is sampled."""
+        if not self.enabled or random.random() >= self.sample_rate or \
+                not self._running.acquire(blocking=False):
+            yield
+            return
+        profile = cProfile.Profile()
+        try:
+            try:
+                profile.enable()
+            except ValueError as e:
+                # another profiler is active in this process
+                LOG.debug(f"Not profiling {intent}: {e}")
+                yield
+                return
+            _current.profiled = True
+            try:
+                yield
+            finally:
+                _current.profiled = False
+                profile.disable()
+                self._add(intent, profile)
+        finally:
+            self._running.release()
+
+    def _add(self, intent, profile):
+        with self._lock:
+            stats = self._stats.get(intent)
+            if stats is None:
+                stats = self._stats[intent] = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+            self._samples[intent] += 1
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                stats.dump_stats(join(self.directory, f"{intent}.pstats"))
+            except OSError as e:
+                LOG.warning(f"Could not write the profile of {intent}: {e}")
+
+    def samples(self):
+        """ {intent: number of profiled runs}."""
+        with self._lock:
+            return dict(self._samples)
@@ -0,0 +1,236 @@
+from sys import intern
+
+# How many cast members are kept per movie, search_depth slices from these
+TOP_CAST = 10
+# How many titles a person is known for are kept
+TOP_KNOWN_FOR = 5
+# How many keywords are kept per movie, they describe it for similarity
+TOP_KEYWORDS = 20
+
+
+class MovieRecord:
+    """ The handful of TMDb movie fields the dialogs actually use.
+
+    tmdbv3api hands out AsObj wrappers holding the whole JSON payload, which
+    is far too heavy to keep around in a cache.  A record is treated as
+    immutable; use replace() to get an updated copy.
+
+    runtime and cast are None until the movie details have been fetched,
+    search and list results only fill in the basics.
+    """
+    __slots__ = ("id", "title", "release_date", "overview", "popularity",
+                 "runtime", "genres", "cast_ids", "cast", "poster_path",
+                 "backdrop_path", "keyword_ids")
+
+    def __init__(self, id, title, release_date="", overview="",
+                 popularity=0.0, runtime=None, genres=(), cast_ids=None,
+                 cast=None, poster_path=None, backdrop_path=None,
+                 keyword_ids=None):
+        self.id = id
+        self.title = title
+        self.release_date = release_date or ""
+        self.overview = overview or ""
+        self.popularity = popularity or 0.0
+        self.runtime = runtime
+        self.genres = genres
+        self.cast_ids = cast_ids
+        self.cast = cast
+        self.poster_path = poster_path
+        self.backdrop_path = backdrop_path
+        self.keyword_ids = keyword_ids
+
+    @classmethod
+    def from_tmdb(cls, obj):
+        """ Build a record from a tmdbv3api result or a plain TMDb dict.
+
+        Credits and keywords are picked up when the details were requested
+        with append_to_response=credits,keywords.
+        """
+        get = obj.get
+        runtime = get("runtime")
+        genres = tuple(intern(g["name"]) for g in get("genres") or ())
+        cast_ids = cast = None
+        credits = get("credits")
+        if credits is not None:
+            top = list(credits.get("cast") or ())[:TOP_CAST]
+            cast_ids = tuple(c["id"] for c in top)
+            cast = tuple(c["name"] for c in top)
+        keyword_ids = None
+        keywords = get("keywords")
+        if keywords is not None:
+            keyword_ids = tuple(
+                k["id"] for k in
+                list(keywords.get("keywords") or ())[:TOP_KEYWORDS])
+        return cls(get("id"), get("title") or get("name") or "",
+                   get("release_date"), get("overview"),
+                   get("popularity"), runtime, genres, cast_ids, cast,
+                   get("poster_path"), get("backdrop_path"), keyword_ids)
+
+    @classmethod
+    def from_tuple(cls, data):
+        """ Inverse of to_tuple(), also reads the shorter tuples of older
+        versions."""
+        record = cls(*data)
+        record.genres = tuple(intern(g) for g in record.genres)
+        if record.cast_ids is not None:
+            record.cast_ids = tuple(record.cast_ids)
+            record.cast = tuple(record.cast)
+        if record.keyword_ids is not None:
+            record.keyword_ids = tuple(record.keyword_ids)
+        return record
+
+    def to_tuple(self):
+        """ Plain tuple of the fields, cheap to serialize."""
+        return tuple(getattr(self, f) for f in self.__slots__)
+
+    def replace(self, **changes):
+        """ Copy of this record with some fields changed."""
+        data = dict(zip(self.__slots__, self.to_tuple()))
+        data.update(changes)
+        return MovieRecord(**data)
+
+    @property
+    def has_details(self):
+        return self.runtime is not None and self.cast is not None
+
+    @property
+    def year(self):
+        try:
+            return int(self.release_date[:4])
+        except ValueError:
+            return None
+
+    def get(self, key, default=None):
+        # Lets records stand in for TMDb results in _create_dialog_list
+        return getattr(self, key, default) if key in self.__slots__ \
+            else default
+
+    def __eq__(self, other):
+        return isinstance(other, MovieRecord) and \
+            self.to_tuple() == other.to_tuple()
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f"MovieRecord({self.id}, {self.title!r}, {self.release_date!r})"
+
+
+class EntityRecord:
+    """ A movie, TV show or person found by a multi search.
+
+    kind is the TMDb media_type, "movie", "tv" or "person".  date is the
+    release or first air date, known_for the titles a person is best
+    known for.  Like MovieRecord it is immutable and cheap to cache.
+    """
+    __slots__ = ("kind", "id", "name", "date", "overview", "popularity",
+                 "known_for")
+
+    def __init__(self, kind, id, name, date="", overview="", popularity=0.0,
+                 known_for=()):
+        self.kind = intern(kind)
+        self.id = id
+        self.name = name
+        self.date = date or ""
+        self.overview = overview or ""
+        self.popularity = popularity or 0.0
+        self.known_for = tuple(known_for)
+
+    @classmethod
+    def from_tmdb(cls, obj):
+        """ Build a record from a multi search result."""
+        get = obj.get
+        known_for = tuple(k.get("title") or k.get("name") or ""
+                          for k in list(get("known_for") or ())
+                          [:TOP_KNOWN_FOR])
+        return cls(get("media_type"), get("id"),
+                   get("title") or get("name") or "",
+                   get("release_date") or get("first_air_date"),
+                   get("overview"), get("popularity"), known_for)
+
+    @classmethod
+    def from_tuple(cls, data):
+        return cls(*data)
+
+    def to_tuple(self):
+        return tuple(getattr(self, f) for f in self.__slots__)
+
+    # resolver.rank_candidates ranks these like movies
+    @property
+    def title(self):
+        return self.name
+
+    @property
+    def release_date(self):
+        return self.date
+
+    @property
+    def year(self):
+        try:
+            return int(self.date[:4])
+        except ValueError:
+            return None
+
+    def __eq__(self, other):
+        return isinstance(other, EntityRecord) and \
+            self.to_tuple() == other.to_tuple()
+
+    def __hash__(self):
+        return hash((self.kind, self.id))
+
+    def __repr__(self):
+        return f"EntityRecord({self.kind!r}, {self.id}, {self.name!r})"
+
+
+class Filmography:
+    """ The movies a person played in, as a compact set of movie ids.
+
+    Only the id, title and popularity of each movie are kept, in parallel
+    tuples, with a frozenset of the ids for fast intersection.
+    """
+    __slots__ = ("ids", "titles", "popularity", "_ids", "_positions")
+
+    def __init__(self, ids=(), titles=(), popularity=()):
+        self.ids = tuple(ids)
+        self.titles = tuple(intern(t) for t in titles)
+        self.popularity = tuple(popularity)
+        self._ids = frozenset(self.ids)
+        self._positions = None
+
+    @classmethod
+    def from_tmdb(cls, credits):
+        """ Build it from the cast part of a person's movie credits."""
+        movies = {}
+        for credit in credits.get("cast") or ():
+            # a movie is listed once per role
+            movies.setdefault(credit.get("id"), (
+                credit.get("title") or "", credit.get("popularity") or 0.0))
+        return cls(list(movies), [t for t, _ in movies.values()],
+                   [p for _, p in movies.values()])
+
+    @classmethod
+    def from_tuple(cls, data):
+        return cls(*data)
+
+    def to_tuple(self):
+        return self.ids, self.titles, self.popularity
+
+    def together(self, other):
+        """ Titles of the movies both played in, most popular first."""
+        if self._positions is None:
+            self._positions = {movie_id: i
+                               for i, movie_id in enumerate(self.ids)}
+        shared = [self._positions[movie_id]
+                  for movie_id in self._ids & other._ids]
+        shared.sort(key=lambda i: self.popularity[i], reverse=True)
+        return [self.titles[i] for i in shared]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __eq__(self, other):
+        return isinstance(other, Filmography) and \
+            self.to_tuple() == other.to_tuple()
+
+    def __repr__(self):
+        return f"Filmography({len(self)} movies)"
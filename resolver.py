@@ -0,0 +1,96 @@
+import math
+import re
+from datetime import date
+
+from lingua_franca.util import fuzzy_match
+
+# Anything that looks like a release year, from the silent era onwards
+YEAR_PATTERN = re.compile(r"\(?\b(1[89]\d\d|20\d\d)\b\)?")
+
+# How much the priors may move a candidate compared to the title match itself
+POPULARITY_WEIGHT = 0.15
+RECENCY_WEIGHT = 0.05
+
+
+def extract_year(phrase, prefixes=None, suffixes=None):
+    """ Split a year qualifier off a spoken movie title.
+
+    "the 1976 version of king kong" -> ("king kong", 1976)
+
+    The qualifier words around the year come from the skill vocab so they
+    can be translated.  Years that can not be a release date yet, or a
+    phrase that is only a year (the movie "1917"), are left alone.
+
+    Returns a tuple of the cleaned title and the year, or None.
+    """
+    match = YEAR_PATTERN.search(phrase)
+    if not match or match.group(0).strip("()") == phrase.strip():
+        return phrase, None
+    year = int(match.group(1))
+    if year > date.today().year + 2:
+        return phrase, None
+
+    before = phrase[:match.start()].rstrip()
+    after = phrase[match.end():].lstrip()
+    for prefix in sorted((p.lower() for p in prefixes or []),
+                         key=len, reverse=True):
+        if before.lower() == prefix or before.lower().endswith(" " + prefix):
+            before = before[:len(before) - len(prefix)].rstrip()
+            break
+    for suffix in sorted((s.lower() for s in suffixes or []),
+                         key=len, reverse=True):
+        if after.lower() == suffix or after.lower().startswith(suffix + " "):
+            after = after[len(suffix):].lstrip()
+            break
+
+    title = " ".join(f"{before} {after}".split())
+    if not title:
+        return phrase, None
+    return title, year
+
+
+def release_year(candidate):
+    """ Year part of a TMDb release_date, or None if it is unknown."""
+    release_date = getattr(candidate, "release_date", None) or ""
+    try:
+        return int(release_date[:4])
+    except ValueError:
+        return None
+
+
+def rank_candidates(candidates, query, min_confidence):
+    """ Order search results by how likely they are the movie that was meant.
+
+    Only titles matching the query with at least min_confidence are kept.
+    Remakes share a title, so the title match alone can not tell them
+    apart; a popularity prior and a smaller recency prior break the tie.
+
+    Returns a list of (candidate, score) tuples, best first.
+    """
+    query = query.lower()
+    matches = []
+    for c in candidates:
+        confidence = fuzzy_match(c.title.lower(), query)
+        if confidence >= min_confidence:
+            matches.append((c, confidence))
+    if not matches:
+        return []
+
+    max_popularity = max(
+        getattr(c, "popularity", 0) or 0 for c, _ in matches)
+    years = [y for y in (release_year(c) for c, _ in matches) if y]
+    oldest, newest = (min(years), max(years)) if years else (0, 0)
+
+    ranked = []
+    for c, confidence in matches:
+        score = confidence
+        popularity = getattr(c, "popularity", 0) or 0
+        if max_popularity > 0:
+            score += POPULARITY_WEIGHT * \
+                math.log1p(popularity) / math.log1p(max_popularity)
+        year = release_year(c)
+        if year and newest > oldest:
+            score += RECENCY_WEIGHT * (year - oldest) / (newest - oldest)
+        ranked.append((c, score))
+    ranked.sort(key=lambda r: r[1], reverse=True)
+    return ranked
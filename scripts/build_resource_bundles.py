@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Precompile the intent, dialog and vocab files of every locale into a
+locale/<lang>/bundle.json the skill loads instead of the single files.
+
+Run it after changing any resource file, sync_translations.py does so
+after importing translations.  With --check nothing is written and the
+exit code tells if a bundle is missing or out of date.
+"""
+import argparse
+import os
+import sys
+from os.path import dirname, isdir, join
+
+sys.path.insert(0, dirname(dirname(os.path.abspath(__file__))))
+from bundle import (ResourceBundle, build_bundle, compare_placeholders,  # noqa: E402
+                    source_hash, write_bundle)
+
+locale = f"{dirname(dirname(os.path.abspath(__file__)))}/locale"
+REFERENCE_LANG = "en-us"
+
+
+def main(check=False):
+    langs = sorted(lang for lang in os.listdir(locale)
+                   if isdir(join(locale, lang)))
+    reference, _ = build_bundle(join(locale, REFERENCE_LANG), REFERENCE_LANG)
+    failed = False
+    for lang in langs:
+        lang_dir = join(locale, lang)
+        current = ResourceBundle.load(lang_dir)
+        up_to_date = current is not None and \
+            current.hash == source_hash(lang_dir)
+        if check:
+            if not up_to_date:
+                print(f"{lang}: bundle is missing or out of date")
+                failed = True
+            continue
+
+        bundle, problems = build_bundle(lang_dir, lang)
+        problems += compare_placeholders(bundle, reference)
+        for problem in problems:
+            print(f"  {problem}")
+        if any("unbalanced" in p or "no usable" in p for p in problems):
+            print(f"{lang}: not written, fix the errors above")
+            failed = True
+            continue
+        samples = sum(len(s) for s in bundle["intents"].values())
+        print(f"{lang}: {len(bundle['intents'])} intents ({samples} samples), "
+              f"{len(bundle['dialogs'])} dialogs, "
+              f"{len(bundle['vocabs'])} vocabs"
+              f"{'' if up_to_date else ' (updated)'}")
+        if not up_to_date:
+            write_bundle(lang_dir, bundle)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--check", action="store_true",
+                        help="only report bundles that need a rebuild")
+    sys.exit(main(parser.parse_args().check))
@@ -1,80 +1,102 @@
 """this script should run in every PR originated from @gitlocalize-app
 TODO - before PR merge
+
+Only files whose content changed are written, so untouched resources keep
+their mtime, and languages are synced in parallel.  When anything changed
+the stale resource bundles are rebuilt afterwards, if the dependencies
+of the build are installed.
 """
 
+import argparse
 import json
-from os.path import dirname
 import os
+from concurrent.futures import ThreadPoolExecutor
+from os.path import dirname
 
-locale = f"{dirname(dirname(__file__))}/locale"
-tx = f"{dirname(dirname(__file__))}/translations"
+locale = f"{dirname(dirname(os.path.abspath(__file__)))}/locale"
+tx = f"{dirname(dirname(os.path.abspath(__file__)))}/translations"
 
+# translations/<lang>/<name> files, each mapping resource path -> samples
+RESOURCE_FILES = ("intents.json", "dialogs.json", "vocabs.json",
+                  "regexes.json")
 
-for lang in os.listdir(tx):
-    intents = f"{tx}/{lang}/intents.json"
-    dialogs = f"{tx}/{lang}/dialogs.json"
-    vocs = f"{tx}/{lang}/vocabs.json"
-    regexes = f"{tx}/{lang}/regexes.json"
 
-    os.makedirs(f"{locale}/{lang}", exist_ok=True)
-    
-    if os.path.isfile(intents):
-        with open(intents) as f:
-            data = json.load(f)
-        for fid, samples in data.items():
-            if samples:
-                samples = list(set([s.strip() for s in samples
-                           if s and s.strip() != "[UNUSED]"]))  # s may be None
-                if fid.startswith("/"):
-                    p = f"{locale}/{lang.lower()}{fid}"
-                else:
-                    p = f"{locale}/{lang.lower()}/{fid}"
-                os.makedirs(os.path.dirname(p), exist_ok=True)
-                with open(f"{locale}/{lang.lower()}/{fid}", "w") as f:
-                    f.write("\n".join(sorted(samples)))
+def _render(samples):
+    samples = set([s.strip() for s in samples
+                   if s and s.strip() != "[UNUSED]"])  # s may be None
+    return "\n".join(sorted(samples)).encode("utf-8")
 
-    if os.path.isfile(dialogs):
-        with open(dialogs) as f:
-            data = json.load(f)
-        for fid, samples in data.items():
-            if samples:
-                samples = list(set([s.strip() for s in samples
-                           if s and s.strip() != "[UNUSED]"]))  # s may be None
-                if fid.startswith("/"):
-                    p = f"{locale}/{lang.lower()}{fid}"
-                else:
-                    p = f"{locale}/{lang.lower()}/{fid}"
-                os.makedirs(os.path.dirname(p), exist_ok=True)
-                with open(f"{locale}/{lang.lower()}/{fid}", "w") as f:
-                    f.write("\n".join(sorted(samples)))
 
-    if os.path.isfile(vocs):
-        with open(vocs) as f:
-            data = json.load(f)
-        for fid, samples in data.items():
-            if samples:
-                samples = list(set([s.strip() for s in samples
-                           if s and s.strip() != "[UNUSED]"]))  # s may be None
-                if fid.startswith("/"):
-                    p = f"{locale}/{lang.lower()}{fid}"
-                else:
-                    p = f"{locale}/{lang.lower()}/{fid}"
-                os.makedirs(os.path.dirname(p), exist_ok=True)
-                with open(f"{locale}/{lang.lower()}/{fid}", "w") as f:
-                    f.write("\n".join(sorted(samples)))
+def _target(lang, fid):
+    if fid.startswith("/"):
+        return f"{locale}/{lang.lower()}{fid}"
+    return f"{locale}/{lang.lower()}/{fid}"
+
 
-    if os.path.isfile(regexes):
-        with open(regexes) as f:
+def sync_lang(lang, dry_run=False):
+    """ Write the resource files of one language that differ from the
+    translations.
+
+    Returns a dict listing the created and updated paths and the number of
+    files left untouched.
+    """
+    report = {"lang": lang, "created": [], "updated": [], "unchanged": 0}
+    for name in RESOURCE_FILES:
+        path = f"{tx}/{lang}/{name}"
+        if not os.path.isfile(path):
+            continue
+        with open(path) as f:
             data = json.load(f)
         for fid, samples in data.items():
-            if samples:
-                samples = list(set([s.strip() for s in samples
-                           if s and s.strip() != "[UNUSED]"]))  # s may be None
-                if fid.startswith("/"):
-                    p = f"{locale}/{lang.lower()}{fid}"
-                else:
-                    p = f"{locale}/{lang.lower()}/{fid}"
+            if not samples:
+                continue
+            content = _render(samples)
+            p = _target(lang, fid)
+            if os.path.isfile(p):
+                with open(p, "rb") as f:
+                    if f.read() == content:
+                        report["unchanged"] += 1
+                        continue
+                report["updated"].append(p)
+            else:
+                report["created"].append(p)
+            if not dry_run:
                 os.makedirs(os.path.dirname(p), exist_ok=True)
-                with open(f"{locale}/{lang.lower()}/{fid}", "w") as f:
-                    f.write("\n".join(sorted(samples)))
+                with open(p, "wb") as f:
+                    f.write(content)
+    return report
+
+
+def main(dry_run=False):
+    langs = sorted(os.listdir(tx))
+    with ThreadPoolExecutor() as pool:
+        reports = list(pool.map(lambda l: sync_lang(l, dry_run), langs))
+
+    changed = []
+    for report in reports:
+        print(f"{report['lang']}: {len(report['created'])} created, "
+              f"{len(report['updated'])} updated, "
+              f"{report['unchanged']} unchanged")
+        for kind in ("created", "updated"):
+            for p in report[kind]:
+                print(f"  {kind}: {os.path.relpath(p, locale)}")
+        if report["created"] or report["updated"]:
+            changed.append(report["lang"])
+
+    if changed and not dry_run:
+        try:
+            from build_resource_bundles import main as build_bundles
+        except ImportError as e:
+            # the bundles are built with the skill's own dependencies
+            print(f"WARNING: not rebuilding the resource bundles ({e}), "
+                  f"run scripts/build_resource_bundles.py")
+        else:
+            build_bundles()
+    return changed
+
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only report what would change")
+    main(parser.parse_args().dry_run)
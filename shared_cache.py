@@ -0,0 +1,227 @@
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import Future
+from os.path import dirname
+from queue import Queue
+from threading import Lock, Thread, local
+
+from ovos_utils.log import LOG
+
+from .snapshot import decode_key, encode_key
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    section TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (section, key)
+) WITHOUT ROWID
+"""
+
+# Seconds a statement waits for another process to finish writing
+BUSY_TIMEOUT = 5
+
+_STOP = object()
+
+
+class SharedCache:
+    """ Cache entries shared by every MovieMaster process on a host.
+
+    Backed by a SQLite database in WAL mode, so any number of processes
+    read at the same time while one of them writes.  Reads happen on the
+    calling thread, each thread has its own connection.  Writes, purges
+    included, are queued to a single writer thread per process that commits
+    them in batches, so a request never waits for the database lock of
+    another process.
+
+    Values are anything json can encode, keys are encoded like in the
+    snapshot files.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._local = local()
+        self._connections = []
+        self._lock = Lock()
+        self._closed = False
+        db = self._connect()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(_SCHEMA)
+        self._queue = Queue()
+        self._writer = Thread(target=self._write_loop, daemon=True,
+                              name="moviemaster-shared-cache")
+        self._writer.start()
+        self.purge()
+
+    @classmethod
+    def open(cls, path):
+        """ SharedCache at path, or None if the database is not usable."""
+        try:
+            os.makedirs(dirname(path), exist_ok=True)
+            return cls(path)
+        except (OSError, sqlite3.Error) as e:
+            LOG.warning(f"Not sharing the cache through {path}: {e}")
+            return None
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT,
+                                 isolation_level=None,
+                                 check_same_thread=False)
+            # losing the last writes on a power cut is fine for a cache
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+            with self._lock:
+                self._connections.append(db)
+        return db
+
+    def get(self, section, key):
+        """ (value, expires) of an entry that has not expired, else None."""
+        try:
+            row = self._connect().execute(
+                "SELECT value, expires FROM entries "
+                "WHERE section = ? AND key = ? AND expires > ?",
+                (section, encode_key(key), time.time())).fetchone()
+        except sqlite3.Error as e:
+            LOG.debug(f"Shared cache read failed: {e}")
+            row = None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0]), row[1]
+
+    def put(self, section, key, value, expires):
+        if self._closed:
+            return
+        self._queue.put(("put", (section, encode_key(key),
+                                 json.dumps(value, separators=(",", ":")),
+                                 expires)))
+
+    def delete(self, section, key):
+        if self._closed:
+            return
+        self._queue.put(("delete", (section, encode_key(key))))
+
+    def purge(self):
+        """ Drop the expired entries, queued like the other writes."""
+        if self._closed:
+            return
+        self._queue.put(("purge", ()))
+
+    def keys(self, section):
+        """ Keys of the entries of a section that have not expired."""
+        try:
+            rows = self._connect().execute(
+                "SELECT key FROM entries WHERE section = ? AND expires > ?",
+                (section, time.time())).fetchall()
+        except sqlite3.Error as e:
+            LOG.debug(f"Shared cache read failed: {e}")
+            return []
+        return [decode_key(key) for key, in rows]
+
+    def size(self):
+        """ Bytes the database takes on disk, with its write ahead log."""
+        return sum(os.path.getsize(p) for p in (self.path, f"{self.path}-wal")
+                   if os.path.isfile(p))
+
+    def compact(self):
+        """ Drop the expired entries and give the free space back, on the
+        writer thread after the writes queued before.
+
+        Returns how many entries were dropped.
+        """
+        if self._closed:
+            return 0
+        done = Future()
+        self._queue.put(("compact", done))
+        return done.result()
+
+    def _compact(self):
+        db = self._connect()
+        try:
+            removed = db.execute("DELETE FROM entries WHERE expires <= ?",
+                                 (time.time(),)).rowcount
+            db.execute("VACUUM")
+            db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error as e:
+            LOG.warning(f"Could not compact the shared cache: {e}")
+            return 0
+        return removed
+
+    def __len__(self):
+        try:
+            return self._connect().execute(
+                "SELECT COUNT(*) FROM entries WHERE expires > ?",
+                (time.time(),)).fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while not self._queue.empty() and batch[-1] is not _STOP:
+                batch.append(self._queue.get())
+            writes = []
+            for item in batch:
+                if item is _STOP:
+                    continue
+                op, args = item
+                if op != "compact":
+                    writes.append(item)
+                    continue
+                # VACUUM can not run inside the batch transaction
+                if writes:
+                    self._write(writes)
+                    writes = []
+                args.set_result(self._compact())
+            if writes:
+                self._write(writes)
+            for _ in batch:
+                self._queue.task_done()
+            if batch[-1] is _STOP:
+                return
+
+    def _write(self, writes):
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            for op, args in writes:
+                if op == "put":
+                    db.execute("INSERT OR REPLACE INTO entries "
+                               "VALUES (?, ?, ?, ?)", args)
+                elif op == "purge":
+                    db.execute("DELETE FROM entries WHERE expires <= ?",
+                               (time.time(),))
+                else:
+                    db.execute("DELETE FROM entries "
+                               "WHERE section = ? AND key = ?", args)
+            db.execute("COMMIT")
+        except sqlite3.Error as e:
+            LOG.warning(f"Could not write {len(writes)} entries to the "
+                        f"shared cache: {e}")
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+
+    def flush(self):
+        """ Wait until the queued writes are committed."""
+        self._queue.join()
+
+    def close(self):
+        """ Stop writing, reads from threads still holding on to the cache
+        find nothing from now on."""
+        self._closed = True
+        if self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join()
+        with self._lock:
+            for db in self._connections:
+                db.close()
+            self._connections = []
@@ -0,0 +1,75 @@
+import numpy as np
+
+
+def features(record):
+    """ What a movie is about, its genres and keywords."""
+    return [f"genre:{g}" for g in record.genres] + \
+        [f"keyword:{k}" for k in record.keyword_ids or ()]
+
+
+class SimilarityIndex:
+    """ Content based similarity of the cached movies.
+
+    Every movie is a row of a matrix over its genre and keyword features,
+    weighted by how rare a feature is (idf) and scaled to unit length, so
+    the cosine similarity of all the movies to a batch of them is a single
+    matrix product.
+
+    An index is never changed, a new one is built from scratch when the
+    cache changed.  It only ever holds the few hundred cached movies.
+    """
+
+    def __init__(self, records=()):
+        records = [r for r in records if features(r)]
+        columns = {}
+        for record in records:
+            for feature in features(record):
+                columns.setdefault(feature, len(columns))
+        matrix = np.zeros((len(records), len(columns)), dtype=np.float32)
+        for row, record in enumerate(records):
+            matrix[row, [columns[f] for f in features(record)]] = 1.0
+        # rare features say more about a movie than "Drama" does
+        idf = np.log((1 + len(records)) / (1 + matrix.sum(axis=0))) + 1
+        matrix *= idf
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True),
+                             1e-9)
+        self._records = records
+        self._ids = np.array([r.id for r in records], dtype=np.int64)
+        self._columns = columns
+        self._idf = idf.astype(np.float32)
+        self._matrix = matrix
+
+    def __len__(self):
+        return len(self._records)
+
+    def _vectors(self, records):
+        """ Unit rows of records, features the index lacks are ignored."""
+        vectors = np.zeros((len(records), len(self._columns)),
+                           dtype=np.float32)
+        for row, record in enumerate(records):
+            known = [self._columns[f] for f in features(record)
+                     if f in self._columns]
+            vectors[row, known] = self._idf[known]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-9)
+
+    def top_k(self, records, k):
+        """ The k movies most similar to each of records, in one batch.
+
+        Returns a list with a list of (MovieRecord, similarity) per record,
+        best first.  The movie itself and movies sharing nothing with it
+        are left out.
+        """
+        indexed = self._records
+        if not indexed or not records or k < 1:
+            return [[] for _ in records]
+        scores = self._vectors(records) @ self._matrix.T
+        scores[np.array([r.id for r in records])[:, None] == self._ids] = 0
+        k = min(k, len(indexed))
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in enumerate(best):
+            ranked = candidates[np.argsort(-scores[row, candidates])]
+            results.append([(indexed[i], float(scores[row, i]))
+                            for i in ranked if scores[row, i] > 0])
+        return results
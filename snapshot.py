@@ -0,0 +1,162 @@
+import json
+import mmap
+import os
+import struct
+import time
+from threading import Lock
+
+from ovos_utils.log import LOG
+
+MAGIC = b"MMSNAP1\n"
+_HEADER_LEN = struct.Struct("<I")
+
+
+def encode_key(key):
+    return json.dumps(list(key) if isinstance(key, tuple) else key)
+
+
+def decode_key(key):
+    key = json.loads(key)
+    return tuple(key) if isinstance(key, list) else key
+
+
+def write_snapshot(path, sections):
+    """ Write cache entries to a snapshot file.
+
+    sections maps a section name to a list of (key, value, expires) where
+    the value is anything json can encode.  The file starts with an index
+    of byte ranges so single entries can be decoded without touching the
+    rest.  It is written to a temporary file first and then moved in place
+    so a crash never leaves a half written snapshot behind.
+    """
+    index = {}
+    blobs = []
+    offset = 0
+    for section, entries in sections.items():
+        index[section] = {}
+        for key, value, expires in entries:
+            blob = json.dumps(value, separators=(",", ":")).encode("utf-8")
+            index[section][encode_key(key)] = (offset, len(blob), expires)
+            blobs.append(blob)
+            offset += len(blob)
+    header = json.dumps({"created": time.time(), "sections": index},
+                        separators=(",", ":")).encode("utf-8")
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(_HEADER_LEN.pack(len(header)))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp, path)
+    return sum(len(s) for s in index.values())
+
+
+class Snapshot:
+    """ Read only view of a snapshot file, decoded on demand.
+
+    Opening only maps the file; the index is parsed on the first lookup and
+    entries are decoded one by one as they are asked for.
+
+    Lookups may run on any thread.  Closing waits for the lookups in
+    progress: the file stays mapped until the last of them is done.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except ValueError:
+            # an empty file can not be mapped
+            self._file.close()
+            raise
+        self._index = None
+        self._data_start = 0
+        # lookups in progress, the map is closed once none are left
+        self._readers = 0
+        self._closing = False
+        self._lock = Lock()
+
+    @classmethod
+    def open(cls, path):
+        """ Snapshot for path, or None if there is no usable file."""
+        if not os.path.isfile(path):
+            return None
+        try:
+            snapshot = cls(path)
+        except (OSError, ValueError) as e:
+            LOG.warning(f"Ignoring unreadable cache snapshot {path}: {e}")
+            return None
+        if snapshot._map[:len(MAGIC)] != MAGIC:
+            LOG.warning(f"Ignoring cache snapshot {path}: unknown format")
+            snapshot.close()
+            return None
+        return snapshot
+
+    def _load_index(self):
+        start = len(MAGIC) + _HEADER_LEN.size
+        length, = _HEADER_LEN.unpack_from(self._map, len(MAGIC))
+        header = json.loads(self._map[start:start + length])
+        self._data_start = start + length
+        self._index = {section: {decode_key(k): v
+                                 for k, v in entries.items()}
+                       for section, entries in header["sections"].items()}
+
+    def _enter(self):
+        """ True if the file can be read until _leave() is called."""
+        with self._lock:
+            if self._closing:
+                return False
+            self._readers += 1
+            return True
+
+    def _leave(self):
+        with self._lock:
+            self._readers -= 1
+            if self._closing and not self._readers:
+                self._unmap()
+
+    def get(self, section, key):
+        """ (value, expires) of an entry that has not expired, else None."""
+        if not self._enter():
+            return None
+        try:
+            if self._index is None:
+                self._load_index()
+            entry = self._index.get(section, {}).get(key)
+            if entry is None:
+                return None
+            offset, length, expires = entry
+            if expires <= time.time():
+                return None
+            start = self._data_start + offset
+            return json.loads(self._map[start:start + length]), expires
+        finally:
+            self._leave()
+
+    def keys(self, section):
+        if not self._enter():
+            return []
+        try:
+            if self._index is None:
+                self._load_index()
+            return list(self._index.get(section, {}))
+        finally:
+            self._leave()
+
+    def close(self):
+        """ Unmap the file once the lookups in progress are done, later
+        lookups find nothing."""
+        with self._lock:
+            self._closing = True
+            if not self._readers:
+                self._unmap()
+
+    def _unmap(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = None
@@ -0,0 +1,992 @@
+# pylint: disable=missing-docstring
+import multiprocessing
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from unittest.mock import patch
+
+import pytest
+from requests.exceptions import ConnectionError as RequestsConnectionError
+from ovos_utils.fakebus import FakeBus
+from tmdbv3api.as_obj import AsObj
+from tmdbv3api.exceptions import TMDbException
+
+from ovos_skill_moviemaster.breaker import (CircuitBreaker, CircuitOpenError,
+                                            TMDbUnavailable)
+from ovos_skill_moviemaster.catalog import BREAKER_FAILURES, MovieCatalog
+from ovos_skill_moviemaster.hub import HubClient, HubServer
+from ovos_skill_moviemaster.lookups import LookupCancelled, LookupTracker
+from ovos_skill_moviemaster.records import (Filmography, MovieRecord,
+                                            TOP_CAST)
+from ovos_skill_moviemaster.shared_cache import SharedCache
+from ovos_skill_moviemaster.snapshot import Snapshot, write_snapshot
+
+
+def details_payload(movie_id=550, title="Fight Club", cast_size=60,
+                    crew_size=120):
+    """ A details response shaped like TMDb's, credits appended."""
+    person = {"adult": False, "gender": 2, "known_for_department": "Acting",
+              "original_name": "Someone", "popularity": 12.3,
+              "profile_path": "/abcdefghijklmnopqrstuvwxyz.jpg",
+              "credit_id": "52fe4250c3a36847f80149f3"}
+    return {
+        "adult": False, "backdrop_path": "/hZkgoQYus5vegHoetLkCJzb17zJ.jpg",
+        "belongs_to_collection": None, "budget": 63000000,
+        "genres": [{"id": 18, "name": "Drama"},
+                   {"id": 53, "name": "Thriller"}],
+        "homepage": "http://www.foxmovies.com/movies/fight-club",
+        "id": movie_id, "imdb_id": "tt0137523", "original_language": "en",
+        "original_title": title,
+        "overview": "A ticking-time-bomb insomniac and a slippery soap "
+                    "salesman channel primal male aggression into a "
+                    "shocking new form of therapy. " * 2,
+        "popularity": 61.4, "poster_path": "/pB8BM7pdSp6B6Ih7QZ4DrQ3PmJK.jpg",
+        "production_companies": [
+            {"id": i, "logo_path": None, "name": f"Company {i}",
+             "origin_country": "US"} for i in range(5)],
+        "production_countries": [{"iso_3166_1": "US",
+                                  "name": "United States of America"}],
+        "release_date": "1999-10-15", "revenue": 100853753, "runtime": 139,
+        "spoken_languages": [{"english_name": "English", "iso_639_1": "en",
+                              "name": "English"}],
+        "status": "Released", "tagline": "Mischief. Mayhem. Soap.",
+        "title": title, "video": False, "vote_average": 8.4,
+        "vote_count": 26280,
+        "keywords": {"keywords": [{"id": 825 + i, "name": f"keyword {i}"}
+                                  for i in range(30)]},
+        "credits": {
+            "cast": [dict(person, id=1000 + i, name=f"Actor {i}",
+                          cast_id=i, character=f"Character {i}", order=i)
+                     for i in range(cast_size)],
+            "crew": [dict(person, id=5000 + i, name=f"Crew {i}",
+                          department="Crew", job="Grip")
+                     for i in range(crew_size)]},
+    }
+
+
+def deep_sizeof(obj, seen=None):
+    """ Bytes held by an object and everything it references."""
+    seen = seen if seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen)
+                    for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(deep_sizeof(i, seen) for i in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), seen)
+    elif hasattr(obj, "__slots__"):
+        size += sum(deep_sizeof(getattr(obj, s), seen)
+                    for s in obj.__slots__ if hasattr(obj, s))
+    return size
+
+
+class TestMovieRecord:
+    def test_from_tmdb(self):
+        record = MovieRecord.from_tmdb(AsObj(details_payload()))
+        assert record.id == 550
+        assert record.year == 1999
+        assert record.runtime == 139
+        assert record.genres == ("Drama", "Thriller")
+        assert len(record.cast) == TOP_CAST
+        assert record.cast_ids[0] == 1000
+        assert record.keyword_ids[:2] == (825, 826)
+        assert record.has_details
+
+    def test_search_result_has_no_details(self):
+        record = MovieRecord.from_tmdb({"id": 1, "title": "Heat",
+                                        "genre_ids": [28]})
+        assert not record.has_details
+        assert record.year is None
+
+    def test_tuple_round_trip(self):
+        record = MovieRecord.from_tmdb(details_payload())
+        assert MovieRecord.from_tuple(record.to_tuple()) == record
+        assert MovieRecord.from_tuple(
+            list(record.to_tuple())).cast == record.cast
+
+    def test_memory_per_cached_movie(self):
+        payload = details_payload()
+        raw = deep_sizeof(AsObj(payload))
+        compact = deep_sizeof(MovieRecord.from_tmdb(AsObj(payload)))
+        print(f"\nbytes per cached movie: AsObj {raw}, MovieRecord {compact}")
+        assert compact < 3000
+        assert compact * 20 < raw
+
+
+class TestMovieCatalog:
+    @pytest.fixture
+    def tmdb(self):
+        with patch("ovos_skill_moviemaster.catalog.Search") as search, \
+                patch("ovos_skill_moviemaster.catalog.Movie") as movie:
+            search.return_value.movies.return_value = [
+                {"id": 550, "title": "Fight Club",
+                 "release_date": "1999-10-15", "popularity": 61.4}]
+            movie.return_value.details.return_value = details_payload()
+            movie.return_value.popular.side_effect = lambda page=1: [
+                {"id": page * 100 + i, "title": f"Movie {page}.{i}"}
+                for i in range(20 if page < 3 else 7)]
+            yield search.return_value, movie.return_value
+
+    def test_resolve_is_cached(self, tmdb):
+        search, _ = tmdb
+        catalog = MovieCatalog()
+        assert catalog.resolve("fight club", 0.8).id == 550
+        assert catalog.resolve("Fight Club", 0.8).id == 550
+        assert search.movies.call_count == 1
+
+    def test_movie_details_are_cached(self, tmdb):
+        _, movie = tmdb
+        catalog = MovieCatalog()
+        catalog.resolve("fight club", 0.8)
+        assert catalog.movie(550).runtime == 139
+        assert catalog.movie(550).runtime == 139
+        assert movie.details.call_count == 1
+        # a later search result does not replace the full record
+        catalog.search("fight club")
+        assert catalog.movies.get(550).has_details
+
+    def test_lists_hold_records(self, tmdb):
+        _, movie = tmdb
+        catalog = MovieCatalog()
+        popular = catalog.popular().take(5)
+        assert all(isinstance(m, MovieRecord) for m in popular)
+        assert catalog.popular().take(5) == popular
+        assert movie.popular.call_count == 1
+
+    def test_pages_are_fetched_lazily(self, tmdb):
+        _, movie = tmdb
+        catalog = MovieCatalog()
+        assert len(catalog.popular().take(10)) == 10
+        assert movie.popular.call_count == 1
+        # close to the end of page one, page two is fetched ahead of time
+        catalog.popular().take(16)
+        catalog._executor.shutdown(wait=True)
+        assert ("popular", 2) in catalog.lists
+        assert movie.popular.call_count == 2
+
+    def test_pages_stop_at_the_last_page(self, tmdb):
+        _, movie = tmdb
+        catalog = MovieCatalog()
+        movies = catalog.popular().take(100)
+        assert len(movies) == 47
+        assert movies[-1].title == "Movie 3.6"
+        assert movie.popular.call_count == 3
+
+    def test_lists_are_cached_per_region(self, tmdb):
+        _, movie = tmdb
+        movie.now_playing.side_effect = lambda region=None, page=1: [
+            {"id": 1, "title": f"In {region} theaters"}]
+        catalog = MovieCatalog()
+        assert catalog.now_playing("US").take(1)[0].title == \
+            "In US theaters"
+        assert catalog.now_playing("DE").take(1)[0].title == \
+            "In DE theaters"
+        catalog.now_playing("US").take(1)
+        assert movie.now_playing.call_count == 2
+
+    def test_trending_per_time_window(self):
+        with patch("ovos_skill_moviemaster.catalog.Trending") as trending:
+            trending.return_value.movie_day.return_value = AsObj(
+                {"page": 1, "results": [{"id": 1, "title": "Today"}]})
+            trending.return_value.movie_week.return_value = AsObj(
+                {"page": 1, "results": [{"id": 2, "title": "This week"}]})
+            catalog = MovieCatalog()
+            assert [m.title for m in catalog.trending("day").take(5)] == \
+                ["Today"]
+            assert [m.title for m in catalog.trending("week").take(5)] == \
+                ["This week"]
+            catalog.trending("day").take(5)
+            assert trending.return_value.movie_day.call_count == 1
+
+    def test_snapshot_warm_start(self, tmdb, tmp_path):
+        search, movie = tmdb
+        path = str(tmp_path / "cache.snapshot")
+        catalog = MovieCatalog()
+        catalog.resolve("fight club", 0.8)
+        catalog.movie(550)
+        catalog.popular()
+        assert catalog.save_snapshot(path)
+        assert not catalog.save_snapshot(path)
+
+        warm = MovieCatalog()
+        warm.load_snapshot(path)
+        assert len(warm.movies) == 0
+        assert warm.resolve("fight club", 0.8).runtime == 139
+        assert warm.movie(550).cast == catalog.movie(550).cast
+        assert len(warm.popular().take(10)) == 10
+        assert search.movies.call_count == 1
+        assert movie.details.call_count == 1
+        assert movie.popular.call_count == 1
+        warm.close_snapshot()
+
+
+class TestWatchProviders:
+    @pytest.fixture
+    def tmdb(self):
+        def watch_providers(movie_id):
+            netflix = {"provider_id": 8, "provider_name": "Netflix",
+                       "display_priority": 2}
+            mubi = {"provider_id": 11, "provider_name": "MUBI",
+                    "display_priority": 1}
+            apple = {"provider_id": 2, "provider_name": "Apple TV",
+                     "display_priority": 4}
+            return AsObj({"id": movie_id, "results": {
+                "US": {"flatrate": [netflix, mubi], "rent": [apple],
+                       "buy": [apple]},
+                "DE": {"buy": [apple]}}}, key="results")
+
+        with patch("ovos_skill_moviemaster.catalog.Movie") as movie, \
+                patch("ovos_skill_moviemaster.catalog.Provider") as provider:
+            movie.return_value.watch_providers.side_effect = watch_providers
+            provider.return_value.movie_providers.return_value = AsObj(
+                {"results": [
+                    {"provider_id": 8, "provider_name": "Netflix"},
+                    {"provider_id": 2, "provider_name": "Apple TV"}]},
+                key="results")
+            yield movie.return_value, provider.return_value
+
+    def test_offers_of_the_region(self, tmdb):
+        catalog = MovieCatalog()
+        assert catalog.watch_providers(550, "US") == {
+            "flatrate": ("MUBI", "Netflix"), "rent": ("Apple TV",),
+            "buy": ("Apple TV",)}
+        assert catalog.watch_providers(550, "DE") == {"buy": ("Apple TV",)}
+        assert catalog.watch_providers(550, "FR") == {}
+
+    def test_one_request_per_movie_and_region(self, tmdb):
+        movie, provider = tmdb
+        catalog = MovieCatalog()
+        for _ in range(3):
+            catalog.watch_providers(550, "US")
+            catalog.watch_providers(680, "US")
+        assert movie.watch_providers.call_count == 2
+        assert provider.movie_providers.call_count == 1
+        # offers are kept as ids, MUBI was missing from the provider list
+        assert catalog.providers.get(("US", 550))["flatrate"] == (11, 8)
+        assert catalog.provider_names.get("US")[11] == "MUBI"
+
+    def test_satellites_are_served_by_the_hub(self, tmdb):
+        movie, provider = tmdb
+        bus = FakeBus()
+        executor = ThreadPoolExecutor(max_workers=1)
+        HubServer(bus, MovieCatalog(), executor)
+        for _ in range(2):
+            satellite = MovieCatalog()
+            satellite.hub = HubClient(bus, timeout=2)
+            assert satellite.watch_providers(550, "US") == {
+                "flatrate": ("MUBI", "Netflix"), "rent": ("Apple TV",),
+                "buy": ("Apple TV",)}
+            assert satellite.watch_provider_names("US")[11] == "MUBI"
+        assert movie.watch_providers.call_count == 1
+        assert provider.movie_providers.call_count == 1
+        executor.shutdown()
+
+    def test_snapshot_round_trip(self, tmdb, tmp_path):
+        catalog = MovieCatalog()
+        offers = catalog.watch_providers(550, "US")
+        catalog.save_snapshot(str(tmp_path / "snapshot"))
+        movie, provider = tmdb
+        warm = MovieCatalog()
+        warm.load_snapshot(str(tmp_path / "snapshot"))
+        assert warm.watch_providers(550, "US") == offers
+        assert movie.watch_providers.call_count == 1
+        assert provider.movie_providers.call_count == 1
+
+
+class TestMultiSearch:
+    @pytest.fixture
+    def search(self):
+        with patch("ovos_skill_moviemaster.catalog.Search") as search:
+            search.return_value.multi.return_value = AsObj({"results": [
+                {"media_type": "tv", "id": 90228, "name": "Dune: Prophecy",
+                 "first_air_date": "2024-11-17", "popularity": 80.0},
+                {"media_type": "movie", "id": 438631, "title": "Dune",
+                 "release_date": "2021-09-15", "popularity": 150.0},
+                {"media_type": "person", "id": 1190668,
+                 "name": "Timothée Chalamet", "popularity": 60.0,
+                 "known_for": [{"media_type": "movie", "title": "Dune"}]},
+                {"media_type": "collection", "id": 726871,
+                 "name": "Dune Collection"}]}, key="results")
+            yield search.return_value
+
+    def test_one_request_classifies_the_name(self, search):
+        catalog = MovieCatalog()
+        entity = catalog.resolve_entity("dune", 0.8)
+        assert (entity.kind, entity.id) == ("movie", 438631)
+        person = catalog.resolve_entity("timothee chalamet", 0.8)
+        assert (person.kind, person.known_for) == ("person", ("Dune",))
+        assert search.multi.call_count == 2
+        assert catalog.resolve_entity("Dune", 0.8) == entity
+        assert search.multi.call_count == 2
+
+    def test_movies_found_are_cached_for_the_movie_intents(self, search):
+        catalog = MovieCatalog()
+        catalog.resolve_entity("dune", 0.8)
+        with patch("ovos_skill_moviemaster.catalog.Search") as movies:
+            assert catalog.resolve("dune", 0.8).id == 438631
+            movies.return_value.movies.assert_not_called()
+
+    def test_nothing_found(self, search):
+        catalog = MovieCatalog()
+        assert catalog.resolve_entity("a film nobody made", 0.8) is None
+        assert catalog.resolve_entity("a film nobody made", 0.8) is None
+        assert search.multi.call_count == 1
+
+
+class TestFilmography:
+    @staticmethod
+    def credits(*movies):
+        return AsObj({"id": 1, "cast": [
+            {"id": movie_id, "title": f"Movie {movie_id}",
+             "popularity": popularity, "character": "Someone"}
+            for movie_id, popularity in movies]})
+
+    def test_movies_together_most_popular_first(self):
+        first = Filmography.from_tmdb(
+            self.credits((1, 5.0), (2, 50.0), (3, 9.0), (3, 9.0), (4, 1.0)))
+        second = Filmography.from_tmdb(
+            self.credits((3, 9.0), (5, 7.0), (2, 50.0), (4, 1.0)))
+        assert len(first) == 4
+        assert first.together(second) == ["Movie 2", "Movie 3", "Movie 4"]
+        assert first.together(Filmography()) == []
+
+    def test_cached_per_person(self, tmp_path):
+        with patch("ovos_skill_moviemaster.catalog.Person") as person:
+            person.return_value.movie_credits.side_effect = \
+                lambda person_id: self.credits((person_id, 1.0), (7, 2.0))
+            catalog = MovieCatalog()
+            first, second = catalog.filmography(1), catalog.filmography(2)
+            assert catalog.filmography(1).together(second) == ["Movie 7"]
+            catalog.save_snapshot(str(tmp_path / "snapshot"))
+            warm = MovieCatalog()
+            warm.load_snapshot(str(tmp_path / "snapshot"))
+            assert warm.filmography(1) == first
+            assert person.return_value.movie_credits.call_count == 2
+
+    def test_satellites_are_served_by_the_hub(self):
+        with patch("ovos_skill_moviemaster.catalog.Person") as person:
+            person.return_value.movie_credits.side_effect = \
+                lambda person_id: self.credits((person_id, 1.0), (7, 2.0))
+            bus = FakeBus()
+            executor = ThreadPoolExecutor(max_workers=1)
+            HubServer(bus, MovieCatalog(), executor)
+            for _ in range(2):
+                satellite = MovieCatalog()
+                satellite.hub = HubClient(bus, timeout=2)
+                first = satellite.filmography(1)
+                assert first.together(satellite.filmography(2)) == \
+                    ["Movie 7"]
+                assert satellite.filmography(1) is first
+            assert person.return_value.movie_credits.call_count == 2
+            executor.shutdown()
+
+
+class TestRecommendations:
+    @pytest.fixture
+    def tmdb(self):
+        # movie id -> genre, keyword ids
+        movies = {1: ("Crime", (100, 101)), 3: ("Crime", (100, 101, 102)),
+                  4: ("Crime", (100,)), 5: ("Crime", (100, 101)),
+                  11: ("Animation", (200,))}
+
+        def details(movie_id, append_to_response=None):
+            genre, keyword_ids = movies[movie_id]
+            return {"id": movie_id, "title": f"Movie {movie_id}",
+                    "runtime": 100, "credits": {"cast": []},
+                    "genres": [{"id": 1, "name": genre}],
+                    "keywords": {"keywords": [{"id": k}
+                                              for k in keyword_ids]}}
+
+        with patch("ovos_skill_moviemaster.catalog.Movie") as movie:
+            movie.return_value.details.side_effect = details
+            movie.return_value.recommendations.return_value = [
+                {"id": 50, "title": "Movie 50"},
+                {"id": 3, "title": "Movie 3"}]
+            yield movie.return_value
+
+    def test_tmdb_and_similar_cached_movies_take_turns(self, tmdb):
+        catalog = MovieCatalog()
+        for movie_id in (3, 4, 5, 11):
+            catalog.movie(movie_id)
+        movies = catalog.recommend(1, 4)
+        # TMDb, similar, TMDb again (a duplicate), similar
+        assert [m.id for m in movies] == [50, 5, 3, 4]
+
+    def test_index_is_rebuilt_only_for_movies_with_features(self, tmdb):
+        catalog = MovieCatalog()
+        for movie_id in (3, 4):
+            catalog.movie(movie_id)
+        index = catalog.similarity_index()
+        assert len(index) == 2
+        # search and list results have no genres or keywords
+        catalog.recommendations(1).take(2)
+        assert catalog.similarity_index() is index
+        catalog.movie(5)
+        assert len(catalog.similarity_index()) == 3
+
+    def test_offline_from_the_cache(self, tmdb):
+        catalog = MovieCatalog()
+        for movie_id in (1, 3, 4, 11):
+            catalog.movie(movie_id)
+        tmdb.recommendations.side_effect = RequestsConnectionError()
+        tmdb.details.side_effect = RequestsConnectionError()
+        for _ in range(BREAKER_FAILURES):
+            with pytest.raises(TMDbUnavailable):
+                catalog.movie(5)
+        assert [m.id for m in catalog.recommend(1, 5)] == [3, 4]
+        # nothing known about the movie, nothing to recommend
+        with pytest.raises(TMDbUnavailable):
+            catalog.recommend(2, 5)
+
+    def test_a_cached_list_does_not_wait_for_details(self, tmdb):
+        catalog = MovieCatalog()
+        catalog.recommendations(1).take(2)
+        slow = Event()
+        tmdb.details.side_effect = lambda *a, **kw: slow.wait(5)
+        start = time.monotonic()
+        assert [m.id for m in catalog.recommend(1, 2)] == [50, 3]
+        slow.set()
+        assert time.monotonic() - start < 1
+
+    def test_details_are_fetched_alongside_the_list(self, tmdb):
+        catalog = MovieCatalog()
+        for movie_id in (4, 5):
+            catalog.movie(movie_id)
+        details = tmdb.details.side_effect
+        both = Event()
+        calls = []
+
+        def slow(request):
+            def call(*args, **kwargs):
+                calls.append(request)
+                if len(calls) == 2:
+                    both.set()
+                # each waits until the other one has started as well
+                assert both.wait(2)
+                return request(*args, **kwargs)
+            return call
+
+        tmdb.details.side_effect = slow(details)
+        tmdb.recommendations.side_effect = slow(
+            lambda *a, **kw: [{"id": 50, "title": "Movie 50"}])
+        assert [m.id for m in catalog.recommend(1, 3)] == [50, 5, 4]
+
+
+class TestSnapshot:
+    def test_expired_entries_are_skipped(self, tmp_path):
+        path = str(tmp_path / "cache.snapshot")
+        write_snapshot(path, {"titles": [(("heat", 0.8), 949, 1.0),
+                                         (("casino", 0.8), 524, 2 ** 40)]})
+        snapshot = Snapshot.open(path)
+        assert snapshot.get("titles", ("heat", 0.8)) is None
+        assert snapshot.get("titles", ("casino", 0.8))[0] == 524
+        assert snapshot.get("movies", 524) is None
+        snapshot.close()
+
+    def test_bad_files_are_ignored(self, tmp_path):
+        assert Snapshot.open(str(tmp_path / "missing")) is None
+        (tmp_path / "empty").write_bytes(b"")
+        assert Snapshot.open(str(tmp_path / "empty")) is None
+        (tmp_path / "junk").write_bytes(b"not a snapshot")
+        assert Snapshot.open(str(tmp_path / "junk")) is None
+
+    def test_reads_while_the_snapshot_is_saved(self, tmp_path):
+        path = str(tmp_path / "cache.snapshot")
+        catalog = MovieCatalog()
+        for movie_id in range(200):
+            catalog.movies.put(movie_id, MovieRecord(movie_id, "Movie"))
+        catalog.save_snapshot(path)
+        catalog.movies.clear()
+        stop = Event()
+
+        def read():
+            found = 0
+            while not stop.is_set():
+                for movie_id in range(200):
+                    found += catalog._stored("movies", movie_id) is not None
+            return found
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            readers = [pool.submit(read) for _ in range(4)]
+            for _ in range(20):
+                catalog.save_snapshot(path, force=True)
+            stop.set()
+            assert all(reader.result() > 0 for reader in readers)
+        catalog.shutdown()
+
+
+class TestNegativeCache:
+    def test_unresolved_titles_are_not_searched_again(self):
+        with patch("ovos_skill_moviemaster.catalog.Search") as search:
+            search.return_value.movies.return_value = []
+            catalog = MovieCatalog()
+            for _ in range(10):
+                assert catalog.resolve("fright club", 0.8) is None
+            catalog.resolve("the matrix", 0.8)
+            assert search.return_value.movies.call_count == 2
+            assert catalog.stats()["unresolved_titles"] == [
+                ("fright club", 10), ("the matrix", 1)]
+
+
+class TestStaleWhileRevalidate:
+    def test_stale_list_is_served_and_refreshed(self):
+        with patch("ovos_skill_moviemaster.catalog.Movie") as movie:
+            movie.return_value.popular.return_value = [
+                {"id": 1, "title": "New"}]
+            catalog = MovieCatalog()
+            lists = catalog.lists
+            old = (MovieRecord(2, "Old"),)
+            lists.put(("popular", 1), old,
+                      expires=time.time() + lists.ttl - lists.soft_ttl - 1)
+
+            assert catalog.popular().take(5) == list(old)
+            catalog._executor.shutdown(wait=True)
+            assert [m.title for m in catalog.popular()] == ["New"]
+            assert movie.return_value.popular.call_count == 1
+
+    def test_fresh_list_is_not_refreshed(self):
+        with patch("ovos_skill_moviemaster.catalog.Movie") as movie:
+            catalog = MovieCatalog()
+            old = (MovieRecord(2, "Old"),)
+            catalog.lists.put(("popular", 1), old)
+            assert catalog.popular().take(5) == list(old)
+            assert movie.return_value.popular.call_count == 0
+
+
+class TestPrefetch:
+    @pytest.fixture
+    def movie(self):
+        with patch("ovos_skill_moviemaster.catalog.Movie") as movie:
+            movie.return_value.details.return_value = details_payload()
+            movie.return_value.recommendations.return_value = [
+                {"id": 680, "title": "Pulp Fiction"}]
+            yield movie.return_value
+
+    def test_prefetched_data_is_used(self, movie):
+        catalog = MovieCatalog()
+        catalog.prefetch_budget = 10
+        catalog.prefetch(550)
+        catalog._prefetch_executor.shutdown(wait=True)
+        assert catalog.prefetch_stats["fetched"] == 2
+
+        assert catalog.movie(550).runtime == 139
+        catalog.movie(550)
+        assert movie.details.call_count == 1
+        assert catalog.stats()["prefetch"] == {"fetched": 2, "used": 1}
+
+    def test_handler_shares_the_prefetch_on_its_way(self, movie):
+        started = Event()
+
+        def slow_details(movie_id, append_to_response=None):
+            started.set()
+            time.sleep(0.2)
+            return details_payload()
+
+        movie.details.side_effect = slow_details
+        catalog = MovieCatalog()
+        catalog.prefetch_budget = 10
+        catalog.prefetch(550)
+        assert started.wait(5)
+        assert catalog.movie(550).runtime == 139
+        catalog._prefetch_executor.shutdown(wait=True)
+        assert movie.details.call_count == 1
+
+    def test_budget(self, movie):
+        catalog = MovieCatalog()
+        catalog.prefetch_budget = 1
+        catalog.prefetch(550)
+        catalog.prefetch(551)
+        catalog._prefetch_executor.shutdown(wait=True)
+        assert catalog.prefetch_stats["fetched"] == 1
+        assert catalog.prefetch_stats["skipped"] == 3
+
+    def test_disabled(self, movie):
+        catalog = MovieCatalog()
+        catalog.prefetch(550)
+        catalog._prefetch_executor.shutdown(wait=True)
+        assert movie.details.call_count == 0
+
+
+class TestCircuitBreaker:
+    @staticmethod
+    def down():
+        raise RequestsConnectionError("no route to host")
+
+    @staticmethod
+    def rejected():
+        raise TMDbException("Invalid API key")
+
+    def test_opens_after_failures_in_a_row(self):
+        changes = []
+        breaker = CircuitBreaker(3, 60, lambda *change: changes.append(change))
+        for _ in range(3):
+            with pytest.raises(TMDbUnavailable):
+                breaker.call(self.down)
+        assert breaker.state == "open"
+        assert changes == [("open", "closed")]
+        with pytest.raises(CircuitOpenError):
+            breaker.call(lambda: "not called")
+
+    def test_answers_from_tmdb_close_it(self):
+        breaker = CircuitBreaker(2, 60)
+        with pytest.raises(TMDbUnavailable):
+            breaker.call(self.down)
+        with pytest.raises(TMDbException):
+            breaker.call(self.rejected)
+        assert breaker.failures == 0
+        assert breaker.state == "closed"
+
+    def test_half_open_probe(self):
+        changes = []
+        breaker = CircuitBreaker(1, 0.05, lambda *change: changes.append(change))
+        with pytest.raises(TMDbUnavailable):
+            breaker.call(self.down)
+        time.sleep(0.06)
+        assert breaker.state == "half_open"
+        # a failed probe opens it again for another reset_timeout
+        with pytest.raises(TMDbUnavailable):
+            breaker.call(self.down)
+        with pytest.raises(CircuitOpenError):
+            breaker.call(self.down)
+        time.sleep(0.06)
+        assert breaker.call(lambda: "back") == "back"
+        assert changes == [("open", "closed"), ("half_open", "open"),
+                           ("open", "half_open"), ("half_open", "open"),
+                           ("closed", "half_open")]
+
+    def test_catalog_fails_fast_and_serves_cache(self):
+        with patch("ovos_skill_moviemaster.catalog.Movie") as movie:
+            movie.return_value.details.return_value = details_payload()
+            catalog = MovieCatalog()
+            catalog.movie(550)
+            movie.return_value.details.side_effect = RequestsConnectionError
+            for movie_id in (551, 552, 553):
+                with pytest.raises(TMDbUnavailable):
+                    catalog.movie(movie_id)
+            with pytest.raises(CircuitOpenError):
+                catalog.movie(554)
+            assert movie.return_value.details.call_count == 4
+            assert catalog.movie(550).runtime == 139
+
+    def test_probe(self):
+        with patch("ovos_skill_moviemaster.catalog.Configuration") as config:
+            catalog = MovieCatalog()
+            catalog.breaker.reset_timeout = 0
+            config.return_value.api_configuration.side_effect = \
+                RequestsConnectionError
+            assert catalog.probe()
+            assert config.return_value.api_configuration.call_count == 0
+            for _ in range(3):
+                catalog.breaker._failed()
+            assert not catalog.probe()
+            config.return_value.api_configuration.side_effect = None
+            assert catalog.probe()
+            assert catalog.breaker.state == "closed"
+
+
+def write_shared_entries(path, worker, count):
+    cache = SharedCache(path)
+    for i in range(count):
+        cache.put("movies", worker * count + i, [i, f"Movie {i}"],
+                  time.time() + 60)
+    cache.flush()
+    assert cache.get("movies", worker * count) is not None
+    cache.close()
+
+
+class TestSharedCache:
+    def test_movie_fetched_by_one_process_is_a_hit_for_others(
+            self, tmp_path):
+        path = str(tmp_path / "tmdb.sqlite")
+        with patch("ovos_skill_moviemaster.catalog.Search") as search, \
+                patch("ovos_skill_moviemaster.catalog.Movie") as movie:
+            search.return_value.movies.return_value = [
+                {"id": 550, "title": "Fight Club"}]
+            movie.return_value.details.return_value = details_payload()
+            movie.return_value.popular.return_value = [
+                {"id": 1, "title": "New"}]
+            first, second = MovieCatalog(), MovieCatalog()
+            first.open_shared_cache(path)
+            second.open_shared_cache(path)
+            first.resolve("fight club", 0.8)
+            first.movie(550)
+            first.popular().take(1)
+            first.shared.flush()
+
+            assert second.resolve("fight club", 0.8).runtime == 139
+            assert second.movie(550).cast == first.movie(550).cast
+            assert [m.title for m in second.popular()] == ["New"]
+            assert search.return_value.movies.call_count == 1
+            assert movie.return_value.details.call_count == 1
+            assert movie.return_value.popular.call_count == 1
+            assert second.stats()["caches"]["shared"]["hits"] == 3
+            first.shutdown()
+            second.shutdown()
+
+    def test_expired_entries_are_ignored(self, tmp_path):
+        cache = SharedCache(str(tmp_path / "tmdb.sqlite"))
+        cache.put("titles", ("heat", 0.8), 949, time.time() - 1)
+        cache.put("titles", ("casino", 0.8), 524, time.time() + 60)
+        cache.flush()
+        assert cache.get("titles", ("heat", 0.8)) is None
+        assert cache.get("titles", ("casino", 0.8))[0] == 524
+        assert len(cache) == 1
+        cache.close()
+
+    def test_purge_does_not_wait_for_other_writers(self, tmp_path):
+        path = str(tmp_path / "tmdb.sqlite")
+        cache = SharedCache(path)
+        cache.put("titles", ("heat", 0.8), 949, time.time() - 1)
+        cache.flush()
+        other = sqlite3.connect(path, isolation_level=None)
+        other.execute("BEGIN IMMEDIATE")
+        start = time.monotonic()
+        cache.purge()
+        assert time.monotonic() - start < 0.5
+        other.execute("COMMIT")
+        cache.flush()
+        assert other.execute("SELECT COUNT(*) FROM entries").fetchone()[0] \
+            == 0
+        other.close()
+        cache.close()
+
+    def test_concurrent_writers(self, tmp_path):
+        path = str(tmp_path / "tmdb.sqlite")
+        SharedCache(path).close()
+        context = multiprocessing.get_context("spawn")
+        workers = [context.Process(target=write_shared_entries,
+                                   args=(path, worker, 200))
+                   for worker in range(4)]
+        for process in workers:
+            process.start()
+        for process in workers:
+            process.join()
+        assert all(process.exitcode == 0 for process in workers)
+        cache = SharedCache(path)
+        assert len(cache) == 800
+        cache.close()
+
+
+class TestCacheAdministration:
+    @pytest.fixture
+    def tmdb(self):
+        with patch("ovos_skill_moviemaster.catalog.Search") as search, \
+                patch("ovos_skill_moviemaster.catalog.Movie") as movie:
+            search.return_value.movies.return_value = [
+                {"id": 550, "title": "Fight Club"}]
+            movie.return_value.details.return_value = details_payload()
+            movie.return_value.popular.return_value = [
+                {"id": 1, "title": "New"}]
+            movie.return_value.recommendations.return_value = [
+                {"id": 2, "title": "Similar"}]
+            yield search.return_value, movie.return_value
+
+    def test_invalidate_a_movie_everywhere(self, tmdb, tmp_path):
+        search, movie = tmdb
+        path = str(tmp_path / "cache.snapshot")
+        catalog = MovieCatalog()
+        catalog.open_shared_cache(str(tmp_path / "tmdb.sqlite"))
+        catalog.resolve("fight club", 0.8)
+        catalog.movie(550)
+        catalog.recommendations(550).take(1)
+        catalog.popular().take(1)
+        catalog.save_snapshot(path)
+        catalog.load_snapshot(path)
+
+        # title, details and recommendations, in memory and shared
+        assert catalog.invalidate(movie_id=550) == 3
+        catalog.close_shared_cache()
+        assert catalog.resolve("fight club", 0.8).id == 550
+        assert catalog.movie(550).runtime == 139
+        assert search.movies.call_count == 2
+        assert movie.details.call_count == 2
+        catalog.popular().take(1)
+        assert movie.popular.call_count == 1
+        # the rewritten snapshot leaves the dropped entries out
+        catalog.invalidate(endpoint="movies")
+        catalog.save_snapshot(path)
+        assert Snapshot.open(path).keys("movies") == []
+        catalog.shutdown()
+
+    def test_invalidate_a_title_or_an_endpoint(self, tmdb):
+        search, movie = tmdb
+        catalog = MovieCatalog()
+        catalog.resolve("fight club", 0.8)
+        catalog.resolve("a film nobody made", 0.8)
+        catalog.popular().take(1)
+        assert catalog.invalidate(title="Fight Club") == 1
+        assert catalog.invalidate(title="a film nobody made") == 1
+        assert catalog.invalidate(endpoint="popular") == 1
+        assert len(catalog.lists) == 0
+        catalog.resolve("fight club", 0.8)
+        catalog.resolve("a film nobody made", 0.8)
+        assert search.movies.call_count == 4
+
+    def test_stats_per_endpoint(self, tmdb):
+        catalog = MovieCatalog()
+        catalog.popular().take(1)
+        catalog.popular().take(1)
+        catalog.recommendations(550).take(1)
+        stats = catalog.stats()
+        assert stats["endpoints"]["popular"] == {
+            "hits": 1, "misses": 1, "hit_ratio": 0.5}
+        assert stats["endpoints"]["recommendations"]["hits"] == 0
+        assert stats["caches"]["lists"]["bytes"] > 0
+        assert stats["caches"]["titles"] == {
+            "entries": 0, "hits": 0, "misses": 0, "hit_ratio": None,
+            "bytes": 0}
+
+    def test_compact(self, tmdb, tmp_path):
+        catalog = MovieCatalog()
+        catalog.open_shared_cache(str(tmp_path / "tmdb.sqlite"))
+        catalog.movies.put(1, MovieRecord(1, "Gone"), expires=time.time() - 1)
+        catalog.shared.put("movies", 1, [1, "Gone"], time.time() - 1)
+        catalog.movie(550)
+        result = catalog.compact(str(tmp_path / "cache.snapshot"))
+        assert result == {"memory": 1, "shared": 1, "snapshot": 1}
+        assert len(catalog.shared) == 1
+        catalog.shutdown()
+
+
+class TestHub:
+    @pytest.fixture
+    def tmdb(self):
+        with patch("ovos_skill_moviemaster.catalog.Search") as search, \
+                patch("ovos_skill_moviemaster.catalog.Movie") as movie:
+            search.return_value.movies.return_value = [
+                {"id": 550, "title": "Fight Club"}]
+            movie.return_value.details.return_value = details_payload()
+            movie.return_value.popular.return_value = [
+                {"id": 1, "title": "New"}]
+            yield search.return_value, movie.return_value
+
+    def test_satellites_are_served_by_the_hub(self, tmdb):
+        search, movie = tmdb
+        bus = FakeBus()
+        hub = MovieCatalog()
+        executor = ThreadPoolExecutor(max_workers=2)
+        server = HubServer(bus, hub, executor)
+        satellites = [MovieCatalog() for _ in range(3)]
+        for satellite in satellites:
+            satellite.hub = HubClient(bus, timeout=2)
+            assert satellite.resolve("fight club", 0.8).id == 550
+            assert satellite.movie(550).runtime == 139
+            assert [m.title for m in satellite.popular()] == ["New"]
+        assert search.movies.call_count == 1
+        assert movie.details.call_count == 1
+        assert movie.popular.call_count == 1
+        server.shutdown()
+        executor.shutdown()
+
+    def test_unresolved_titles_come_back_as_none(self, tmdb):
+        search, _ = tmdb
+        search.movies.return_value = []
+        bus = FakeBus()
+        executor = ThreadPoolExecutor(max_workers=1)
+        HubServer(bus, MovieCatalog(), executor)
+        satellite = MovieCatalog()
+        satellite.hub = HubClient(bus, timeout=2)
+        assert satellite.resolve("fright club", 0.8) is None
+        assert satellite.resolve("fright club", 0.8) is None
+        assert search.movies.call_count == 1
+        executor.shutdown()
+
+    def test_entities_are_resolved_by_the_hub(self, tmdb):
+        search, movie = tmdb
+        search.multi.return_value = AsObj({"results": [
+            {"media_type": "movie", "id": 550, "title": "Fight Club",
+             "release_date": "1999-10-15", "popularity": 60.0}]},
+            key="results")
+        bus = FakeBus()
+        executor = ThreadPoolExecutor(max_workers=1)
+        HubServer(bus, MovieCatalog(), executor)
+        for _ in range(2):
+            satellite = MovieCatalog()
+            satellite.hub = HubClient(bus, timeout=2)
+            entity = satellite.resolve_entity("fight club", 0.8)
+            assert (entity.kind, entity.id) == ("movie", 550)
+            # the movie came along, resolve needs no further lookup
+            assert satellite.resolve("fight club", 0.8).year == 1999
+        assert search.multi.call_count == 1
+        search.movies.assert_not_called()
+        assert satellite.resolve_entity("a film nobody made", 0.8) is None
+        executor.shutdown()
+
+    def test_falls_back_to_tmdb_without_a_hub(self, tmdb):
+        _, movie = tmdb
+        satellite = MovieCatalog()
+        satellite.hub = HubClient(FakeBus(), timeout=0.1)
+        assert satellite.movie(550).runtime == 139
+        assert not satellite.hub.available
+        # no more waiting for the hub until HUB_RETRY passed
+        started = time.monotonic()
+        assert satellite.popular().take(1)[0].title == "New"
+        assert time.monotonic() - started < 0.1
+        assert movie.details.call_count == 1
+
+
+class TestCancellation:
+    @pytest.fixture
+    def slow_tmdb(self):
+        release = Event()
+
+        def details(movie_id, append_to_response=None):
+            release.wait(5)
+            return details_payload(movie_id)
+
+        with patch("ovos_skill_moviemaster.catalog.Movie") as movie:
+            movie.return_value.details.side_effect = details
+            movie.return_value.recommendations.return_value = []
+            movie.return_value.release = release
+            yield movie.return_value
+            release.set()
+
+    def test_cancel_stops_waiting_for_tmdb(self, slow_tmdb):
+        catalog, lookups = MovieCatalog(), LookupTracker()
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            def lookup(session_id, movie_id):
+                with lookups.lookup(session_id):
+                    return catalog.movie(movie_id)
+
+            cancelled = pool.submit(lookup, "kitchen", 550)
+            other = pool.submit(lookup, "bedroom", 551)
+            time.sleep(0.1)
+            assert lookups.busy("kitchen")
+            started = time.monotonic()
+            assert lookups.cancel("kitchen") == 1
+            with pytest.raises(LookupCancelled):
+                cancelled.result(timeout=1)
+            assert time.monotonic() - started < 0.5
+            assert not other.done()
+            assert not lookups.busy("kitchen")
+            slow_tmdb.release.set()
+            assert other.result(timeout=1).id == 551
+
+    def test_cancelled_lookup_makes_no_new_requests(self, slow_tmdb):
+        catalog, lookups = MovieCatalog(), LookupTracker()
+        with lookups.lookup("kitchen") as token:
+            token.cancel()
+            with pytest.raises(LookupCancelled):
+                catalog.movie(550)
+        assert slow_tmdb.details.call_count == 0
+
+    def test_stop_drops_queued_prefetches(self, slow_tmdb):
+        catalog, lookups = MovieCatalog(), LookupTracker()
+        catalog.prefetch_budget = 10
+        with lookups.lookup("kitchen"):
+            # the single prefetch worker is busy with the first movie
+            lookups.track(catalog.prefetch(550))
+            lookups.track(catalog.prefetch(551))
+        assert lookups.busy("kitchen")
+        # a new utterance leaves prefetches of finished lookups alone
+        assert lookups.cancel("kitchen") == 0
+        assert lookups.cancel("kitchen", queued=True) >= 2
+        slow_tmdb.release.set()
+        catalog._prefetch_executor.shutdown(wait=True)
+        assert slow_tmdb.details.call_count <= 1
@@ -0,0 +1,377 @@
+# pylint: disable=missing-docstring
+import json
+import os
+import pstats
+import random
+import time
+from datetime import datetime
+from threading import Event, Lock
+from unittest.mock import patch
+
+import pytest
+from lingua_franca import load_language
+from lingua_franca.format import nice_date
+from ovos_bus_client.message import Message, dig_for_message
+from ovos_utils.fakebus import FakeBus
+
+from ovos_skill_moviemaster import WORKERS, MovieMaster
+
+LOCALE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "locale")
+SKILL_ID = "ovos-skill-moviemaster.test"
+TITLES = {f"movie number {i}": i for i in range(1, 25)}
+
+
+def tmdb_movie(movie_id):
+    return {"id": movie_id, "title": f"Movie Number {movie_id}",
+            "release_date": f"{1950 + movie_id}-06-01",
+            "popularity": 10.0, "runtime": 90 + movie_id,
+            "genres": [{"id": 18, "name": "Drama"}],
+            "credits": {"cast": [{"id": movie_id * 100,
+                                  "name": f"Actor {movie_id}"}]}}
+
+
+def search(title, year=None):
+    # slow and jittery, so overlapping lookups finish out of order
+    time.sleep(random.uniform(0.005, 0.03))
+    movie_id = TITLES.get(title)
+    return [tmdb_movie(movie_id)] if movie_id else []
+
+
+def details(movie_id, append_to_response=None):
+    time.sleep(random.uniform(0.005, 0.03))
+    return tmdb_movie(movie_id)
+
+
+@pytest.fixture
+def skill(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path / "data"))
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path / "config"))
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    load_language("en")
+    with patch("ovos_skill_moviemaster.Movie"), \
+            patch("ovos_skill_moviemaster.catalog.Search") as search_api, \
+            patch("ovos_skill_moviemaster.catalog.Movie") as movie_api:
+        search_api.return_value.movies.side_effect = search
+        movie_api.return_value.details.side_effect = details
+        bus = FakeBus()
+        skill = MovieMaster(skill_id=SKILL_ID, bus=bus)
+        skill.catalog.close_shared_cache()
+        skill.settings["gui_cards"] = False
+        answers = []
+        lock = Lock()
+
+        def speak_dialog(key, data=None, *args, **kwargs):
+            # the request this answer belongs to
+            request = dig_for_message()
+            with lock:
+                answers.append((request.data, key, data))
+
+        skill.speak_dialog = speak_dialog
+        skill.answers = answers
+        skill.tmdb = movie_api.return_value
+        skill.search = search_api.return_value
+        yield skill
+        skill.shutdown()
+
+
+def ask(skill, intent, movie):
+    skill.bus.emit(Message(f"{SKILL_ID}:{intent}", {"movie": movie},
+                           {"session": {"session_id": f"user {movie}"}}))
+
+
+def wait_for_answers(skill, count, timeout=10):
+    deadline = time.monotonic() + timeout
+    while len(skill.answers) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return skill.answers
+
+
+def test_overlapping_intents_answer_about_their_own_movie(skill):
+    requests = [(intent, title)
+                for title in TITLES
+                for intent in ("movie.year.intent", "movie.runtime.intent",
+                               "movie.cast.intent")]
+    random.shuffle(requests)
+    for intent, title in requests:
+        ask(skill, intent, title)
+
+    answers = wait_for_answers(skill, len(requests))
+    assert len(answers) == len(requests)
+    for request, key, data in answers:
+        movie_id = TITLES[request["movie"]]
+        if key == "movie.year":
+            assert data["movie"] == f"Movie Number {movie_id}"
+            assert data["year"] == nice_date(datetime(1950 + movie_id, 6, 1))
+        elif key == "movie.runtime":
+            assert data["runtime"] == 90 + movie_id
+        else:
+            assert key == "movie.cast"
+            assert data["lastactor"] == f"Actor {movie_id}"
+
+
+def test_unknown_title_does_not_reuse_an_earlier_movie(skill):
+    ask(skill, "movie.year.intent", "movie number 1")
+    wait_for_answers(skill, 1)
+    ask(skill, "movie.year.intent", "a film nobody made")
+    request, key, data = wait_for_answers(skill, 2)[1]
+    assert key == "no.info"
+    assert data == {"movie": "a film nobody made"}
+
+
+def test_theater_listings_are_for_the_region(skill):
+    with patch("ovos_skill_moviemaster.catalog.Movie") as movie_api:
+        movie_api.return_value.now_playing.side_effect = \
+            lambda region=None, page=1: [
+                {"id": i, "title": f"{region} movie {i}"} for i in range(3)]
+        skill.settings["region"] = "gb"
+        skill.bus.emit(Message(f"{SKILL_ID}:movie.now.playing.intent", {},
+                               {"session": {"session_id": "cinema"}}))
+        request, key, data = wait_for_answers(skill, 1)[0]
+    assert key == "movie.now.playing"
+    assert data == {"movielist": "GB movie 0, GB movie 1, ",
+                    "lastmovie": "GB movie 2"}
+
+
+def test_where_to_watch_it_follows_up_on_the_last_movie(skill):
+    skill.settings["region"] = "us"
+    skill.tmdb.watch_providers.return_value = {"results": {"US": {
+        "flatrate": [{"provider_id": 8, "provider_name": "Netflix"}]}}}
+    ask(skill, "movie.year.intent", "movie number 7")
+    wait_for_answers(skill, 1)
+    with patch("ovos_skill_moviemaster.catalog.Provider") as provider:
+        provider.return_value.movie_providers.return_value = [
+            {"provider_id": 8, "provider_name": "Netflix"}]
+        # same session as the question about the year
+        session = {"session": {"session_id": "user movie number 7"}}
+        skill.bus.emit(Message(f"{SKILL_ID}:movie.providers.intent", {},
+                               session))
+        request, key, data = wait_for_answers(skill, 2)[1]
+    assert key == "movie.providers.stream.single"
+    assert data == {"movie": "Movie Number 7", "provider": "Netflix"}
+    skill.tmdb.watch_providers.assert_called_once_with(7)
+
+
+@pytest.mark.parametrize("utterance", ["where can I watch it",
+                                       "where is it streaming",
+                                       "where can I stream that movie"])
+def test_where_to_watch_it_as_the_intent_engine_hears_it(skill, utterance):
+    from padacioso import IntentContainer
+
+    with open(os.path.join(LOCALE, "en-us", "bundle.json")) as f:
+        intents = json.load(f)["intents"]
+    engine = IntentContainer()
+    for name, samples in intents.items():
+        engine.add_intent(name, samples)
+    match = engine.calc_intent(utterance)
+    assert match["name"] == "movie.providers.intent"
+
+    skill.settings["region"] = "us"
+    skill.tmdb.watch_providers.return_value = {"results": {"US": {
+        "flatrate": [{"provider_id": 8, "provider_name": "Netflix"}]}}}
+    ask(skill, "movie.year.intent", "movie number 7")
+    wait_for_answers(skill, 1)
+    with patch("ovos_skill_moviemaster.catalog.Provider") as provider:
+        provider.return_value.movie_providers.return_value = [
+            {"provider_id": 8, "provider_name": "Netflix"}]
+        skill.bus.emit(Message(
+            f"{SKILL_ID}:movie.providers.intent",
+            dict(match["entities"], utterance=utterance),
+            {"session": {"session_id": "user movie number 7"}}))
+        request, key, data = wait_for_answers(skill, 2)[1]
+    assert key == "movie.providers.stream.single"
+    assert data == {"movie": "Movie Number 7", "provider": "Netflix"}
+    # no search for a movie called "It"
+    assert skill.search.movies.call_count == 1
+
+
+def test_information_is_routed_by_what_the_name_is(skill):
+    skill.search.multi.return_value = [
+        {"media_type": "person", "id": 1, "name": "Movie Number 3",
+         "known_for": [{"title": "Movie Number 1"},
+                       {"name": "A Series"}]},
+        {"media_type": "tv", "id": 2, "name": "Movie Number 4",
+         "first_air_date": "2001-01-01"}]
+    ask(skill, "movie.information.intent", "movie number 3")
+    ask(skill, "movie.information.intent", "movie number 4")
+    answers = {request["movie"]: (key, data)
+               for request, key, data in wait_for_answers(skill, 2)}
+    assert answers["movie number 3"] == ("movie.info.person.multiple", {
+        "person": "Movie Number 3", "movielist": "Movie Number 1, ",
+        "lastmovie": "A Series"})
+    assert answers["movie number 4"] == ("movie.info.tv", {
+        "show": "Movie Number 4", "year": 2001})
+    # one request each, no separate movie or person search
+    assert skill.search.multi.call_count == 2
+    skill.search.movies.assert_not_called()
+
+
+def test_comparisons_look_both_movies_up_at_once(skill):
+    calls = []
+    # background work keeping every worker busy does not matter
+    busy = Event()
+    for _ in range(WORKERS):
+        skill._executor.submit(busy.wait, 5)
+
+    def slow_search(title, year=None):
+        start = time.monotonic()
+        time.sleep(0.1)
+        calls.append((start, time.monotonic()))
+        return [tmdb_movie(TITLES[title])]
+
+    skill.search.movies.side_effect = slow_search
+    skill.bus.emit(Message(f"{SKILL_ID}:movie.compare.length.intent",
+                           {"first": "movie number 3",
+                            "second": "movie number 12"}))
+    request, key, data = wait_for_answers(skill, 1)[0]
+    assert key == "movie.compare.length"
+    assert data == {"longer": "Movie Number 12", "longruntime": 102,
+                    "shorter": "Movie Number 3", "shortruntime": 93}
+    busy.set()
+    (start_a, end_a), (start_b, end_b) = calls
+    assert start_a < end_b and start_b < end_a
+
+
+def test_which_came_out_first(skill):
+    skill.bus.emit(Message(f"{SKILL_ID}:movie.compare.release.intent",
+                           {"first": "movie number 20",
+                            "second": "movie number 2"}))
+    request, key, data = wait_for_answers(skill, 1)[0]
+    assert key == "movie.compare.release"
+    assert data == {"earlier": "Movie Number 2", "earlieryear": 1952,
+                    "later": "Movie Number 20", "lateryear": 1970}
+
+
+def test_movies_two_people_played_in_together(skill):
+    people = {"actor 1": 1, "actor 2": 2}
+    skill.search.multi.side_effect = lambda name: [
+        {"media_type": "person", "id": people[name], "name": name.title()}]
+    filmographies = {1: [(10, 3.0), (11, 9.0), (12, 1.0)],
+                     2: [(12, 1.0), (10, 3.0), (13, 5.0)]}
+
+    with patch("ovos_skill_moviemaster.catalog.Person") as person:
+        person.return_value.movie_credits.side_effect = lambda person_id: {
+            "cast": [{"id": i, "title": f"Movie {i}", "popularity": p}
+                     for i, p in filmographies[person_id]]}
+        for count in (1, 2):
+            skill.bus.emit(Message(f"{SKILL_ID}:movie.costars.intent",
+                                   {"first": "actor 1", "second": "actor 2"}))
+            answers = wait_for_answers(skill, count)
+        # the second time everything is cached
+        assert person.return_value.movie_credits.call_count == 2
+    assert skill.search.multi.call_count == 2
+    for request, key, data in answers:
+        assert key == "movie.costars.multiple"
+        assert data == {"first": "Actor 1", "second": "Actor 2",
+                        "movielist": "Movie 10, ", "lastmovie": "Movie 12"}
+
+
+def test_sampled_interactions_are_traced(skill):
+    skill.tracer.sample_rate = 1
+    ask(skill, "movie.year.intent", "movie number 5")
+    wait_for_answers(skill, 1)
+    deadline = time.monotonic() + 5
+    while not os.path.exists(skill.tracer.path) and \
+            time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    with open(skill.tracer.path) as f:
+        spans = [json.loads(line) for line in f]
+    names = [s["name"] for s in spans]
+    assert names[0] == "handle_movie_year"
+    assert {"resolve", "search", "tmdb", "fuzzy_match", "cache"} <= set(names)
+    assert len({s["trace_id"] for s in spans}) == 1
+    tmdb = next(s for s in spans if s["name"] == "tmdb")
+    assert "movies" in tmdb["attributes"]["request"]
+    assert tmdb["attributes"]["args"] == ["movie number 5"]
+
+
+def test_profiling_is_switched_on_over_the_bus(skill):
+    reply = skill.bus.wait_for_response(
+        Message("ovos.moviemaster.profiling.set", {"sample_rate": 1}))
+    assert reply.data["sample_rate"] == 1
+    ask(skill, "movie.runtime.intent", "movie number 2")
+    wait_for_answers(skill, 1)
+    deadline = time.monotonic() + 5
+    while not skill.profiler.samples() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    reply = skill.bus.wait_for_response(
+        Message("ovos.moviemaster.profiling.get"))
+    assert reply.data["samples"] == {"handle_movie_length": 1}
+    stats = pstats.Stats(os.path.join(reply.data["directory"],
+                                      "handle_movie_length.pstats"))
+    # the TMDb requests, search() above, ran on the profiled thread
+    assert (__file__, search.__code__.co_firstlineno, "search") in stats.stats
+
+
+def test_caches_are_managed_over_the_bus(skill):
+    reply = skill.bus.wait_for_response(
+        Message("ovos.moviemaster.cache.warm",
+                {"titles": ["movie number 4", "a film nobody made"]}),
+        timeout=10)
+    assert reply.data == {
+        "warmed": [{"title": "movie number 4", "id": 4,
+                    "movie": "Movie Number 4"}],
+        "not_found": ["a film nobody made"], "failed": []}
+
+    ask(skill, "movie.runtime.intent", "movie number 4")
+    wait_for_answers(skill, 1)
+    reply = skill.bus.wait_for_response(
+        Message("ovos.moviemaster.cache.stats"))
+    assert reply.data["endpoints"]["titles"]["hits"] == 1
+    assert skill.search.movies.call_count == 2
+
+    reply = skill.bus.wait_for_response(
+        Message("ovos.moviemaster.cache.invalidate", {"movie_id": 4}))
+    # title and details, and recommendations if they were prefetched
+    assert reply.data["dropped"] >= 2
+    assert 4 not in skill.catalog.movies
+    reply = skill.bus.wait_for_response(
+        Message("ovos.moviemaster.cache.invalidate", {}))
+    assert "error" in reply.data
+
+    reply = skill.bus.wait_for_response(
+        Message("ovos.moviemaster.cache.compact"), timeout=10)
+    assert reply.data["memory"] == 0
+    assert os.path.exists(skill._snapshot_path)
+
+
+def test_a_failing_handler_still_answers_and_reports(skill):
+    errors = []
+    skill.bus.on("mycroft.skill.handler.error", errors.append)
+    skill.search.movies.side_effect = KeyError("results")
+    ask(skill, "movie.year.intent", "movie number 1")
+    request, key, data = wait_for_answers(skill, 1)[0]
+    assert key == "lookup.error"
+    deadline = time.monotonic() + 5
+    while not errors and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert errors[0].data == {"name": "MovieMaster.handle_movie_year",
+                              "exception": "KeyError('results')"}
+
+
+def test_gui_cards_do_not_hold_up_answers(skill):
+    checks = []
+
+    def connected(gui):
+        # no GUI attached, the check waits for a reply that never comes
+        checks.append(time.monotonic())
+        time.sleep(0.5)
+        return False
+
+    skill.search.movies.side_effect = lambda title, year=None: [
+        dict(tmdb_movie(TITLES[title]), poster_path="/poster.jpg")]
+    skill.settings["gui_cards"] = True
+    with patch.object(type(skill.gui), "connected", property(connected)):
+        for count, title in enumerate(("movie number 1", "movie number 2",
+                                       "movie number 3"), 1):
+            ask(skill, "movie.year.intent", title)
+            wait_for_answers(skill, count)
+        start = time.monotonic()
+        skill.bus.emit(Message(f"{SKILL_ID}:movie.compare.release.intent",
+                               {"first": "movie number 4",
+                                "second": "movie number 5"}))
+        wait_for_answers(skill, 4)
+        assert time.monotonic() - start < 0.5
+        time.sleep(0.6)
+    # asked once, then trusted
+    assert len(checks) == 1
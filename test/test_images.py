@@ -0,0 +1,75 @@
+# pylint: disable=missing-docstring
+import os
+import time
+from threading import Event
+from unittest.mock import MagicMock
+
+import pytest
+
+from ovos_skill_moviemaster.images import (BACKDROP_SIZES, POSTER_SIZES,
+                                           ImageCache, image_url)
+
+
+def test_image_url_picks_the_smallest_suitable_size():
+    assert image_url("/a.jpg", POSTER_SIZES, 300) == \
+        "https://image.tmdb.org/t/p/w342/a.jpg"
+    assert image_url("/a.jpg", POSTER_SIZES, 92) == \
+        "https://image.tmdb.org/t/p/w92/a.jpg"
+    assert image_url("/b.jpg", BACKDROP_SIZES, 4000) == \
+        "https://image.tmdb.org/t/p/w1280/b.jpg"
+
+
+class TestImageCache:
+    @pytest.fixture
+    def cache(self, tmp_path):
+        cache = ImageCache(str(tmp_path / "images"), budget=1000)
+        cache._session = MagicMock()
+        cache._session.get.side_effect = lambda url, timeout: MagicMock(
+            content=url.encode() * 100)
+        yield cache
+        cache.shutdown()
+
+    @staticmethod
+    def download(cache, url):
+        done = Event()
+        assert cache.fetch(url, callback=lambda path: done.set()) is None
+        assert done.wait(5)
+        return cache.get(url)
+
+    def test_downloads_in_the_background_once(self, cache):
+        path = self.download(cache, "https://x/a.jpg")
+        assert path.endswith(".jpg")
+        with open(path, "rb") as f:
+            assert f.read() == b"https://x/a.jpg" * 100
+        assert cache.fetch("https://x/a.jpg") == path
+        assert cache._session.get.call_count == 1
+
+    def test_same_content_is_stored_once(self, cache):
+        cache._session.get.side_effect = lambda url, timeout: MagicMock(
+            content=b"poster")
+        first = self.download(cache, "https://x/w342/a.jpg")
+        second = self.download(cache, "https://y/w342/a.jpg")
+        assert first == second
+        assert cache.size() == len(b"poster")
+
+    def test_least_recently_used_are_evicted(self, cache):
+        # each image is 1500 bytes, two of them fit
+        cache.budget = 3500
+        a = self.download(cache, "https://x/a.jpg")
+        time.sleep(0.01)
+        self.download(cache, "https://x/b.jpg")
+        time.sleep(0.01)
+        cache.get("https://x/a.jpg")
+        time.sleep(0.01)
+        self.download(cache, "https://x/c.jpg")
+        assert cache.get("https://x/b.jpg") is None
+        assert cache.get("https://x/a.jpg") == a
+        assert cache.size() <= cache.budget
+
+    def test_index_survives_a_restart(self, cache, tmp_path):
+        path = self.download(cache, "https://x/a.jpg")
+        again = ImageCache(str(tmp_path / "images"), budget=1000)
+        assert again.get("https://x/a.jpg") == path
+        os.remove(path)
+        assert ImageCache(str(tmp_path / "images"),
+                          budget=1000).get("https://x/a.jpg") is None
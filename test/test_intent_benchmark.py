@@ -0,0 +1,232 @@
+# pylint: disable=missing-docstring
+"""Intent matching benchmark over every shipped locale.
+
+Trains each intent engine on the precompiled bundle of a locale, then
+matches utterances made from the expanded templates of the intents the
+skill registers.  Reports training time, per utterance match latency and
+top-1 accuracy, and fails when a locale regresses against
+intent_benchmark_baseline.json.
+
+Wall clock timings differ from machine to machine, so latency is judged
+relative to a reference run: the same engine matching a fixed synthetic
+intent set in the same process.  The baseline keeps these ratios, with
+the raw timings and the environment they were taken in for reference.
+
+Matching is slow with some engines, so the benchmark only runs with
+INTENT_BENCHMARK=1.  Other knobs:
+    INTENT_ENGINE               only benchmark padatious or padacioso
+    INTENT_BENCHMARK_SAMPLES    utterances per intent (default 1)
+    INTENT_BENCHMARK_TOLERANCE  allowed growth of the p95 latency ratio
+                                (default 2.0)
+    INTENT_BENCHMARK_UPDATE=1   write the results as the new baseline
+"""
+import json
+import platform
+import re
+import statistics
+import time
+from importlib.metadata import PackageNotFoundError, version
+from os import getenv, listdir
+from os.path import dirname, isfile, join
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from ovos_skill_moviemaster import MovieMaster
+
+LOCALE = join(dirname(dirname(__file__)), "locale")
+BASELINE = join(dirname(__file__), "intent_benchmark_baseline.json")
+ENGINES = ["padacioso", "padatious"]
+ENTITY_VALUES = {"movie": "the matrix", "genre": "comedy"}
+# accuracy may drop this much below the baseline before failing
+ACCURACY_MARGIN = 0.05
+
+pytestmark = pytest.mark.skipif(getenv("INTENT_BENCHMARK") != "1",
+                                reason="set INTENT_BENCHMARK=1 to run")
+
+RESULTS = {}
+# engine -> median ms of the reference run
+REFERENCE_MS = {}
+# key of the baseline entry describing where it was measured
+ENVIRONMENT = "environment"
+
+
+def registered_intents():
+    """ The .intent files MovieMaster registers handlers for."""
+    return sorted(intent for method in vars(MovieMaster).values()
+                  for intent in getattr(method, "intents", [])
+                  if isinstance(intent, str) and intent.endswith(".intent"))
+
+
+def utterances(samples, count):
+    """ count evenly spread samples with their entities filled in."""
+    step = max(len(samples) // count, 1)
+    return [re.sub(r"\{(\w+)\}",
+                   lambda m: ENTITY_VALUES.get(m.group(1), "the matrix"), s)
+            for s in samples[::step][:count]]
+
+
+class Padacioso:
+    def __init__(self):
+        from padacioso import IntentContainer
+        self.container = IntentContainer()
+
+    def add_intent(self, name, samples):
+        self.container.add_intent(name, samples)
+
+    def train(self):
+        pass
+
+    def match(self, utterance):
+        """ (best intent name, True if another intent tied with it)"""
+        matches = [m for m in self.container.calc_intents(utterance)
+                   if m and m.get("name")]
+        if not matches:
+            return None, False
+        best = max(m["conf"] for m in matches)
+        ties = [m for m in matches if m["conf"] == best]
+        return ties[0]["name"], len(ties) > 1
+
+
+class Padatious:
+    def __init__(self):
+        from padatious import IntentContainer
+        self._cache = TemporaryDirectory()
+        self.container = IntentContainer(self._cache.name)
+
+    def add_intent(self, name, samples):
+        self.container.add_intent(name, samples)
+
+    def train(self):
+        self.container.train(single_thread=True)
+
+    def match(self, utterance):
+        match = self.container.calc_intent(utterance)
+        return match.name, False
+
+
+def load_engine(engine):
+    try:
+        return {"padacioso": Padacioso, "padatious": Padatious}[engine]()
+    except ImportError:
+        pytest.skip(f"{engine} is not installed")
+
+
+def reference_ms(engine):
+    """ Median ms per match of a fixed synthetic intent set, measured once
+    per engine and process, the yardstick for the latencies."""
+    if engine not in REFERENCE_MS:
+        container = load_engine(engine)
+        for i in range(8):
+            container.add_intent(
+                f"reference{i}.intent",
+                [f"{verb} the {thing} number {i} about {{movie}}"
+                 for verb in ("show", "tell", "find", "list", "play")
+                 for thing in ("film", "show", "cast", "story", "year")])
+        container.train()
+        latencies = []
+        for i in range(8):
+            start = time.perf_counter()
+            container.match(f"tell the story number {i} about the matrix")
+            latencies.append((time.perf_counter() - start) * 1000)
+        REFERENCE_MS[engine] = statistics.median(latencies)
+    return REFERENCE_MS[engine]
+
+
+def environment():
+    """ What the timings of a run were taken with."""
+    engines = {}
+    for engine in sorted({key.split("/")[0] for key in RESULTS}):
+        try:
+            engines[engine] = version(engine)
+        except PackageNotFoundError:
+            engines[engine] = None
+    return {"engines": engines, "python": platform.python_version(),
+            "platform": platform.platform(), "machine": platform.machine(),
+            "reference_ms": {e: round(ms, 2)
+                             for e, ms in sorted(REFERENCE_MS.items())}}
+
+
+def load_baseline():
+    if not isfile(BASELINE):
+        return {}
+    with open(BASELINE) as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def report():
+    yield
+    for key, result in sorted(RESULTS.items()):
+        print(f"\n{key}: train {result['train_ms']:.1f} ms, "
+              f"match p50 {result['p50_ms']:.1f} ms / "
+              f"p95 {result['p95_ms']:.1f} ms "
+              f"({result['p95_ratio']:.2f}x reference), "
+              f"top-1 {result['accuracy']:.2%} "
+              f"({result['ties']} ties, {result['utterances']} utterances)")
+    if RESULTS and getenv("INTENT_BENCHMARK_UPDATE") == "1":
+        baseline = load_baseline()
+        baseline.update(RESULTS)
+        baseline[ENVIRONMENT] = environment()
+        with open(BASELINE, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+
+@pytest.mark.parametrize("lang", sorted(listdir(LOCALE)))
+@pytest.mark.parametrize("engine", ENGINES)
+def test_intent_matching(engine, lang):
+    if getenv("INTENT_ENGINE") and getenv("INTENT_ENGINE") != engine:
+        pytest.skip(f"INTENT_ENGINE is {getenv('INTENT_ENGINE')}")
+    with open(join(LOCALE, lang, "bundle.json")) as f:
+        intents = {name: samples
+                   for name, samples in json.load(f)["intents"].items()
+                   if name in registered_intents()}
+    count = int(getenv("INTENT_BENCHMARK_SAMPLES", "1"))
+
+    container = load_engine(engine)
+    start = time.perf_counter()
+    for name, samples in intents.items():
+        container.add_intent(name, samples)
+    container.train()
+    train_ms = (time.perf_counter() - start) * 1000
+
+    latencies = []
+    correct = ties = total = 0
+    for name, samples in intents.items():
+        for utterance in utterances(samples, count):
+            start = time.perf_counter()
+            matched, tied = container.match(utterance)
+            latencies.append((time.perf_counter() - start) * 1000)
+            total += 1
+            ties += tied
+            # a tie is a coin flip, it does not count as a hit
+            correct += matched == name and not tied
+
+    latencies.sort()
+    reference = reference_ms(engine)
+    p50 = statistics.median(latencies)
+    p95 = latencies[int(0.95 * (len(latencies) - 1))]
+    result = {
+        "train_ms": round(train_ms, 1),
+        "p50_ms": round(p50, 1),
+        "p95_ms": round(p95, 1),
+        "p50_ratio": round(p50 / reference, 3),
+        "p95_ratio": round(p95 / reference, 3),
+        "accuracy": round(correct / total, 4),
+        "ties": ties,
+        "utterances": total,
+    }
+    key = f"{engine}/{lang}"
+    RESULTS[key] = result
+
+    expected = load_baseline().get(key)
+    if expected and getenv("INTENT_BENCHMARK_UPDATE") != "1":
+        tolerance = float(getenv("INTENT_BENCHMARK_TOLERANCE", "2.0"))
+        assert result["accuracy"] >= expected["accuracy"] - ACCURACY_MARGIN, \
+            f"{key} top-1 accuracy fell from {expected['accuracy']:.2%}"
+        # baselines from before the reference run only gate accuracy
+        if "p95_ratio" in expected:
+            assert result["p95_ratio"] <= expected["p95_ratio"] * tolerance, \
+                f"{key} p95 latency grew from {expected['p95_ratio']:.2f} " \
+                f"to {result['p95_ratio']:.2f} times the reference run"
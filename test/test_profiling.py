@@ -0,0 +1,52 @@
+# pylint: disable=missing-docstring
+import pstats
+from threading import Event, Thread
+
+from ovos_skill_moviemaster.profiling import Profiler
+
+
+def fuzzy_loop():
+    return sum(i * i for i in range(1000))
+
+
+def test_off_by_default(tmp_path):
+    profiler = Profiler(str(tmp_path / "profiles"))
+    with profiler.profile("handle_movie_year"):
+        fuzzy_loop()
+    assert not profiler.enabled
+    assert profiler.samples() == {}
+    assert not (tmp_path / "profiles").exists()
+
+
+def test_profiles_are_added_up_per_intent(tmp_path):
+    profiler = Profiler(str(tmp_path / "profiles"), sample_rate=1)
+    for _ in range(3):
+        with profiler.profile("handle_movie_year"):
+            fuzzy_loop()
+    with profiler.profile("handle_movie_cast"):
+        pass
+    assert profiler.samples() == {"handle_movie_year": 3,
+                                  "handle_movie_cast": 1}
+    stats = pstats.Stats(str(tmp_path / "profiles" /
+                             "handle_movie_year.pstats"))
+    calls = {func[2]: counts[1] for func, counts in stats.stats.items()}
+    assert calls["fuzzy_loop"] == 3
+
+
+def test_overlapping_runs_are_skipped(tmp_path):
+    profiler = Profiler(str(tmp_path / "profiles"), sample_rate=1)
+    started, release = Event(), Event()
+
+    def slow_handler():
+        with profiler.profile("handle_movie_cast"):
+            started.set()
+            release.wait(5)
+
+    thread = Thread(target=slow_handler)
+    thread.start()
+    started.wait(5)
+    with profiler.profile("handle_movie_year"):
+        fuzzy_loop()
+    release.set()
+    thread.join()
+    assert profiler.samples() == {"handle_movie_cast": 1}
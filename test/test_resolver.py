@@ -0,0 +1,50 @@
+# pylint: disable=missing-docstring
+from types import SimpleNamespace
+
+import pytest
+
+from ovos_skill_moviemaster.resolver import extract_year, rank_candidates
+
+PREFIXES = ["the", "from", "made in"]
+SUFFIXES = ["version", "version of", "remake of"]
+
+
+def movie(title, release_date="", popularity=0.0):
+    return SimpleNamespace(title=title, release_date=release_date,
+                           popularity=popularity)
+
+
+class TestExtractYear:
+    @pytest.mark.parametrize("phrase, expected", [
+        ("the 1976 version of king kong", ("king kong", 1976)),
+        ("king kong from 1933", ("king kong", 1933)),
+        ("King Kong (2005)", ("King Kong", 2005)),
+        ("the 1982 remake of the thing", ("the thing", 1982)),
+    ])
+    def test_year_qualifiers(self, phrase, expected):
+        assert extract_year(phrase, PREFIXES, SUFFIXES) == expected
+
+    @pytest.mark.parametrize("phrase", [
+        "king kong", "1917", "blade runner 2049"])
+    def test_no_qualifier(self, phrase):
+        assert extract_year(phrase, PREFIXES, SUFFIXES) == (phrase, None)
+
+
+class TestRankCandidates:
+    def test_filters_on_confidence(self):
+        ranked = rank_candidates([movie("Stripes"), movie("Heat")],
+                                 "stripes", 0.8)
+        assert [m.title for m, _ in ranked] == ["Stripes"]
+
+    def test_popularity_breaks_title_ties(self):
+        candidates = [movie("King Kong", "1976-12-17", 20.0),
+                      movie("King Kong", "2005-12-14", 60.0),
+                      movie("King Kong", "1933-03-07", 25.0)]
+        ranked = rank_candidates(candidates, "king kong", 0.8)
+        assert ranked[0][0].release_date == "2005-12-14"
+
+    def test_title_match_beats_priors(self):
+        candidates = [movie("King Kong Lives", "1986-12-19", 500.0),
+                      movie("King Kong", "1933-03-07", 5.0)]
+        ranked = rank_candidates(candidates, "king kong", 0.7)
+        assert ranked[0][0].title == "King Kong"
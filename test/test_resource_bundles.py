@@ -0,0 +1,46 @@
+# pylint: disable=missing-docstring
+from os import listdir
+from os.path import dirname, join
+
+import pytest
+
+from ovos_skill_moviemaster.bundle import (ResourceBundle, build_bundle,
+                                           read_lines, source_hash)
+
+LOCALE = join(dirname(dirname(__file__)), "locale")
+LANGS = sorted(listdir(LOCALE))
+
+
+@pytest.mark.parametrize("lang", LANGS)
+def test_bundle_is_up_to_date(lang):
+    bundle = ResourceBundle.load(join(LOCALE, lang))
+    assert bundle is not None, "run scripts/build_resource_bundles.py"
+    assert bundle.hash == source_hash(join(LOCALE, lang)), \
+        "run scripts/build_resource_bundles.py"
+
+
+@pytest.mark.parametrize("lang", LANGS)
+def test_bundle_is_valid(lang):
+    _, problems = build_bundle(join(LOCALE, lang), lang)
+    assert problems == []
+
+
+def test_bundle_expands_and_dedupes_templates(tmp_path):
+    (tmp_path / "vocab").mkdir()
+    (tmp_path / "vocab" / "test.intent").write_text(
+        "# comment\nwho (acts|is) in {movie}\nwho is in {movie}\n")
+    (tmp_path / "test.dialog").write_text("Here is {{movie}}\n")
+    bundle, problems = build_bundle(str(tmp_path), "en-us")
+    assert problems == []
+    assert sorted(bundle["intents"]["test.intent"]) == [
+        "who acts in {movie}", "who is in {movie}"]
+    assert bundle["dialogs"]["test"] == ["Here is {movie}"]
+    assert read_lines(str(tmp_path / "test.dialog")) == ["Here is {{movie}}"]
+
+
+def test_intent_file_holds_the_expanded_samples(tmp_path):
+    bundle = ResourceBundle.load(join(LOCALE, "en-us"))
+    path = bundle.intent_file("movie.cast.intent", str(tmp_path))
+    assert path == join(str(tmp_path), bundle.hash, "movie.cast.intent")
+    assert read_lines(path) == bundle.intent("movie.cast.intent")
+    assert bundle.intent_file("missing.intent", str(tmp_path)) is None
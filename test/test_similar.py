@@ -0,0 +1,51 @@
+# pylint: disable=missing-docstring
+import time
+
+from ovos_skill_moviemaster.records import MovieRecord
+from ovos_skill_moviemaster.similar import SimilarityIndex
+
+
+def movie(movie_id, genres=(), keyword_ids=None):
+    return MovieRecord(movie_id, f"Movie {movie_id}", genres=genres,
+                       keyword_ids=keyword_ids)
+
+
+HEIST = movie(1, ("Crime", "Thriller"), (10, 11))
+CASINO = movie(2, ("Crime", "Drama"), (10, 12))
+HEAT = movie(3, ("Crime", "Thriller"), (10, 11, 13))
+TOY_STORY = movie(4, ("Animation", "Family"), (20,))
+NO_FEATURES = movie(5)
+
+
+def test_most_similar_first():
+    index = SimilarityIndex([HEIST, CASINO, HEAT, TOY_STORY, NO_FEATURES])
+    assert len(index) == 4
+    [similar] = index.top_k([HEIST], 10)
+    assert [m for m, _ in similar] == [HEAT, CASINO]
+    assert similar[0][1] > similar[1][1] > 0
+
+
+def test_batches_and_unknown_movies():
+    index = SimilarityIndex([HEIST, CASINO, HEAT, TOY_STORY])
+    unknown = movie(9, ("Family",), (20, 99))
+    heat, toy_story, nothing = index.top_k([HEAT, unknown, NO_FEATURES], 1)
+    assert [m for m, _ in heat] == [HEIST]
+    assert [m for m, _ in toy_story] == [TOY_STORY]
+    assert nothing == []
+
+
+def test_empty_index():
+    assert SimilarityIndex().top_k([HEIST], 5) == [[]]
+
+
+def test_top_k_of_a_full_cache_is_fast():
+    records = [movie(i, (f"genre {i % 19}", f"genre {i % 7}"),
+                     tuple(range(i % 50, i % 50 + 20)))
+               for i in range(256)]
+    index = SimilarityIndex(records)
+    start = time.perf_counter()
+    for _ in range(100):
+        index.top_k(records[:1], 5)
+    per_query = (time.perf_counter() - start) / 100
+    print(f"\ntop 5 of 256 cached movies in {per_query * 1e6:.0f} µs")
+    assert per_query < 0.005
@@ -53,6 +53,17 @@ class TestMovieMasterSkill:
     def test_nada(self, test_skill):
         assert True
 
+    def test_intents_registered_from_bundle(self, test_skill):
+        registered = dict(test_skill.intent_service.registered_intents)
+        samples = registered["movie.cast.intent"]["samples"]
+        assert "who acts in the movie {movie}" in samples
+        assert len(samples) == len(set(samples))
+
+    def test_dialogs_loaded_from_bundle(self, test_skill):
+        templates = test_skill.dialog_renderer.templates
+        assert "movie.cast" in templates
+        assert test_skill.voc_list("year.suffix")
+
 def test_skill_is_a_valid_plugin():
     assert "ovos-skill-moviemaster.builderjer" in find_skill_plugins()
 
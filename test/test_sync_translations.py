@@ -0,0 +1,69 @@
+# pylint: disable=missing-docstring
+import json
+import os
+import sys
+from os.path import dirname, join
+
+import pytest
+
+sys.path.insert(0, join(dirname(dirname(__file__)), "scripts"))
+import sync_translations  # noqa: E402
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    locale, tx = tmp_path / "locale", tmp_path / "translations"
+    (tx / "de-de").mkdir(parents=True)
+    (tx / "de-de" / "intents.json").write_text(json.dumps({
+        "vocab/movie.cast.intent": ["wer spielt in {movie}",
+                                    "[UNUSED]", None],
+        "vocab/movie.year.intent": ["wann kam {movie} heraus"],
+        "vocab/movie.runtime.intent": []}))
+    (tx / "de-de" / "dialogs.json").write_text(json.dumps({
+        "/dialog/movie.year.dialog": ["{movie} kam {year} heraus"]}))
+    monkeypatch.setattr(sync_translations, "locale", str(locale))
+    monkeypatch.setattr(sync_translations, "tx", str(tx))
+    return locale
+
+
+def test_new_files_are_created(tree):
+    report = sync_translations.sync_lang("de-de")
+    assert sorted(os.path.relpath(p, tree) for p in report["created"]) == [
+        "de-de/dialog/movie.year.dialog", "de-de/vocab/movie.cast.intent",
+        "de-de/vocab/movie.year.intent"]
+    assert (tree / "de-de" / "vocab" / "movie.cast.intent").read_text() == \
+        "wer spielt in {movie}"
+
+
+def test_unchanged_files_are_not_written(tree):
+    sync_translations.sync_lang("de-de")
+    path = tree / "de-de" / "vocab" / "movie.year.intent"
+    os.utime(path, (0, 0))
+    report = sync_translations.sync_lang("de-de")
+    assert report["created"] == report["updated"] == []
+    assert report["unchanged"] == 3
+    assert path.stat().st_mtime == 0
+
+
+def test_changed_files_are_updated(tree):
+    sync_translations.sync_lang("de-de")
+    path = tree / "de-de" / "vocab" / "movie.year.intent"
+    path.write_text("veraltet")
+    report = sync_translations.sync_lang("de-de")
+    assert report["updated"] == [str(path)]
+    assert path.read_text() == "wann kam {movie} heraus"
+
+
+def test_dry_run_writes_nothing(tree):
+    report = sync_translations.sync_lang("de-de", dry_run=True)
+    assert len(report["created"]) == 3
+    assert not tree.exists()
+
+
+def test_bundles_are_skipped_without_the_build_dependencies(
+        tree, monkeypatch, capsys):
+    # importing the bundle builder fails like it does without ovos-utils
+    monkeypatch.setitem(sys.modules, "build_resource_bundles", None)
+    assert sync_translations.main() == ["de-de"]
+    assert "not rebuilding the resource bundles" in capsys.readouterr().out
+    assert (tree / "de-de" / "vocab" / "movie.cast.intent").exists()
@@ -0,0 +1,84 @@
+# pylint: disable=missing-docstring
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ovos_skill_moviemaster.tracing import (Tracer, activate, current_span,
+                                            span, traced)
+
+
+def read(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+class Catalog:
+    @traced("lookup")
+    def lookup(self, title, year=None):
+        with span("tmdb", request="Search.movies"):
+            return title * 100
+
+
+def test_spans_of_an_interaction(tmp_path):
+    tracer = Tracer(str(tmp_path / "traces.jsonl"), sample_rate=1)
+    with tracer.trace("handle_movie_year", session="kitchen"):
+        Catalog().lookup("heat", year=1995)
+        parent = current_span()
+        with ThreadPoolExecutor(1) as pool:
+            def work():
+                with activate(parent), span("worker"):
+                    pass
+            pool.submit(work).result()
+    spans = {s["name"]: s for s in read(tracer.path)}
+    assert set(spans) == {"handle_movie_year", "lookup", "tmdb", "worker"}
+    assert len({s["trace_id"] for s in spans.values()}) == 1
+    root = spans["handle_movie_year"]
+    assert root["parent_id"] is None
+    assert root["attributes"] == {"session": "kitchen"}
+    assert spans["lookup"]["parent_id"] == root["span_id"]
+    assert spans["tmdb"]["parent_id"] == spans["lookup"]["span_id"]
+    assert spans["worker"]["parent_id"] == root["span_id"]
+    assert spans["lookup"]["attributes"] == {"args": ["heat"], "year": 1995}
+    assert spans["worker"]["thread"] != root["thread"]
+    assert root["duration_ms"] >= spans["lookup"]["duration_ms"]
+
+
+def test_errors_and_long_arguments(tmp_path):
+    tracer = Tracer(str(tmp_path / "traces.jsonl"), sample_rate=1)
+    with pytest.raises(KeyError):
+        with tracer.trace("handler"):
+            Catalog().lookup("x" * 1000)
+            with span("cache"):
+                raise KeyError("movies")
+    spans = {s["name"]: s for s in read(tracer.path)}
+    assert spans["cache"]["attributes"]["error"] == "KeyError"
+    assert spans["handler"]["attributes"]["error"] == "KeyError"
+    assert len(spans["lookup"]["attributes"]["args"][0]) == 80
+
+
+def test_sampling_keeps_slow_interactions(tmp_path):
+    tracer = Tracer(str(tmp_path / "traces.jsonl"), sample_rate=0, slow=0.05)
+    with tracer.trace("fast"):
+        pass
+    assert not (tmp_path / "traces.jsonl").exists()
+    tracer.slow = 0
+    with tracer.trace("slow"):
+        pass
+    assert [s["name"] for s in read(tracer.path)] == ["slow"]
+
+
+def test_outside_of_a_trace_nothing_is_recorded():
+    with span("cache") as nothing:
+        assert nothing is None
+    assert Catalog().lookup("heat") == "heat" * 100
+
+
+def test_file_is_rotated(tmp_path):
+    tracer = Tracer(str(tmp_path / "traces.jsonl"), sample_rate=1,
+                    max_bytes=100)
+    for _ in range(3):
+        with tracer.trace("handler"):
+            pass
+    assert (tmp_path / "traces.jsonl.1").exists()
+    assert len(read(tracer.path)) == 1
@@ -0,0 +1,172 @@
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock, current_thread, local
+from uuid import uuid4
+
+from ovos_utils.log import LOG
+
+_current = local()
+
+
+class Span:
+    """ One timed step of a traced interaction."""
+    __slots__ = ("trace", "id", "parent_id", "name", "start", "duration",
+                 "thread", "attributes")
+
+    def __init__(self, trace, name, parent_id=None, attributes=None):
+        self.trace = trace
+        self.id = uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time()
+        self.duration = None
+        self.thread = current_thread().name
+        self.attributes = attributes or {}
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_json(self):
+        return {"trace_id": self.trace.id, "span_id": self.id,
+                "parent_id": self.parent_id, "name": self.name,
+                "start": round(self.start, 6),
+                "duration_ms": round(self.duration * 1000, 3),
+                "thread": self.thread, "attributes": self.attributes}
+
+
+class Trace:
+    """ The spans of one interaction, collected from any thread."""
+
+    def __init__(self):
+        self.id = uuid4().hex
+        self.spans = []
+        self._lock = Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+
+def current_span():
+    """ Span running on this thread, or None outside of a trace."""
+    return getattr(_current, "span", None)
+
+
+@contextmanager
+def activate(span):
+    """ Make span the parent of the spans started on this thread, so work
+    handed to another thread ends up in the same trace."""
+    previous = current_span()
+    _current.span = span
+    try:
+        yield span
+    finally:
+        _current.span = previous
+
+
+@contextmanager
+def span(name, **attributes):
+    """ Time the body as a child of the current span.
+
+    Outside of a trace nothing is recorded and None is yielded.
+    """
+    parent = current_span()
+    if parent is None:
+        yield None
+        return
+    child = Span(parent.trace, name, parent.id, attributes)
+    start = time.perf_counter()
+    try:
+        with activate(child):
+            yield child
+    except BaseException as e:
+        child.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        child.duration = time.perf_counter() - start
+        parent.trace.add(child)
+
+
+class Tracer:
+    """ Writes the traces of sampled interactions to a JSON lines file.
+
+    Every interaction is traced in memory, which costs a few small objects
+    per step.  It is written, one line per span, when it is picked by the
+    sample rate or when it took longer than slow seconds, so a slow answer
+    can always be reconstructed afterwards.
+
+    The file is moved to path.1 once it grows past max_bytes.
+    """
+
+    def __init__(self, path, sample_rate=0.1, slow=2.0,
+                 max_bytes=5 * 1024 * 1024):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.slow = slow
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+
+    @contextmanager
+    def trace(self, name, **attributes):
+        """ Trace the body as an interaction, yields its root span."""
+        if current_span() is not None:
+            # already part of a trace
+            with span(name, **attributes) as child:
+                yield child
+            return
+        root = Span(Trace(), name, attributes=attributes)
+        start = time.perf_counter()
+        try:
+            with activate(root):
+                yield root
+        except BaseException as e:
+            root.attributes["error"] = type(e).__name__
+            raise
+        finally:
+            root.duration = time.perf_counter() - start
+            root.trace.add(root)
+            if root.duration >= self.slow or \
+                    random.random() < self.sample_rate:
+                self._write(root.trace)
+
+    def _write(self, trace):
+        lines = "".join(json.dumps(s.to_json(), default=str) + "\n"
+                        for s in sorted(trace.spans, key=lambda s: s.start))
+        with self._lock:
+            try:
+                if os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, f"{self.path}.1")
+            except OSError:
+                pass
+            try:
+                with open(self.path, "a") as f:
+                    f.write(lines)
+            except OSError as e:
+                LOG.warning(f"Could not write trace {trace.id}: {e}")
+
+
+def traced(name):
+    """ Decorator running a method as a span, with its arguments, cut
+    short, as attributes."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if current_span() is None:
+                return func(self, *args, **kwargs)
+            with span(name, args=[_short(a) for a in args],
+                      **{k: _short(v) for k, v in kwargs.items()}):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _short(value, limit=80):
+    """ Something small enough to describe a value in a span."""
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    text = value if isinstance(value, str) else repr(value)
+    return text if len(text) <= limit else text[:limit - 3] + "..."